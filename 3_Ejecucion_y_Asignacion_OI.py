@@ -1,20 +1,79 @@
+import datetime
 import streamlit as st
-from database import get_db
+import pandas as pd
+from sqlalchemy.orm import joinedload
+from database import page_db
 from models import Quote, OI, Mall
 from auth import require_role
+from services import transition_quote, bulk_transition_quotes, QuoteConflictError, InvalidTransitionError
+from services import oi_available_budget, rank_ois_for_quote, plan_oi_assignments
+from ui import seen_version, show_conflict
+from money import to_cents, from_cents
 
 require_role(["ADMIN", "AUTORIZADO"])
-db = next(get_db())
+db = page_db()
 
 st.title("🚀 Asignación de OI y Ejecución")
 st.markdown("Aquí conviertes una **Cotización Aprobada** en una actividad **Ejecutada**, asignándole la cuenta (OI) que pagará.")
 
-# 1. Buscar Cotizaciones Aprobadas (Pendientes de Ejecución)
-pending_execution = db.query(Quote).filter(Quote.status == "APROBADA").all()
+# 1. Buscar Cotizaciones Aprobadas (Pendientes de Ejecución) + saldo de todas las OIs (una consulta)
+pending_execution = (
+    db.query(Quote)
+    .options(joinedload(Quote.creator), joinedload(Quote.mall))
+    .filter(Quote.status == "APROBADA")
+    .all()
+)
+
+def oi_label(budget, cost_usd):
+    fits = "✅" if budget["available"] >= to_cents(cost_usd) else "⚠️ no alcanza"
+    return f"{budget['oi'].oi_code} - {budget['oi'].oi_name} · Disp: ${from_cents(budget['available']):,.2f} {fits}"
+
+def execute_quote(q, oi, version):
+    # Si no tenía Mall, le asignamos el de la OI (solo si nadie la cambió mientras tanto)
+    transition_quote(
+        db, q.id, "EJECUTADA", expected_version=version,
+        oi_id=oi.id,
+        mall_id=q.mall_id or oi.mall_id
+    )
+
+result = st.session_state.pop("bulk_exec_result", None)
+if result:
+    if result["applied"]:
+        st.success(f"✅ {result['applied']} actividad(es) ejecutadas.")
+    if result["skipped"]:
+        st.warning(f"⚠️ {len(result['skipped'])} no se procesaron:")
+        st.dataframe(pd.DataFrame(result["skipped"]), use_container_width=True, hide_index=True)
 
 if not pending_execution:
     st.info("🎉 No hay cotizaciones pendientes de ejecución.")
 else:
+    budgets = oi_available_budget(db, datetime.date.today().year)
+    versions = {q.id: seen_version(q) for q in pending_execution}
+
+    # --- ASIGNACIÓN MASIVA (RECOMENDADA) ---
+    plan = plan_oi_assignments(pending_execution, budgets)
+    with st.expander(f"⚡ Asignación masiva recomendada ({sum(1 for oi in plan.values() if oi)} de {len(plan)})"):
+        st.caption("Cada actividad va a la OI de su mall con saldo suficiente y menor sobrante, de la más cara a la más barata.")
+        st.dataframe(pd.DataFrame([{
+            "ID": q.id, "Actividad": q.activity_name, "Total USD": q.total_cost_usd,
+            "OI Recomendada": f"{plan[q.id].oi_code} - {plan[q.id].oi_name}" if plan[q.id] else "⚠️ Sin OI con saldo"
+        } for q in pending_execution]).style.format({"Total USD": "${:,.2f}"}), use_container_width=True, hide_index=True)
+
+        if st.button("🚀 Ejecutar todas las recomendadas", type="primary"):
+            # Un solo UPDATE: cada actividad con su OI (y el mall de la OI si no tenía)
+            targets = [q for q in pending_execution if plan[q.id]]
+            applied, skipped = bulk_transition_quotes(
+                db, {q.id: versions[q.id] for q in targets}, "EJECUTADA",
+                per_quote={q.id: {"oi_id": plan[q.id].id, "mall_id": q.mall_id or plan[q.id].mall_id} for q in targets}
+            )
+            st.session_state["bulk_exec_result"] = {
+                "applied": len(applied),
+                "skipped": [
+                    {"ID": q.id, "Actividad": q.activity_name, "Motivo": skipped[q.id]} for q in targets if q.id in skipped
+                ],
+            }
+            st.rerun()
+
     for q in pending_execution:
         with st.expander(f"📌 #{q.id}: {q.activity_name} | Total: ${q.total_cost_usd:,.2f}", expanded=True):
             col1, col2 = st.columns([2, 1])
@@ -28,31 +87,26 @@ else:
                 # Lógica para asignar OI
                 st.write("### Asignar Cuenta (OI)")
                 
-                # Filtramos las OIs. Si la cotización ya tenía Mall, mostramos OIs de ese Mall.
-                if q.mall_id:
-                    ois_available = db.query(OI).filter(OI.mall_id == q.mall_id, OI.is_active==True).all()
-                else:
-                    ois_available = db.query(OI).filter(OI.is_active==True).all()
+                # OIs del Mall de la cotización (o todas), la recomendada primero
+                ois_available = rank_ois_for_quote(q, budgets)
                 
                 if not ois_available:
                     st.error("No hay OIs disponibles para este Mall.")
                 else:
                     # Selectbox para elegir la OI
-                    selected_oi = st.selectbox(
+                    selected = st.selectbox(
                         f"Selecciona OI para #{q.id}", 
                         ois_available, 
-                        format_func=lambda x: f"{x.oi_code} - {x.oi_name}",
+                        format_func=lambda b, cost=q.total_cost_usd: oi_label(b, cost or 0.0),
                         key=f"sel_oi_{q.id}"
                     )
+                    selected_oi = selected["oi"]
                     
                     if st.button(f"✅ CONFIRMAR EJECUCIÓN #{q.id}", type="primary"):
-                        # Actualizamos la cotización
-                        q.oi_id = selected_oi.id
-                        q.status = "EJECUTADA"
-                        # Si no tenía Mall, le asignamos el de la OI
-                        if not q.mall_id:
-                            q.mall_id = selected_oi.mall_id
-                            
-                        db.commit()
-                        st.success(f"Actividad #{q.id} ejecutada y asignada a OI {selected_oi.oi_code}")
-                        st.rerun()
\ No newline at end of file
+                        try:
+                            execute_quote(q, selected_oi, versions[q.id])
+                        except (QuoteConflictError, InvalidTransitionError) as e:
+                            show_conflict(e)
+                        else:
+                            st.success(f"Actividad #{q.id} ejecutada y asignada a OI {selected_oi.oi_code}")
+                            st.rerun()
@@ -0,0 +1,293 @@
+import pandas as pd
+from sqlalchemy import func, case, type_coerce, Integer, Float
+from sqlalchemy.orm import Session
+from models import Expense, Mall, OI, Quote, ActivityType, Proveedor
+from money import to_cents, from_cents
+
+# ==============================================================================
+# DATOS PARA GRÁFICAS DEL DASHBOARD
+# ==============================================================================
+# Las gráficas reciben datos ya agregados en el servidor: el navegador nunca
+# recibe una fila por OI. El tamaño del payload (y el tiempo de render) queda
+# acotado aunque existan miles de OIs.
+
+CHART_TOP_N = 15           # OIs mostradas individualmente
+CHART_MAX_OTHER_GROUPS = 8 # Grupos "Otras" por mall; el resto se junta en uno solo
+
+OI_CHART_RANKINGS = {
+    "Mayor gasto": lambda df: df["real_cents"],
+    "Mayor desvío": lambda df: (df["real_cents"] - df["budget_cents"]).abs(),
+}
+
+def _with_cents(df):
+    df = df.copy()
+    df["budget_cents"] = to_cents(df["budget_usd"].fillna(0).to_numpy())
+    df["real_cents"] = to_cents(df["real_usd"].fillna(0).to_numpy())
+    return df
+
+def _finish(rows):
+    # Pasa a formato largo (2 barras por etiqueta) y regresa los montos a USD
+    rows = rows.drop(columns=["budget_usd", "real_usd"], errors="ignore").rename(
+        columns={"budget_cents": "budget_usd", "real_cents": "real_usd"}
+    )
+    rows["budget_usd"] = from_cents(rows["budget_usd"].to_numpy())
+    rows["real_usd"] = from_cents(rows["real_usd"].to_numpy())
+    return rows[["Etiqueta", "Mall", "Grupo", "OIs", "budget_usd", "real_usd"]].melt(
+        ["Etiqueta", "Mall", "Grupo", "OIs"], var_name="Tipo", value_name="Monto USD"
+    )
+
+def oi_chart_data(df, top_n=CHART_TOP_N, rank_by="Mayor gasto", mall=None):
+    # df: una fila por OI con columnas OI, Mall, budget_usd, real_usd.
+    # Devuelve las top_n OIs + un grupo "Otras" por mall (o uno solo si se
+    # hace drill-down a un mall). Máximo top_n + CHART_MAX_OTHER_GROUPS + 1 barras.
+    df = _with_cents(df)
+    if mall is not None:
+        df = df[df["Mall"] == mall]
+    if df.empty:
+        return _finish(df.assign(Etiqueta=[], Grupo=[], OIs=[]))
+
+    top_index = OI_CHART_RANKINGS[rank_by](df).nlargest(top_n).index # nlargest ya viene ordenado
+    top = df.loc[top_index].assign(
+        Etiqueta=lambda d: d["OI"] + " (" + d["Mall"] + ")", Grupo="OI", OIs=1
+    )
+
+    rest = df.drop(top_index)
+    if rest.empty:
+        return _finish(top)
+
+    # Agregación entera (centavos) de lo que no entró al top, por mall
+    others = rest.groupby("Mall", as_index=False).agg(
+        budget_cents=("budget_cents", "sum"), real_cents=("real_cents", "sum"), OIs=("OI", "count")
+    )
+    others = others.loc[OI_CHART_RANKINGS[rank_by](others).sort_values(ascending=False).index]
+    if len(others) > CHART_MAX_OTHER_GROUPS:
+        tail = others.iloc[CHART_MAX_OTHER_GROUPS:]
+        others = pd.concat([
+            others.iloc[:CHART_MAX_OTHER_GROUPS],
+            pd.DataFrame([{
+                "Mall": "Varios", "budget_cents": tail["budget_cents"].sum(),
+                "real_cents": tail["real_cents"].sum(), "OIs": tail["OIs"].sum()
+            }])
+        ], ignore_index=True)
+    others = others.assign(
+        Etiqueta=lambda d: "Otras " + d["Mall"] + " (" + d["OIs"].astype(str) + " OIs)", Grupo="Otras"
+    )
+    return _finish(pd.concat([top, others], ignore_index=True))
+
+
+# ==============================================================================
+# GASTO MENSUAL (SERIES DE TIEMPO Y MAPA DE CALOR)
+# ==============================================================================
+# Una sola consulta agrupada (año, mes, mall, OI, categoría, tipo) trae el
+# gasto ya sumado por la BD; cada vista (por mall, por OI, ...) es un pivot de
+# pandas sobre ese resultado pequeño, sin volver a consultar.
+
+MONTHLY_DIMENSIONS = {
+    "Mall": "Mall",
+    "OI": "OI",
+    "Categoría": "Categoria",
+    "Tipo de Actividad": "Tipo",
+}
+MONTHLY_MAX_SERIES = 8 # Líneas por gráfica; el resto se suma en "Otros"
+
+def monthly_spend(db: Session, start_year, end_year, mall_ids=None, type_ids=None, quote_ids=None):
+    q = (
+        db.query(
+            Expense.year, Expense.month,
+            func.coalesce(Mall.name, "N/A").label("Mall"),
+            func.coalesce(OI.oi_code, "N/A").label("OI"),
+            func.coalesce(Expense.category, "N/A").label("Categoria"),
+            func.coalesce(ActivityType.name, "N/A").label("Tipo"),
+            func.coalesce(func.sum(Expense.amount_usd), 0).label("usd"),
+            func.count(Expense.id).label("gastos"),
+        )
+        .outerjoin(Mall, Expense.mall_id == Mall.id)
+        .outerjoin(OI, Expense.oi_id == OI.id)
+        .outerjoin(Quote, Expense.quote_id == Quote.id)
+        .outerjoin(ActivityType, Quote.activity_type_id == ActivityType.id)
+        .filter(Expense.year >= start_year, Expense.year <= end_year)
+    )
+    if mall_ids:
+        q = q.filter(Expense.mall_id.in_(mall_ids))
+    if type_ids:
+        q = q.filter(Quote.activity_type_id.in_(type_ids))
+    if quote_ids:
+        q = q.filter(Expense.quote_id.in_(quote_ids))
+    q = q.group_by(Expense.year, Expense.month, "Mall", "OI", "Categoria", "Tipo")
+
+    df = pd.DataFrame(q.all(), columns=["year", "month", "Mall", "OI", "Categoria", "Tipo", "usd", "gastos"])
+    df["Mes"] = pd.PeriodIndex.from_fields(year=df["year"].to_numpy(int), month=df["month"].to_numpy(int), freq="M")
+    df["cents"] = to_cents(df["usd"].to_numpy(float))
+    return df.drop(columns=["year", "month", "usd"])
+
+def monthly_pivot(df, dimension, start_year, end_year, max_series=MONTHLY_MAX_SERIES):
+    # Meses x valores de la dimensión (USD), con todos los meses del rango (los vacíos en 0)
+    col = MONTHLY_DIMENSIONS[dimension]
+    months = pd.period_range(f"{start_year}-01", f"{end_year}-12", freq="M")
+    data = df
+    if data[col].nunique() > max_series:
+        top = data.groupby(col)["cents"].sum().nlargest(max_series - 1).index
+        data = data.assign(**{col: data[col].where(data[col].isin(top), "Otros")})
+    pivot = data.pivot_table(index="Mes", columns=col, values="cents", aggfunc="sum", fill_value=0)
+    pivot = pivot.reindex(months, fill_value=0)
+    pivot = pd.DataFrame(from_cents(pivot.to_numpy()).reshape(pivot.shape), index=pivot.index.to_timestamp(), columns=pivot.columns)
+    pivot.index.name = "Mes"
+    return pivot
+
+def mall_month_heatmap(df):
+    # Formato largo Mall x Mes para el mapa de calor
+    grid = df.groupby(["Mall", "Mes"], as_index=False).agg(cents=("cents", "sum"), gastos=("gastos", "sum"))
+    grid["Mes"] = grid["Mes"].astype(str)
+    grid["Monto USD"] = from_cents(grid["cents"].to_numpy())
+    return grid.drop(columns=["cents"])
+
+
+# ==============================================================================
+# RENTABILIDAD POR ACTIVIDAD (COTIZACIÓN)
+# ==============================================================================
+# cotizaciones ⟕ (gastos agrupados por cotización) en UNA consulta. Orden,
+# filtros y paginación se resuelven en SQL: a la página solo llega una hoja.
+# Toda la aritmética es en centavos enteros (type_coerce evita que los
+# literales pasen por Money); el margen es un cociente sin unidades.
+
+PROFITABILITY_SORTS = {
+    "Utilidad": "utilidad",
+    "Margen %": "margen",
+    "Desvío vs presupuesto": "desvio",
+    "Venta": "venta",
+    "Gasto real": "gasto",
+}
+PROFITABILITY_PAGE_SIZE = 25
+
+def _cents(col):
+    return type_coerce(col, Integer)
+
+def quote_profitability(db: Session, start_d, end_d, mall_ids=None, type_ids=None, quote_ids=None,
+                        search=None, only_losses=False, sort_by="Utilidad", ascending=True,
+                        page=1, page_size=PROFITABILITY_PAGE_SIZE):
+    spent = (
+        db.query(Expense.quote_id, func.sum(_cents(Expense.amount_usd)).label("cents"))
+        .group_by(Expense.quote_id)
+        .subquery()
+    )
+    # Venta: precio final acordado o, si no hay, el sugerido al 60% (igual que el Dashboard)
+    venta = case(
+        (func.coalesce(_cents(Quote.final_sale_price_usd), 0) > 0, _cents(Quote.final_sale_price_usd)),
+        else_=func.coalesce(_cents(Quote.suggested_price_usd_m60), 0)
+    )
+    costo = func.coalesce(_cents(Quote.total_cost_usd), 0)
+    gasto = func.coalesce(spent.c.cents, 0)
+    utilidad = venta - gasto
+    desvio = costo - gasto # Positivo = ahorro
+    margen = type_coerce(case((venta > 0, type_coerce(utilidad, Float) * 100.0 / venta), else_=None), Float)
+
+    q = (
+        db.query(
+            Quote.id, Quote.activity_name, Quote.status,
+            func.coalesce(Mall.name, "Global").label("mall"),
+            venta.label("venta"), costo.label("costo"), gasto.label("gasto"),
+            utilidad.label("utilidad"), desvio.label("desvio"), margen.label("margen"),
+        )
+        .outerjoin(spent, spent.c.quote_id == Quote.id)
+        .outerjoin(Mall, Quote.mall_id == Mall.id)
+        .filter(
+            Quote.status.in_(["APROBADA", "EJECUTADA", "LIQUIDADA"]),
+            Quote.created_at >= start_d, Quote.created_at <= end_d
+        )
+    )
+    if mall_ids:
+        q = q.filter(Quote.mall_id.in_(mall_ids))
+    if type_ids:
+        q = q.filter(Quote.activity_type_id.in_(type_ids))
+    if quote_ids:
+        q = q.filter(Quote.id.in_(quote_ids))
+    if search:
+        q = q.filter(Quote.activity_name.ilike(f"%{search}%"))
+    if only_losses:
+        q = q.filter(utilidad < 0)
+
+    total = q.order_by(None).count()
+    sort_col = {"utilidad": utilidad, "margen": margen, "desvio": desvio, "venta": venta, "gasto": gasto}[PROFITABILITY_SORTS[sort_by]]
+    page = max(1, page)
+    rows = (
+        q.order_by(sort_col.asc() if ascending else sort_col.desc(), Quote.id)
+        .limit(page_size).offset((page - 1) * page_size)
+        .all()
+    )
+
+    df = pd.DataFrame(rows, columns=["ID", "Actividad", "Estado", "Mall", "venta", "costo", "gasto", "utilidad", "desvio", "margen"])
+    for col, label in [("venta", "Venta USD"), ("costo", "Presupuesto USD"), ("gasto", "Gasto Real USD"),
+                       ("utilidad", "Utilidad USD"), ("desvio", "Desvío USD")]:
+        df[label] = from_cents(df[col].to_numpy(dtype="int64"))
+    df["Margen %"] = df["margen"].astype(float)
+    return df.drop(columns=["venta", "costo", "gasto", "utilidad", "desvio", "margen"]), total
+
+
+# ==============================================================================
+# GASTO POR PROVEEDOR
+# ==============================================================================
+# Una consulta agrupada (proveedor, categoría, OI, mes) sobre expenses.company_id;
+# ranking, concentración, tendencia y desgloses salen de ese resultado con pandas.
+# La página cachea el resultado con la versión de datos de gastos como llave.
+
+PROVIDER_TOP_N = 15
+
+def provider_spend(db: Session, start_year=None, end_year=None):
+    q = (
+        db.query(
+            func.coalesce(Proveedor.name, "Sin proveedor").label("Proveedor"),
+            func.coalesce(Expense.category, "N/A").label("Categoria"),
+            func.coalesce(OI.oi_code, "N/A").label("OI"),
+            Expense.year, Expense.month,
+            func.sum(_cents(Expense.amount_gtq)).label("cents"),
+            func.count(Expense.id).label("gastos"),
+        )
+        .outerjoin(Proveedor, Expense.company_id == Proveedor.id)
+        .outerjoin(OI, Expense.oi_id == OI.id)
+        .filter(Expense.year.isnot(None), Expense.month.isnot(None))
+    )
+    if start_year is not None:
+        q = q.filter(Expense.year >= start_year)
+    if end_year is not None:
+        q = q.filter(Expense.year <= end_year)
+    q = q.group_by(Expense.company_id, Proveedor.name, Expense.category, OI.oi_code, Expense.year, Expense.month)
+
+    df = pd.DataFrame(q.all(), columns=["Proveedor", "Categoria", "OI", "year", "month", "cents", "gastos"])
+    df["Mes"] = pd.PeriodIndex.from_fields(year=df["year"].to_numpy(int), month=df["month"].to_numpy(int), freq="M")
+    df["cents"] = df["cents"].fillna(0).astype("int64")
+    return df.drop(columns=["year", "month"])
+
+def provider_ranking(df):
+    # Un renglón por proveedor (mayor a menor) con participación y acumulado
+    ranking = df.groupby("Proveedor", as_index=False).agg(cents=("cents", "sum"), gastos=("gastos", "sum"))
+    ranking = ranking.sort_values("cents", ascending=False, kind="stable").reset_index(drop=True)
+    total = ranking["cents"].sum()
+    ranking["Monto Q"] = from_cents(ranking["cents"].to_numpy())
+    ranking["% del Total"] = ranking["cents"] / total * 100 if total else 0.0
+    ranking["% Acumulado"] = ranking["% del Total"].cumsum()
+    return ranking.drop(columns=["cents"]).rename(columns={"gastos": "# Gastos"})
+
+def provider_concentration(ranking):
+    # HHI (0-10,000): > 2,500 = gasto muy concentrado en pocos proveedores
+    shares = ranking["% del Total"].to_numpy(float)
+    return {
+        "proveedores": len(ranking),
+        "top5_pct": float(shares[:5].sum()),
+        "hhi": float((shares ** 2).sum()),
+        "para_80": int((ranking["% Acumulado"] < 80).sum() + 1) if len(ranking) else 0,
+    }
+
+def provider_monthly(df, providers):
+    # Meses x proveedor (Q) para los proveedores elegidos, meses vacíos en 0
+    data = df[df["Proveedor"].isin(providers)]
+    if data.empty:
+        return pd.DataFrame()
+    months = pd.period_range(df["Mes"].min(), df["Mes"].max(), freq="M")
+    pivot = data.pivot_table(index="Mes", columns="Proveedor", values="cents", aggfunc="sum", fill_value=0).reindex(months, fill_value=0)
+    return pd.DataFrame(from_cents(pivot.to_numpy()).reshape(pivot.shape), index=pivot.index.to_timestamp(), columns=pivot.columns)
+
+def provider_breakdown(df, by, providers=None):
+    # Proveedor x (Categoría | OI) en Q
+    data = df if providers is None else df[df["Proveedor"].isin(providers)]
+    pivot = data.pivot_table(index="Proveedor", columns=by, values="cents", aggfunc="sum", fill_value=0)
+    return pd.DataFrame(from_cents(pivot.to_numpy()).reshape(pivot.shape), index=pivot.index, columns=pivot.columns)
@@ -0,0 +1,120 @@
+import time
+import threading
+import numpy as np
+import pandas as pd
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+from models import Expense
+
+# ==============================================================================
+# GASTOS INUSUALES (MEDIANA / MAD)
+# ==============================================================================
+# Para cada combinación (OI, categoría, proveedor) se calcula la mediana y la
+# MAD del monto en escala log10 (un cero de más = +1 en log10). Un gasto es
+# inusual si su z robusto |0.6745 (x - mediana) / MAD| supera ANOMALY_Z.
+# Si la combinación tiene pocos gastos se usa el nivel más general.
+# Todo se calcula en una pasada vectorizada de pandas sobre la tabla completa.
+
+STAT_LEVELS = [
+    ("oi_id", "category", "company_id"),
+    ("oi_id", "category"),
+    ("category",),
+]
+MIN_SAMPLES = 5     # gastos mínimos para confiar en las estadísticas de un grupo
+MIN_MAD = 0.05      # piso de la MAD (log10): montos idénticos no disparan alertas por centavos
+ANOMALY_Z = 3.5
+STATS_TTL_SECONDS = 15 * 60
+
+REVIEW_PENDING = "REVISAR"
+REVIEW_OK = "OK"
+
+def _expense_frame(db: Session):
+    rows = db.query(
+        Expense.id, Expense.oi_id, Expense.category, Expense.company_id, Expense.amount_gtq, Expense.review_status
+    ).all()
+    df = pd.DataFrame(rows, columns=["id", "oi_id", "category", "company_id", "amount_gtq", "review_status"])
+    return _normalize_keys(df)
+
+def _normalize_keys(df):
+    # Llaves sin nulos (los NaN no coinciden en búsquedas por diccionario)
+    df["oi_id"] = df["oi_id"].fillna(0).astype("int64")
+    df["company_id"] = df["company_id"].fillna(0).astype("int64")
+    df["category"] = df["category"].fillna("")
+    df["x"] = np.log10(df["amount_gtq"].astype(float).where(df["amount_gtq"] > 0))
+    return df
+
+def _level_stats(df, keys):
+    # Mediana, MAD y tamaño por grupo (dos groupby vectorizados)
+    data = df.dropna(subset=["x"])
+    med = data.groupby(list(keys))["x"].median().rename("median")
+    dev = (data["x"] - data[list(keys)].join(med, on=list(keys))["median"]).abs()
+    mad = dev.groupby([data[k] for k in keys]).median().rename("mad")
+    n = data.groupby(list(keys)).size().rename("n")
+    return pd.concat([med, mad, n], axis=1)
+
+def compute_stats(db: Session):
+    df = _expense_frame(db)
+    return [_level_stats(df, keys) for keys in STAT_LEVELS]
+
+def _robust_z(x, median, mad):
+    return 0.6745 * (x - median) / np.maximum(mad, MIN_MAD)
+
+def score_frame(df, stats):
+    # z robusto por fila usando el nivel más específico con MIN_SAMPLES (vectorizado)
+    z = pd.Series(np.nan, index=df.index)
+    median = pd.Series(np.nan, index=df.index)
+    for keys, level in zip(STAT_LEVELS, stats):
+        joined = df[list(keys)].join(level[level["n"] >= MIN_SAMPLES], on=list(keys))
+        take = z.isna() & joined["median"].notna() & df["x"].notna()
+        z[take] = _robust_z(df.loc[take, "x"], joined.loc[take, "median"], joined.loc[take, "mad"])
+        median[take] = joined.loc[take, "median"]
+    return z, 10 ** median
+
+# --- ESTADÍSTICAS EN CACHÉ (PARA VALIDAR AL CAPTURAR) ---
+_cache = {"stats": None, "at": 0.0}
+_cache_lock = threading.Lock()
+
+def get_stats(db: Session, max_age=STATS_TTL_SECONDS):
+    with _cache_lock:
+        if _cache["stats"] is None or time.time() - _cache["at"] > max_age:
+            _cache["stats"] = compute_stats(db)
+            _cache["at"] = time.time()
+        return _cache["stats"]
+
+def flag_expense(db: Session, expense: Expense):
+    # Califica el gasto antes de guardarlo; si es inusual lo deja marcado para revisión.
+    # Devuelve (z, mediana Q) si es inusual, None si no.
+    df = _normalize_keys(pd.DataFrame([{
+        "oi_id": expense.oi_id, "category": expense.category,
+        "company_id": expense.company_id, "amount_gtq": expense.amount_gtq or 0.0
+    }]))
+    z, median = score_frame(df, get_stats(db))
+    if pd.isna(z.iloc[0]) or abs(z.iloc[0]) < ANOMALY_Z:
+        return None
+    expense.anomaly_score = round(float(z.iloc[0]), 2)
+    expense.review_status = REVIEW_PENDING
+    return float(z.iloc[0]), float(median.iloc[0])
+
+def rescore_expenses(db: Session):
+    # Recalcula toda la tabla; no toca los gastos que un usuario ya marcó como OK
+    df = _expense_frame(db)
+    stats = [_level_stats(df, keys) for keys in STAT_LEVELS]
+    z, _ = score_frame(df, stats)
+    flagged = z.abs() >= ANOMALY_Z
+    pending = df["review_status"] != REVIEW_OK
+    to_flag = pending & flagged
+    to_clear = pending & ~flagged & (df["review_status"] == REVIEW_PENDING)
+
+    rows = [
+        {"id": int(i), "review_status": REVIEW_PENDING, "anomaly_score": round(float(v), 2)}
+        for i, v in zip(df.loc[to_flag, "id"], z[to_flag])
+    ] + [
+        {"id": int(i), "review_status": None, "anomaly_score": None}
+        for i in df.loc[to_clear, "id"]
+    ]
+    if rows:
+        db.execute(update(Expense), rows)
+        db.commit()
+    with _cache_lock:
+        _cache["stats"], _cache["at"] = stats, time.time()
+    return int(to_flag.sum())
@@ -3,31 +3,18 @@ import streamlit as st
 # 1. Configuración DEBE ser lo primero
 st.set_page_config(page_title="Cotizador Spectrum", page_icon="📊", layout="wide")
 
-from database import Base, engine, get_db
-from auth import login_form, require_role, hash_password
-from models import User
+from auth import login_form
+from bootstrap import bootstrap
+from jobs import start_workers
 
 # --- INICIALIZACIÓN DE SESIÓN PERSISTENTE ---
 if "authenticated" not in st.session_state:
     st.session_state["authenticated"] = False
 
-# Crear tablas
-Base.metadata.create_all(bind=engine)
-
-# Obtener sesión
-db = next(get_db())
-
-# --- BLOQUE MÁGICO: AUTOCREAR ADMIN ---
-try:
-    admin_user = db.query(User).filter(User.username == "admin").first()
-    if not admin_user:
-        admin_pass = hash_password("admin123") 
-        new_admin = User(username="admin", password_hash=admin_pass, role="ADMIN")
-        db.add(new_admin)
-        db.commit()
-        print("✅ Usuario Admin creado automáticamente.")
-except Exception as e:
-    print(f"Error verificando admin: {e}")
+# Crear tablas y autocrear admin (una sola vez por proceso, no en cada rerun)
+bootstrap()
+# Hilos que ejecutan la cola de trabajos en segundo plano (también una vez por proceso)
+start_workers()
 
 # ==============================================================================
 # LÓGICA DE CONTROL DE ACCESO
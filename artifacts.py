@@ -0,0 +1,105 @@
+import os
+import re
+import time
+import hashlib
+import threading
+
+# ==============================================================================
+# ALMACÉN DE ARCHIVOS GENERADOS (ZIPs, PDFs, EXPORTACIONES)
+# ==============================================================================
+# Los archivos se escriben en disco con nombre = hash SHA-256 del contenido
+# (el mismo documento generado dos veces ocupa un solo archivo). La sesión de
+# Streamlit solo guarda la CLAVE; la descarga lee del disco al hacer click.
+# Limpieza automática por antigüedad (TTL) y por tamaño total (los menos usados primero).
+
+# Con varias réplicas, COTIZADOR_ARTIFACTS_DIR puede apuntar a un volumen compartido
+ARTIFACTS_DIR = os.environ.get("COTIZADOR_ARTIFACTS_DIR", "artifacts")
+STORE_DIR = os.path.join(ARTIFACTS_DIR, "store")
+UPLOADS_DIR = os.path.join(ARTIFACTS_DIR, "uploads")
+
+ARTIFACT_TTL_HOURS = float(os.environ.get("COTIZADOR_ARTIFACT_TTL_HOURS", "72"))
+ARTIFACT_MAX_MB = float(os.environ.get("COTIZADOR_ARTIFACT_MAX_MB", "512"))
+
+_KEY_RE = re.compile(r"^[0-9a-f]{64}(\.[a-z0-9]{1,8})?$")
+_evict_lock = threading.Lock()
+
+def _key_path(key):
+    # La clave viene de la BD / sesión: se valida para no salir del directorio
+    if not key or not _KEY_RE.match(key):
+        raise ValueError(f"Clave de archivo inválida: {key}")
+    return os.path.join(STORE_DIR, key)
+
+def artifact_key(digest, filename):
+    # Clave = hash hexadecimal + extensión del nombre original
+    ext = os.path.splitext(str(filename))[1].lower()
+    return digest + (ext if re.match(r"^\.[a-z0-9]{1,8}$", ext) else "")
+
+def put_artifact(data: bytes, filename, digest=None):
+    # Guarda los bytes y devuelve la clave. Por defecto el hash es el del contenido;
+    # con digest (hash de los DATOS de origen) se puede saber si ya existe sin generarlo.
+    key = artifact_key(digest or hashlib.sha256(data).hexdigest(), filename)
+    path = _key_path(key)
+    os.makedirs(STORE_DIR, exist_ok=True)
+    if os.path.exists(path):
+        os.utime(path) # Ya existía: solo se renueva su vigencia
+    else:
+        # Escritura atómica: otro hilo nunca ve un archivo a medias
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    evict_artifacts()
+    return key
+
+def artifact_exists(key):
+    try:
+        return os.path.exists(_key_path(key))
+    except ValueError:
+        return False
+
+def read_artifact(key):
+    path = _key_path(key)
+    with open(path, "rb") as f:
+        data = f.read()
+    os.utime(path) # Marca de uso para la limpieza por tamaño
+    return data
+
+def _sweep_expired(directory, max_age_seconds, now):
+    removed = 0
+    if not os.path.isdir(directory):
+        return removed
+    for entry in os.scandir(directory):
+        if entry.is_file() and now - entry.stat().st_mtime > max_age_seconds:
+            try:
+                os.remove(entry.path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
+
+def evict_artifacts(ttl_hours=None, max_mb=None):
+    # 1) Borra lo vencido (store + archivos subidos para importar)
+    # 2) Si el store sigue pasado de tamaño, borra los menos usados
+    ttl_hours = ARTIFACT_TTL_HOURS if ttl_hours is None else ttl_hours
+    max_mb = ARTIFACT_MAX_MB if max_mb is None else max_mb
+    now = time.time()
+    with _evict_lock:
+        removed = _sweep_expired(STORE_DIR, ttl_hours * 3600, now)
+        removed += _sweep_expired(UPLOADS_DIR, ttl_hours * 3600, now)
+
+        if not os.path.isdir(STORE_DIR):
+            return removed
+        files = [e for e in os.scandir(STORE_DIR) if e.is_file() and not e.name.endswith(".tmp")]
+        files = sorted(((e.stat().st_mtime, e.stat().st_size, e.path) for e in files))
+        total = sum(size for _, size, _ in files)
+        limit = max_mb * 1024 * 1024
+        for _, size, path in files:
+            if total <= limit:
+                break
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+    return removed
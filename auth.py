@@ -1,12 +1,15 @@
 import streamlit as st
-import bcrypt
-from database import get_db
+from database import SessionLocal
 from models import User
 
+# bcrypt se importa solo al generar/verificar claves (login y edición de usuarios),
+# no en cada página que llama a require_role.
 def hash_password(password):
+    import bcrypt
     return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
 
 def check_password(password, hashed):
+    import bcrypt
     return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
 
 def login_form():
@@ -18,8 +21,8 @@ def login_form():
         submitted = st.form_submit_button("Entrar")
         
         if submitted:
-            db = next(get_db())
-            user = db.query(User).filter(User.username == username).first()
+            with SessionLocal() as db:
+                user = db.query(User).filter(User.username == username).first()
             
             if user and check_password(password, user.password_hash):
                 # --- CAMBIO CLAVE: Activamos la persistencia ---
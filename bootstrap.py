@@ -0,0 +1,58 @@
+import streamlit as st
+from sqlalchemy import inspect
+from sqlalchemy.schema import CreateColumn
+from database import Base, engine, SessionLocal
+import models  # noqa: F401  (registra las tablas en Base.metadata)
+from services import init_db_seeds, ensure_admin_user
+from migrations import run_migrations
+
+# ==============================================================================
+# ARRANQUE ÚNICO POR PROCESO
+# ==============================================================================
+# Antes app.py corría create_all + la consulta del admin en CADA rerun.
+# Ahora se ejecuta una sola vez por proceso del servidor (cache_resource).
+
+def ensure_columns():
+    # create_all NO agrega columnas a tablas que ya existen: las columnas nuevas
+    # de los modelos se agregan aquí con ALTER TABLE (con su server_default y NOT NULL).
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                # El compilador del dialecto arma tipo, DEFAULT (con comillas) y NOT NULL
+                col_ddl = CreateColumn(column).compile(dialect=engine.dialect)
+                table_name = engine.dialect.identifier_preparer.format_table(table)
+                conn.exec_driver_sql(f"ALTER TABLE {table_name} ADD COLUMN {col_ddl}")
+                print(f"🛠️ Columna agregada: {table.name}.{column.name}")
+
+def prepare_database():
+    # Versión sin caché: la usan bootstrap() y las herramientas de línea de comandos
+    fresh_database = not inspect(engine).has_table("quotes")
+    Base.metadata.create_all(bind=engine)
+    ensure_columns()
+    run_migrations(fresh_database)
+    db = SessionLocal()
+    try:
+        init_db_seeds(db)
+        ensure_admin_user(db)
+    except Exception as e:
+        db.rollback()
+        print(f"Error verificando admin: {e}")
+    finally:
+        db.close()
+
+@st.cache_resource(show_spinner=False)
+def bootstrap():
+    prepare_database()
+    return True
+
+def reset_database():
+    # HARD RESET: borra todo y vuelve a sembrar (admin, tipos de gasto, tasa)
+    Base.metadata.drop_all(bind=engine)
+    bootstrap.clear()
+    bootstrap()
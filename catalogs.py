@@ -0,0 +1,335 @@
+import codecs
+import pandas as pd
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from models import Insumo, ActivityType, Mall, OI, Proveedor
+
+# ==============================================================================
+# CARGAS MASIVAS DE CATÁLOGOS
+# ==============================================================================
+# Lógica de importación sin widgets: la usan los trabajos en segundo plano
+# (jobs.py) y la página de Catálogos solo para la vista previa.
+# Los read_*_file devuelven un iterador de bloques (DataFrames) y los import_*
+# los consumen con un commit por bloque. progress(fraccion, mensaje) es opcional.
+
+INSUMOS_RENAME_MAP = {
+    'nombre': 'name', 'insumo': 'name', 'item': 'name',
+    'costo': 'cost_gtq', 'precio': 'cost_gtq', 'cost': 'cost_gtq',
+    'unidad': 'unit_type', 'medida': 'unit_type', 'tipo': 'unit_type',
+    'cobro': 'billing_mode', 'modo': 'billing_mode',
+    'categoria': 'category', 'cat': 'category', 'categoría': 'category',
+    'descripcion': 'description', 'detalle': 'description', 'desc': 'description'
+}
+
+TYPES_RENAME_MAP = {
+    'nombre': 'name', 'tipo': 'name', 'actividad': 'name',
+    'descripcion': 'description', 'descripción': 'description', 'detalle': 'description'
+}
+
+SNIFF_BYTES = 64 * 1024   # Muestra para detectar codificación y separador
+CHUNK_ROWS = 5000         # Filas por bloque
+PREVIEW_ROWS = 200
+CSV_DELIMITERS = [',', ';', '\t', '|']
+
+def _noop_progress(fraction, message=""):
+    pass
+
+def _seek(source, offset=0, whence=0):
+    if hasattr(source, "seek"):
+        source.seek(offset, whence)
+
+def _is_excel(filename):
+    return str(filename).lower().endswith(('.xlsx', '.xls'))
+
+def sniff_csv(sample: bytes):
+    # Una sola mirada a los primeros KB: codificación (BOM / UTF-8 / latin-1) y separador.
+    # Reemplaza los 4 reintentos de pd.read_csv (cada uno volvía a leer TODO el archivo).
+    if sample.startswith(codecs.BOM_UTF8):
+        encoding = 'utf-8-sig'
+    else:
+        try:
+            sample.decode('utf-8')
+            encoding = 'utf-8'
+        except UnicodeDecodeError as e:
+            # Si solo se cortó un carácter al final de la muestra, sigue siendo UTF-8
+            encoding = 'utf-8' if e.reason == "unexpected end of data" else 'latin-1'
+
+    text = sample.decode(encoding, errors='ignore')
+    header = next((line for line in text.splitlines() if line.strip()), "")
+    # El separador es el que más aparece en el encabezado (empate: coma, como antes)
+    sep = max(CSV_DELIMITERS, key=lambda d: (header.count(d), d == ','))
+    return encoding, sep
+
+def normalize_columns(df, rename_map):
+    # Minúsculas, sin espacios y mapeo Español -> Inglés
+    df.columns = [str(c).lower().strip() for c in df.columns]
+    return df.rename(columns=rename_map)
+
+def find_col(columns, options):
+    # Busca una columna ignorando mayúsculas/espacios
+    wanted = [o.lower() for o in options]
+    for col in columns:
+        if str(col).lower().strip() in wanted:
+            return col
+    return None
+
+def _prepare(df, rename_map):
+    if rename_map is not None:
+        return normalize_columns(df, rename_map)
+    df.columns = df.columns.str.strip()
+    return df
+
+def iter_upload(source, filename=None, rename_map=None, dtype=None, chunksize=CHUNK_ROWS, progress=_noop_progress):
+    # Lector compartido de cargas masivas: detecta el formato con una muestra y
+    # recorre el archivo UNA sola vez, en bloques de `chunksize` filas.
+    # source: ruta en disco (trabajos) o el archivo subido de Streamlit (vista previa).
+    filename = filename or getattr(source, "name", source)
+
+    if _is_excel(filename):
+        df = _prepare(pd.read_excel(source, dtype=dtype), rename_map)
+        total_rows = max(len(df), 1)
+        for start in range(0, len(df), chunksize):
+            done = min(start + chunksize, total_rows)
+            yield df.iloc[start:start + chunksize]
+            progress(done / total_rows, f"{done} de {total_rows} filas")
+        return
+
+    f = open(source, "rb") if isinstance(source, str) else source
+    try:
+        _seek(f)
+        sample = f.read(SNIFF_BYTES)
+        _seek(f, 0, 2)
+        size = max(f.tell(), 1)
+        _seek(f)
+        encoding, sep = sniff_csv(sample)
+        # Filas estimadas con el tamaño promedio de fila de la muestra (solo para la barra de avance)
+        est_rows = max(size / max(len(sample) / max(sample.count(b"\n"), 1), 1), 1)
+
+        rows = 0
+        while True:
+            try:
+                # Reanudación: se saltan las filas que ya se entregaron (y guardaron)
+                _seek(f)
+                reader = pd.read_csv(
+                    f, sep=sep, encoding=encoding, dtype=dtype, chunksize=chunksize,
+                    skiprows=range(1, rows + 1) if rows else None
+                )
+                for chunk in reader:
+                    rows += len(chunk)
+                    yield _prepare(chunk, rename_map)
+                    # Se reporta después de que el bloque anterior ya se guardó
+                    progress(min(rows / est_rows, 0.99), f"{rows} filas procesadas")
+                break
+            except UnicodeDecodeError:
+                # La muestra era UTF-8 / ASCII pero más adelante hay bytes Latin-1
+                # ("Diseño" después de los primeros KB): se sigue en latin-1 desde
+                # la fila donde se quedó (latin-1 decodifica cualquier byte).
+                if encoding == 'latin-1':
+                    raise
+                encoding = 'latin-1'
+    finally:
+        if f is not source:
+            f.close()
+
+def preview_upload(chunks):
+    # Primer bloque del lector (no lee el resto del archivo)
+    return next(iter(chunks), pd.DataFrame())
+
+def _as_chunks(data):
+    return [data] if isinstance(data, pd.DataFrame) else data
+
+# --- INSUMOS ---
+def read_insumos_file(source, filename=None, chunksize=CHUNK_ROWS, progress=_noop_progress):
+    return iter_upload(source, filename, INSUMOS_RENAME_MAP, chunksize=chunksize, progress=progress)
+
+def import_insumos(db: Session, chunks):
+    existing_names = {name for (name,) in db.query(Insumo.name).all()}
+    created = 0
+    skipped_count = 0
+
+    for df in _as_chunks(chunks):
+        if 'name' not in df.columns:
+            raise ValueError("No se encuentra la columna 'Nombre' o 'Name'. Revisa tu archivo.")
+
+        new_objects = []
+        for index, row in df.iterrows():
+            name_val = str(row['name']).strip()
+
+            if name_val in existing_names or name_val == "nan":
+                skipped_count += 1
+                continue
+
+            # Manejo seguro de valores numéricos
+            try:
+                cost_val = float(str(row.get('cost_gtq', 0)).replace(',', '').replace('Q', ''))
+            except (TypeError, ValueError):
+                cost_val = 0.0
+
+            cat_val = row.get('category', None)
+            if pd.isna(cat_val): cat_val = "Varios" # Default si no trae
+
+            desc_val = row.get('description', "")
+            if pd.isna(desc_val): desc_val = ""
+
+            new_objects.append(Insumo(
+                name=name_val,
+                unit_type=row.get('unit_type', 'UNIDAD'),
+                cost_gtq=cost_val,
+                billing_mode=row.get('billing_mode', 'MULTIPLICABLE'),
+                category=str(cat_val),
+                description=str(desc_val)
+            ))
+            existing_names.add(name_val)
+
+        if new_objects:
+            db.add_all(new_objects)
+            db.commit()
+            created += len(new_objects)
+    return {"created": created, "updated": 0, "skipped": skipped_count, "errors": []}
+
+# --- TIPOS DE ACTIVIDAD ---
+def read_types_file(source, filename=None, chunksize=CHUNK_ROWS, progress=_noop_progress):
+    return iter_upload(source, filename, TYPES_RENAME_MAP, chunksize=chunksize, progress=progress)
+
+def import_activity_types(db: Session, chunks):
+    existing_types = {name for (name,) in db.query(ActivityType.name).all()}
+    created = 0
+    skipped = 0
+
+    for df in _as_chunks(chunks):
+        if 'name' not in df.columns:
+            raise ValueError("Falta la columna 'Nombre' o 'Tipo'.")
+
+        new_types = []
+        for index, row in df.iterrows():
+            name_val = str(row['name']).strip()
+
+            if name_val in existing_types or name_val == "nan" or name_val == "":
+                skipped += 1
+                continue
+
+            desc_val = str(row.get('description', ''))
+            if desc_val == "nan": desc_val = ""
+
+            new_types.append(ActivityType(name=name_val, description=desc_val))
+            existing_types.add(name_val)
+
+        if new_types:
+            db.add_all(new_types)
+            db.commit()
+            created += len(new_types)
+    return {"created": created, "updated": 0, "skipped": skipped, "errors": []}
+
+# --- OIs ---
+def read_ois_file(source, filename=None, chunksize=CHUNK_ROWS, progress=_noop_progress):
+    # Forzamos que el Código sea Texto para no perder dígitos
+    return iter_upload(source, filename, dtype={'Codigo': str}, chunksize=chunksize, progress=progress)
+
+def _clean_oi_code(raw_code, row_number, warnings):
+    raw_code = str(raw_code).strip()
+    if 'E+' in raw_code:
+        warnings.append(f"Fila {row_number}: El código venía en notación científica ({raw_code}). Se perderá precisión. Usa .xlsx mejor.")
+        return str(int(float(raw_code)))
+    if raw_code.endswith('.0'):
+        return raw_code[:-2]
+    return raw_code
+
+def import_ois(db: Session, chunks):
+    malls_map = {m.name.strip().lower(): m.id for m in db.query(Mall).all()}
+    ois_by_code = {o.oi_code: o for o in db.query(OI).all()}
+
+    created_count = 0
+    updated_count = 0
+    errors = []
+    warnings = []
+
+    for df in _as_chunks(chunks):
+        if 'Mall' not in df.columns or 'Codigo' not in df.columns:
+            raise ValueError(f"No encuentro las columnas 'Mall' o 'Codigo'. Detectadas: {list(df.columns)}")
+
+        for index, row in df.iterrows():
+            try:
+                mall_input = str(row['Mall']).strip()
+                clean_code = _clean_oi_code(row['Codigo'], index + 1, warnings)
+
+                if mall_input.lower() not in malls_map:
+                    errors.append(f"Fila {index+1}: Mall '{mall_input}' no existe.")
+                    continue
+                mall_id_found = malls_map[mall_input.lower()]
+
+                # Upsert (Actualizar o Crear)
+                existing_oi = ois_by_code.get(clean_code)
+                if existing_oi:
+                    existing_oi.mall_id = mall_id_found
+                    existing_oi.oi_name = str(row['Nombre']).strip()
+                    existing_oi.annual_budget_usd = float(row['Presupuesto'])
+                    updated_count += 1
+                else:
+                    new_oi = OI(
+                        mall_id=mall_id_found,
+                        oi_code=clean_code,
+                        oi_name=str(row['Nombre']).strip(),
+                        annual_budget_usd=float(row['Presupuesto']),
+                        is_active=True
+                    )
+                    db.add(new_oi)
+                    ois_by_code[clean_code] = new_oi
+                    created_count += 1
+            except Exception as row_e:
+                errors.append(f"Error fila {index+1}: {row_e}")
+
+        db.commit()
+    return {"created": created_count, "updated": updated_count, "skipped": 0, "errors": errors, "warnings": warnings}
+
+# --- PROVEEDORES ---
+PROVIDER_COLUMNS = {
+    "name": ['Nombre Comercial', 'Nombre', 'Empresa', 'Proveedor'],
+    "legal_name": ['Razón Social', 'Razon Social', 'Legal'],
+    "provider_type": ['Tipo', 'Categoria', 'Servicio'],
+    "nit": ['NIT', 'Nit'],
+    "cui": ['CUI', 'DPI', 'Identificacion'],
+    "bank_name": ['Banco', 'Bank'],
+    "account_number": ['No. de Cuenta', 'No Cuenta', 'Cuenta', 'Numero Cuenta'],
+}
+
+def read_providers_file(source, filename=None, chunksize=CHUNK_ROWS, progress=_noop_progress):
+    # dtype=str para que el NIT o Cuenta no pierdan ceros o se vuelvan notación científica
+    return iter_upload(source, filename, dtype=str, chunksize=chunksize, progress=progress)
+
+def import_providers(db: Session, chunks):
+    # Protección contra duplicados por Nombre Comercial (insensible a mayúsculas)
+    existing = {name.lower() for (name,) in db.query(func.lower(Proveedor.name)).all() if name}
+    count_new = 0
+    count_skipped = 0
+
+    for df in _as_chunks(chunks):
+        cols = {field: find_col(df.columns, options) for field, options in PROVIDER_COLUMNS.items()}
+        if not cols["name"]:
+            raise ValueError(f"No encuentro la columna 'Nombre Comercial'. Columnas leídas: {list(df.columns)}")
+
+        def value(row, field, default=""):
+            col = cols[field]
+            return str(row[col]).strip() if col and pd.notna(row[col]) else default
+
+        for index, row in df.iterrows():
+            nombre_input = str(row[cols["name"]]).strip()
+            if not nombre_input or nombre_input.lower() == 'nan':
+                continue
+
+            if nombre_input.lower() in existing:
+                count_skipped += 1
+            else:
+                db.add(Proveedor(
+                    name=nombre_input,
+                    legal_name=value(row, "legal_name"),
+                    provider_type=value(row, "provider_type", "Certificado"),
+                    nit=value(row, "nit"),
+                    cui=value(row, "cui"),
+                    bank_name=value(row, "bank_name"),
+                    account_number=value(row, "account_number")
+                ))
+                existing.add(nombre_input.lower())
+                count_new += 1
+
+        db.commit()
+    return {"created": count_new, "updated": 0, "skipped": count_skipped, "errors": []}
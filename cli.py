@@ -0,0 +1,231 @@
+"""Tareas por lotes sin Streamlit (para cron / servidor).
+
+Usa la misma BD y los mismos servicios que la app; no renderiza widgets.
+Antes de cada comando se asegura el esquema (migraciones + semillas).
+
+Uso:
+    python cli.py init                                        # esquema, migraciones y semillas (admin, tipos de gasto, tasa)
+    python cli.py importar insumos catalogo.xlsx              # también: tipos, ois, proveedores
+    python cli.py exportar odc --desde 2026-01-01 --hasta 2026-01-31 --formato XLSX --salida odc.xlsx
+    python cli.py recalcular                                  # totales de BORRADOR / ENVIADA con costos y tasa vigentes
+    python cli.py recalcular --estado APROBADA --ids 10 11 12
+    python cli.py conciliar [--solo-revisar]                  # gasto acumulado vs gastos registrados
+    python cli.py anomalias                                   # recalifica gastos inusuales
+    python cli.py limpiar-archivos                            # borra archivos generados vencidos
+
+Códigos de salida:
+    0  todo bien
+    1  error (excepción; el detalle sale en stderr)
+    2  argumentos inválidos
+    3  terminó, pero con filas con error o diferencias por revisar
+"""
+import argparse
+import datetime
+import os
+import sys
+import time
+import traceback
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+EXIT_OK = 0
+EXIT_ERROR = 1
+EXIT_WARNINGS = 3
+
+RECALC_CHUNK = 2000 # cotizaciones por lote al recalcular (avance visible y transacciones cortas)
+
+class Progress:
+    # Misma firma que el progress(fraccion, mensaje) de catalogs / jobs; imprime en stderr
+    def __init__(self, quiet=False):
+        self.quiet = quiet
+        self.started = time.perf_counter()
+
+    def __call__(self, fraction, message=""):
+        if not self.quiet:
+            elapsed = time.perf_counter() - self.started
+            print(f"[{fraction * 100:5.1f}% {elapsed:6.1f}s] {message}", file=sys.stderr, flush=True)
+
+# --- COMANDOS ---
+def cmd_init(db, args, progress):
+    # prepare_database() ya corrió en main(): aquí solo se reporta el estado
+    from models import User, ExpenseType, ExchangeRate
+    from services import get_active_rate
+    print(f"✅ BD lista: {db.query(User).count()} usuarios, {db.query(ExpenseType).count()} tipos de gasto, "
+          f"tasa activa Q{get_active_rate(db):,.2f} ({db.query(ExchangeRate).count()} registradas).")
+    return EXIT_OK
+
+IMPORTERS = {
+    "insumos": ("read_insumos_file", "import_insumos"),
+    "tipos": ("read_types_file", "import_activity_types"),
+    "ois": ("read_ois_file", "import_ois"),
+    "proveedores": ("read_providers_file", "import_providers"),
+}
+
+def cmd_import(db, args, progress):
+    import catalogs
+    if not os.path.isfile(args.archivo):
+        raise FileNotFoundError(f"No existe el archivo: {args.archivo}")
+    reader, importer = IMPORTERS[args.catalogo]
+    chunks = getattr(catalogs, reader)(args.archivo, os.path.basename(args.archivo), progress=progress)
+    result = getattr(catalogs, importer)(db, chunks)
+    progress(1.0, "Carga terminada")
+
+    print(f"✨ {result['created']} nuevos · ✏️ {result.get('updated', 0)} actualizados · ⏭️ {result.get('skipped', 0)} omitidos")
+    problems = result.get("errors", []) + result.get("warnings", [])
+    for problem in problems:
+        print(f"  ❌ {problem}", file=sys.stderr)
+    return EXIT_WARNINGS if result.get("errors") else EXIT_OK
+
+EXPORTS = {
+    "odc": ("odc_report", "reporte_odc"),
+    "caja-chica": ("caja_chica_report", "caja_chica_contable"),
+    "pagos-host": ("host_payouts", "pagos_talentos"),
+}
+
+def cmd_export(db, args, progress):
+    import reports
+    report, basename = EXPORTS[args.reporte]
+    progress(0.1, f"Consultando {args.reporte} del {args.desde} al {args.hasta}...")
+    df = getattr(reports, report)(db, args.desde, args.hasta)
+    if df.empty:
+        print("No hay datos en ese rango de fechas.")
+        return EXIT_OK
+
+    ext, _ = reports.EXPORT_FORMATS[args.formato]
+    path = args.salida or os.path.join(args.cwd, f"{basename}_{args.desde:%Y%m%d}_{args.hasta:%Y%m%d}.{ext}")
+    progress(0.5, f"Generando {args.formato} ({len(df)} filas)...")
+    data = reports.dataframe_to_bytes(df, args.formato)
+    # Escritura atómica: un cron que lea el archivo nunca lo ve a medias
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    progress(1.0, "Archivo guardado")
+    print(f"📄 {len(df)} filas exportadas a {path}")
+    return EXIT_OK
+
+def cmd_recalc(db, args, progress):
+    from models import Quote
+    from services import reprice_quotes, get_active_rate, REPRICE_STATUSES
+    statuses = args.estado or list(REPRICE_STATUSES)
+    q_ids = db.query(Quote.id).filter(Quote.status.in_(statuses))
+    if args.ids:
+        q_ids = q_ids.filter(Quote.id.in_(args.ids))
+    target_ids = [r.id for r in q_ids.order_by(Quote.id)]
+    if not target_ids:
+        print("No hay cotizaciones que recalcular.")
+        return EXIT_OK
+
+    rate = get_active_rate(db) # Misma tasa para todos los lotes
+    done = 0
+    for start in range(0, len(target_ids), RECALC_CHUNK):
+        done += reprice_quotes(db, quote_ids=target_ids[start:start + RECALC_CHUNK], statuses=statuses, rate=rate)
+        progress(done / len(target_ids), f"{done} de {len(target_ids)} cotizaciones")
+    print(f"🧮 {done} cotizaciones recalculadas (tasa Q{rate:,.2f}).")
+    return EXIT_OK
+
+def cmd_reconcile(db, args, progress):
+    from services import reconcile_quote_spend
+    progress(0.2, "Sumando gastos por cotización...")
+    mismatches = reconcile_quote_spend(db, fix=not args.solo_revisar)
+    progress(1.0, "Conciliación terminada")
+    if not mismatches:
+        print("✅ Todo cuadra: el gasto acumulado coincide con los gastos registrados.")
+        return EXIT_OK
+    verb = "con diferencias" if args.solo_revisar else "corregidas"
+    print(f"🛠️ {len(mismatches)} cotizaciones {verb}.")
+    for m in mismatches:
+        print(f"  #{m['id']}: Q{m['spent_gtq']:,.2f} / ${m['spent_usd']:,.2f} ({m['expense_count']} gastos)")
+    return EXIT_WARNINGS if args.solo_revisar else EXIT_OK
+
+def cmd_anomalies(db, args, progress):
+    from anomalies import rescore_expenses
+    progress(0.2, "Calculando estadísticas por OI, categoría y proveedor...")
+    flagged = rescore_expenses(db)
+    progress(1.0, "Revisión terminada")
+    print(f"🚩 {flagged} gastos marcados para revisión." if flagged else "✅ No se encontraron gastos inusuales.")
+    return EXIT_OK
+
+def cmd_evict(db, args, progress):
+    from artifacts import evict_artifacts
+    removed = evict_artifacts()
+    print(f"🗑️ {removed} archivos eliminados.")
+    return EXIT_OK
+
+# --- ARGUMENTOS ---
+def _date(value):
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Fecha inválida (use AAAA-MM-DD): {value}")
+
+def build_parser():
+    from reports import EXPORT_FORMATS
+    parser = argparse.ArgumentParser(prog="cli.py", description="Tareas por lotes del Cotizador (sin Streamlit).")
+    parser.add_argument("-q", "--quiet", action="store_true", help="No imprimir el avance (solo el resumen)")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    p = sub.add_parser("init", help="Crear / migrar el esquema y sembrar datos iniciales")
+    p.set_defaults(func=cmd_init)
+
+    p = sub.add_parser("importar", help="Carga masiva de un catálogo (CSV / Excel)")
+    p.add_argument("catalogo", choices=list(IMPORTERS))
+    p.add_argument("archivo")
+    p.set_defaults(func=cmd_import)
+
+    p = sub.add_parser("exportar", help="Exportar un reporte a archivo")
+    p.add_argument("reporte", choices=list(EXPORTS))
+    p.add_argument("--desde", type=_date, default=datetime.date.today().replace(day=1))
+    p.add_argument("--hasta", type=_date, default=datetime.date.today())
+    p.add_argument("--formato", choices=list(EXPORT_FORMATS), default="CSV")
+    p.add_argument("--salida", help="Ruta del archivo (por defecto: nombre del reporte + fechas)")
+    p.set_defaults(func=cmd_export)
+
+    p = sub.add_parser("recalcular", help="Recalcular líneas y totales con costos y tasa vigentes")
+    p.add_argument("--estado", nargs="+", default=None,
+                   help="Estados a recalcular (por defecto BORRADOR ENVIADA: lo aprobado no cambia)")
+    p.add_argument("--ids", nargs="+", type=int, help="Solo estas cotizaciones")
+    p.set_defaults(func=cmd_recalc)
+
+    p = sub.add_parser("conciliar", help="Conciliar el gasto acumulado por actividad")
+    p.add_argument("--solo-revisar", action="store_true", help="Reportar diferencias sin corregir (sale con 3 si hay)")
+    p.set_defaults(func=cmd_reconcile)
+
+    p = sub.add_parser("anomalias", help="Recalificar gastos inusuales")
+    p.set_defaults(func=cmd_anomalies)
+
+    p = sub.add_parser("limpiar-archivos", help="Borrar archivos generados vencidos o que exceden el tamaño")
+    p.set_defaults(func=cmd_evict)
+    return parser
+
+def main(argv=None):
+    # La app usa rutas relativas (BD local, artifacts/, imágenes): se trabaja desde
+    # su carpeta y los archivos del usuario se resuelven contra el directorio actual.
+    cwd = os.getcwd()
+    os.chdir(ROOT)
+    args = build_parser().parse_args(argv)
+    for attr in ("archivo", "salida"):
+        if getattr(args, attr, None):
+            setattr(args, attr, os.path.join(cwd, getattr(args, attr)))
+    args.cwd = cwd
+    progress = Progress(args.quiet)
+
+    from bootstrap import prepare_database
+    from database import SessionLocal
+    db = None
+    try:
+        prepare_database()
+        db = SessionLocal()
+        return args.func(db, args, progress)
+    except Exception as e:
+        if db is not None:
+            db.rollback()
+        traceback.print_exc()
+        print(f"❌ {args.comando}: {e}", file=sys.stderr)
+        return EXIT_ERROR
+    finally:
+        if db is not None:
+            db.close()
+
+if __name__ == "__main__":
+    sys.exit(main())
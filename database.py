@@ -1,5 +1,8 @@
 import streamlit as st
-from sqlalchemy import create_engine
+import gc
+import threading
+import weakref
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
@@ -8,11 +11,11 @@ import os
 try:
     # Intenta leer la URL de los secretos de Streamlit (Nube)
     database_url = st.secrets["connections"]["postgresql"]["url"]
-    
+
     # Corrige el formato si viene como postgres://
     if database_url.startswith("postgres://"):
         database_url = database_url.replace("postgres://", "postgresql://", 1)
-        
+
     print("☁️ Conectando a Base de Datos en la Nube (PostgreSQL)...")
 
 except Exception:
@@ -20,14 +23,164 @@ except Exception:
     print("💻 Conectando a Base de Datos Local (SQLite)...")
     database_url = "sqlite:///./local_backup.db"
 
-engine = create_engine(database_url)
+IS_SQLITE = database_url.startswith("sqlite")
+
+# ==============================================================================
+# PERFIL SQLITE (DESPLIEGUE LOCAL CON VARIAS SESIONES)
+# ==============================================================================
+# WAL: los lectores no bloquean al escritor ni viceversa.
+# busy_timeout: en vez de fallar con "database is locked", espera su turno.
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "busy_timeout": 15000,          # ms
+    "synchronous": "NORMAL",        # seguro con WAL y mucho más rápido que FULL
+    "mmap_size": 268435456,         # 256 MB mapeados en memoria para lecturas
+    "cache_size": -65536,           # negativo = KiB -> 64 MB de caché de páginas
+    "temp_store": "MEMORY",
+}
+# Las conexiones de solo lectura no pueden cambiar el journal_mode
+SQLITE_READ_PRAGMAS = {k: v for k, v in SQLITE_PRAGMAS.items() if k not in ("journal_mode", "synchronous")}
+SQLITE_READ_PRAGMAS["query_only"] = 1
+
+# Tiempo máximo (segundos) que una sesión espera su turno en la cola de escritura
+WRITER_TIMEOUT = 30
+
+def _pragma_listener(pragmas):
+    def set_pragmas(dbapi_conn, conn_record):
+        cursor = dbapi_conn.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+    return set_pragmas
+
+if IS_SQLITE:
+    # Streamlit atiende cada sesión en su propio hilo: se permite compartir conexiones del pool
+    engine = create_engine(database_url, connect_args={"check_same_thread": False, "timeout": 15})
+    event.listen(engine, "connect", _pragma_listener(SQLITE_PRAGMAS))
+
+    # Pool aparte, en modo solo lectura, para el Dashboard y consultas pesadas
+    ro_url = f"sqlite:///file:{engine.url.database}?mode=ro&uri=true"
+    read_engine = create_engine(ro_url, connect_args={"check_same_thread": False, "timeout": 15})
+    event.listen(read_engine, "connect", _pragma_listener(SQLITE_READ_PRAGMAS))
+else:
+    engine = create_engine(database_url)
+    read_engine = engine
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
 
 Base = declarative_base()
 
+# ==============================================================================
+# COLA DE ESCRITURA (UN SOLO ESCRITOR POR PROCESO EN SQLITE)
+# ==============================================================================
+# SQLite admite un único escritor a la vez. En lugar de que varias sesiones
+# compitan (y alguna reciba "database is locked"), la primera escritura de una
+# transacción toma el turno y lo suelta al terminar (commit o rollback).
+# El turno es de la SESIÓN: se suelta al hacer commit / rollback, al cerrarla o
+# cuando el recolector de basura la elimina (una página que falló, hizo st.stop
+# o st.rerun entre el flush y el commit deja su sesión abandonada). Si el turno
+# está ocupado se corre gc.collect() una vez antes de esperar, así una sesión
+# abandonada no bloquea las escrituras de todo el proceso.
+# No se permiten sesiones de escritura ANIDADAS en el mismo hilo (abrir otra
+# SessionLocal y escribir mientras la primera tiene cambios sin commit): la
+# segunda nunca obtendría el turno. En ese caso se falla de inmediato con un
+# error claro en vez de esperar WRITER_TIMEOUT. Confirmar (commit) antes.
+_writer_lock = threading.Lock()
+_writer_state = {"thread": None} # hilo que tiene el turno (a lo sumo uno)
+
+class _WriterTurn:
+    # Se suelta una sola vez, sea por commit/rollback/cierre o por el finalizador de la sesión
+    def __init__(self):
+        self.thread = threading.get_ident()
+        self.held = True
+
+    def release(self):
+        if self.held:
+            self.held = False
+            _writer_state["thread"] = None
+            _writer_lock.release()
+
+def _acquire_writer(session):
+    if session.info.get("sqlite_writer"):
+        return
+    if not _writer_lock.acquire(blocking=False):
+        gc.collect() # Suelta los turnos de sesiones abandonadas que ya nadie referencia
+        if _writer_state["thread"] == threading.get_ident():
+            raise RuntimeError(
+                "Escritura anidada: este hilo ya tiene otra sesión con cambios sin confirmar. "
+                "Haz commit de esa sesión antes de escribir con una nueva."
+            )
+        if not _writer_lock.acquire(timeout=WRITER_TIMEOUT):
+            raise TimeoutError("La base de datos está ocupada con otras escrituras. Intenta de nuevo en unos segundos.")
+    _writer_state["thread"] = threading.get_ident()
+    turn = _WriterTurn()
+    session.info["sqlite_writer"] = turn
+    # El finalizador no debe referenciar la sesión (si no, nunca se recolectaría)
+    session.info["sqlite_writer_finalizer"] = weakref.finalize(session, turn.release)
+
+def _release_writer(session, *args):
+    # Puede ejecutarse en otro hilo (p.ej. al cerrar la sesión): se libera igual
+    turn = session.info.pop("sqlite_writer", None)
+    finalizer = session.info.pop("sqlite_writer_finalizer", None)
+    if finalizer is not None:
+        finalizer.detach()
+    if turn is not None:
+        turn.release()
+
+if IS_SQLITE:
+    @event.listens_for(SessionLocal, "before_flush")
+    def _writer_before_flush(session, flush_context, instances):
+        _acquire_writer(session)
+
+    @event.listens_for(SessionLocal, "do_orm_execute")
+    def _writer_bulk_statements(orm_execute_state):
+        # INSERT ... SELECT, UPDATE/DELETE masivos (no pasan por flush)
+        if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+            _acquire_writer(orm_execute_state.session)
+
+    @event.listens_for(SessionLocal, "after_transaction_end")
+    def _writer_transaction_end(session, transaction):
+        if transaction.parent is None:
+            _release_writer(session)
+
+    # Un flush fallido hace rollback en la BD aunque la sesión siga abierta
+    event.listen(SessionLocal, "after_rollback", _release_writer)
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+# Sesiones de página: una por sesión del navegador y página (o fragmento).
+# Streamlit no avisa cuando termina una ejecución del script, así que la sesión
+# de la ejecución anterior se cierra (rollback de lo que haya quedado sin
+# confirmar) al empezar la siguiente. Se guardan con referencia débil para no
+# impedir que el recolector las elimine si la página ya no las usa.
+_page_sessions = weakref.WeakValueDictionary()
+_page_sessions_lock = threading.Lock()
+
+def page_db(scope="page", read=False):
+    # read=True: pool de solo lectura (Dashboard, consultas pesadas)
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+    ctx = get_script_run_ctx(suppress_warning=True)
+    db = ReadSessionLocal() if read else SessionLocal()
+    if ctx is None: # Fuera de Streamlit (scripts, pruebas)
+        return db
+    key = (ctx.session_id, ctx.page_script_hash, scope, read)
+    with _page_sessions_lock:
+        previous = _page_sessions.get(key)
+        _page_sessions[key] = db
+    if previous is not None:
+        previous.close()
+    return db
+
+def get_read_db():
+    # Sesión para lecturas (Dashboard): en SQLite usa el pool de solo lectura
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
@@ -0,0 +1,269 @@
+import io
+import os
+import re
+import json
+import hashlib
+import datetime
+
+# ==============================================================================
+# GENERACIÓN DE DOCUMENTOS (PDF / ZIP)
+# ==============================================================================
+# ReportLab y zipfile se importan DENTRO de cada función: las páginas que solo
+# registran una ODC o consultan datos no pagan el costo de cargarlos.
+
+HEADER_IMG_PATH = "header_spectrummedia.png"
+FIRMA_IMG_PATH = "firma.png"
+
+def format_date_es(d):
+    meses = ["", "enero", "febrero", "marzo", "abril", "mayo", "junio", "julio", "agosto", "septiembre", "octubre", "noviembre", "diciembre"]
+    return f"{d.day} de {meses[d.month]} de {d.year}"
+
+def build_host_receipt_pdf(prov, rows, total_host, date_doc, recibo_id_str):
+    from reportlab.lib.pagesizes import LETTER
+    from reportlab.pdfgen import canvas
+    from reportlab.lib import colors
+
+    width, height = LETTER
+
+    buff_recibo = io.BytesIO()
+    p = canvas.Canvas(buff_recibo, pagesize=LETTER)
+    if os.path.exists(HEADER_IMG_PATH): p.drawImage(HEADER_IMG_PATH, 0, height-100, width=width, height=100, preserveAspectRatio=False, mask='auto')
+    else: p.setFillColor(colors.black); p.rect(0, height-80, width, 80, fill=1); p.setFillColor(colors.white); p.setFont("Helvetica-Bold", 24); p.drawString(50, height-50, "spectrum media")
+
+    p.setFillColor(colors.white); p.setFont("Helvetica-Bold", 18); p.drawRightString(width - 50, height - 50, f"RECIBO #{recibo_id_str}")
+    p.setFillColor(colors.black); p.setFont("Helvetica-Bold", 12); y = height - 130
+    p.drawString(400, y, f"FECHA: {date_doc.strftime('%d/%m/%Y')}")
+    p.drawString(50, y, "RECIBO DE: SPECTRUM MEDIA LAB"); p.drawString(50, y-20, f"RECIBO PARA: {prov.name.upper()}")
+    p.setFont("Helvetica", 10); p.drawString(50, y-60, f"Banco: {prov.bank_name}"); p.drawString(50, y-75, f"Nombre: {prov.name}"); p.drawString(50, y-90, f"Cuenta: {prov.account_number}")
+
+    y_table = y - 140; p.setFont("Helvetica-Bold", 10)
+    p.drawString(50, y_table, "DESCRIPCION"); p.drawString(350, y_table, "TARIFA"); p.drawString(420, y_table, "DIAS"); p.drawString(500, y_table, "TOTAL")
+    p.line(50, y_table-5, 550, y_table-5)
+
+    y_row = y_table - 25; p.setFont("Helvetica", 10)
+    for row in rows:
+        p.drawString(50, y_row, row["desc"])
+        p.drawString(350, y_row, f"Q{row['rate']:,.2f}")
+        p.drawString(430, y_row, str(row['days']))
+        p.drawString(500, y_row, f"Q{row['rate']*row['days']:,.2f}")
+        p.line(50, y_row-5, 550, y_row-5); y_row -= 25
+
+    p.setFont("Helvetica-Bold", 14); p.drawString(50, y_row-20, "TOTAL PAGADO"); p.drawString(500, y_row-20, f"Q{total_host:,.2f}")
+    p.line(200, 100, 400, 100); p.setFont("Helvetica", 8); p.drawCentredString(300, 85, "FIRMA DE CONFORMIDAD"); p.save(); buff_recibo.seek(0)
+    return buff_recibo.getvalue()
+
+def build_host_contract_pdf(prov, total_host, date_doc, contract_desc):
+    # MODELO EXACTO SEGÚN REFERENCIA
+    from reportlab.lib.pagesizes import LETTER
+    from reportlab.pdfgen import canvas
+    from reportlab.lib import colors
+    from reportlab.lib.enums import TA_JUSTIFY, TA_CENTER, TA_RIGHT
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.platypus import Paragraph
+
+    width, height = LETTER
+
+    buff_contrato = io.BytesIO()
+    c = canvas.Canvas(buff_contrato, pagesize=LETTER)
+
+    # --- Encabezado (Imagen superior) ---
+    if os.path.exists(HEADER_IMG_PATH):
+        c.drawImage(HEADER_IMG_PATH, 0, height-100, width=width, height=100, preserveAspectRatio=False, mask='auto')
+
+    styles = getSampleStyleSheet()
+
+    # --- Asunto y Fecha (Alineado a la derecha) ---
+    style_right = ParagraphStyle(name='Right', parent=styles['Normal'], alignment=TA_RIGHT, fontSize=10, leading=14)
+    fecha_str = format_date_es(date_doc)
+    p_asunto = Paragraph(f"<b>Asunto: Brand Activation Ambassador</b><br/><br/>En la fecha: <b>{fecha_str}</b>.", style_right)
+    w, h = p_asunto.wrap(width - 100, 100)
+    p_asunto.drawOn(c, 50, height - 160)
+
+    # --- Cuerpo del Contrato (Justificado) ---
+    style_justify = ParagraphStyle(name='Justify', parent=styles['Normal'], alignment=TA_JUSTIFY, fontSize=10, leading=14, spaceAfter=14)
+    cui_val = getattr(prov, 'cui', 'N/A')
+
+    txt_1 = f"Yo, <b>{prov.name}</b> me identifico con el Documento Personal de Identificación (DPI) con Código Único de Identificación (CUI) No. <b>{cui_val}</b>, por medio de la presente acuerdo prestar servicios como <b>BRAND ACTIVATION AMBASSADOR - {contract_desc.upper()}</b> para SPECTRUM MEDIA prestando un servicio y realizando actividades relacionadas con promoción de producto, eventos o generación de contenido, según lo asignado."
+
+    txt_2 = f"Como compensación por estos servicios, se entregará un pago único de <b>Q.{total_host:,.2f}</b>, el día y lugar que me ha sido notificado previamente."
+
+    txt_3 = "En consecuencia, ambas partes reconocen expresamente que:<br/>• No existe entre ellas relación laboral de ningún tipo, conforme a la legislación laboral vigente.<br/>• No se genera ninguna obligación de carácter laboral, tales como pago de salarios, prestaciones laborales, indemnizaciones, o cualquier otro derecho laboral que derive de una relación de trabajo subordinado.<br/>• Cada parte actúa de forma autónoma, sin que exista dependencia, ni vínculo permanente más allá del objeto del contrato de servicios."
+
+    txt_4 = f"La presente notificación tiene como finalidad reiterar la naturaleza de la prestación de servicios, y dejar claro que no se establece, ni se presumirá, ningún tipo de vínculo laboral entre Spectrum Media y {prov.name}."
+
+    # Dibujar los párrafos en orden calculando el alto dinámicamente
+    y_curr = height - 210
+    for txt in [txt_1, txt_2, txt_3, txt_4]:
+        p = Paragraph(txt, style_justify)
+        w, h = p.wrap(width - 100, height)
+        p.drawOn(c, 50, y_curr - h)
+        y_curr -= (h + 16) # Espacio entre párrafos
+
+    # --- ZONA DE FIRMAS (Centradas) ---
+    center_x = width / 2
+    style_center = ParagraphStyle(name='Center', parent=styles['Normal'], alignment=TA_CENTER, fontSize=9, leading=11)
+
+    # 1. Línea y texto del Talento (Brand Ambassador)
+    y_sig1_line = y_curr - 40
+    c.setLineWidth(1)
+    c.setStrokeColor(colors.black)
+    c.line(center_x - 120, y_sig1_line, center_x + 120, y_sig1_line)
+
+    p_sig1 = Paragraph(f"<b>Firma del Brand Ambassador</b><br/>{prov.name}", style_center)
+    w, h = p_sig1.wrap(240, 50)
+    p_sig1.drawOn(c, center_x - 120, y_sig1_line - h - 5)
+
+    # 2. Insertar Imagen de la Firma (en medio)
+    y_sig2_line = y_sig1_line - 100 # Espacio hacia la segunda línea
+
+    if os.path.exists(FIRMA_IMG_PATH):
+        img_w, img_h = 130, 60 # Tamaño aproximado de la firma
+        img_x = center_x - (img_w / 2)
+        img_y = y_sig2_line + 15 # Posicionada un poco por encima de la segunda línea
+        c.drawImage(FIRMA_IMG_PATH, img_x, img_y, width=img_w, height=img_h, mask='auto', preserveAspectRatio=True)
+
+    # 3. Línea y texto de la Empresa
+    c.line(center_x - 120, y_sig2_line, center_x + 120, y_sig2_line)
+
+    p_sig2 = Paragraph("<b>Firma del responsable de la empresa:</b><br/>Maria Jose Aguilar, Product Executive", style_center)
+    w, h = p_sig2.wrap(240, 50)
+    p_sig2.drawOn(c, center_x - 120, y_sig2_line - h - 5)
+
+    c.save()
+    buff_contrato.seek(0)
+    return buff_contrato.getvalue()
+
+def build_host_pack_zip(prov, rows, total_host, date_doc, contract_desc, recibo_id_str):
+    # Recibo + Contrato empaquetados en un ZIP
+    import zipfile
+
+    recibo_pdf = build_host_receipt_pdf(prov, rows, total_host, date_doc, recibo_id_str)
+    contrato_pdf = build_host_contract_pdf(prov, total_host, date_doc, contract_desc)
+
+    zip_buffer = io.BytesIO()
+    with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
+        zip_file.writestr(f"Recibo_{recibo_id_str}.pdf", recibo_pdf)
+        zip_file.writestr(f"Contrato_{recibo_id_str}.pdf", contrato_pdf)
+    return zip_buffer.getvalue()
+
+# ==============================================================================
+# PROPUESTA PARA CLIENTE
+# ==============================================================================
+# El PDF se identifica por el hash de sus DATOS (ver reports.proposal_content):
+# si la cotización no cambió, la clave ya existe en el almacén y se descarga
+# sin volver a generarlo. Subir PROPOSAL_LAYOUT invalida todo al cambiar el diseño.
+
+PROPOSAL_LAYOUT = 2
+
+def _header_signature():
+    if not os.path.exists(HEADER_IMG_PATH):
+        return None
+    stat = os.stat(HEADER_IMG_PATH)
+    return [stat.st_size, int(stat.st_mtime)]
+
+def proposal_digest(content):
+    payload = {"layout": PROPOSAL_LAYOUT, "header": _header_signature(), "content": content}
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+def proposals_digest(digests):
+    # Hash de un lote (ZIP): depende de cada propuesta y del orden
+    return hashlib.sha256("|".join(digests).encode("utf-8")).hexdigest()
+
+def proposal_filename(content):
+    safe_name = re.sub(r"[^\w\-]+", "_", content["activity_name"]).strip("_")
+    return f"Propuesta_{content['id']:05d}_{safe_name}.pdf"
+
+def proposal_bundle(contents, quote_ids):
+    # (hash, nombre, mime) del archivo a descargar: PDF si es una sola, ZIP si son varias
+    ids = [i for i in quote_ids if i in contents]
+    digests = [proposal_digest(contents[i]) for i in ids]
+    if len(ids) == 1:
+        return digests[0], proposal_filename(contents[ids[0]]), "application/pdf"
+    return proposals_digest(digests), f"Propuestas_{len(ids)}.zip", "application/zip"
+
+def build_quote_proposal_pdf(content):
+    from xml.sax.saxutils import escape
+    from reportlab.lib.pagesizes import LETTER
+    from reportlab.lib import colors
+    from reportlab.lib.enums import TA_RIGHT
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+
+    width, height = LETTER
+
+    def header(c, doc):
+        # Encabezado solo en la primera página (igual que el recibo)
+        c.saveState()
+        if os.path.exists(HEADER_IMG_PATH): c.drawImage(HEADER_IMG_PATH, 0, height-100, width=width, height=100, preserveAspectRatio=False, mask='auto')
+        else: c.setFillColor(colors.black); c.rect(0, height-80, width, 80, fill=1); c.setFillColor(colors.white); c.setFont("Helvetica-Bold", 24); c.drawString(50, height-50, "spectrum media")
+        c.setFillColor(colors.white); c.setFont("Helvetica-Bold", 18); c.drawRightString(width - 50, height - 50, f"PROPUESTA #{content['id']:05d}")
+        c.restoreState()
+
+    def footer(c, doc):
+        c.saveState(); c.setFont("Helvetica", 8); c.setFillColor(colors.grey)
+        c.drawRightString(width - 50, 30, f"Propuesta #{content['id']:05d} - Página {doc.page}")
+        c.restoreState()
+
+    styles = getSampleStyleSheet()
+    style_right = ParagraphStyle(name='Right', parent=styles['Normal'], alignment=TA_RIGHT, fontSize=10, leading=14)
+    style_cell = ParagraphStyle(name='Cell', parent=styles['Normal'], fontSize=9, leading=11)
+    style_desc = ParagraphStyle(name='Desc', parent=style_cell, fontSize=7, textColor=colors.grey)
+
+    story = []
+    if content["date"]:
+        fecha = format_date_es(datetime.date.fromisoformat(content["date"]))
+        story.append(Paragraph(f"Guatemala, {fecha}", style_right))
+        story.append(Spacer(1, 16))
+    story.append(Paragraph(f"<b>PROPUESTA COMERCIAL: {escape(content['activity_name']).upper()}</b>", styles['Heading2']))
+    details = [t for t in [content["activity_type"], content["mall"]] if t]
+    if details:
+        story.append(Paragraph(escape(" | ".join(details)), styles['Normal']))
+    story.append(Spacer(1, 14))
+
+    # --- Detalle agrupado por categoría ---
+    rows = [["DESCRIPCION", "CANTIDAD", "UNIDADES", "MONTO (USD)"]]
+    row_styles = []
+    for group in content["groups"]:
+        row_styles.append(('BACKGROUND', (0, len(rows)), (-1, len(rows)), colors.HexColor("#EEEEEE")))
+        row_styles.append(('FONTNAME', (0, len(rows)), (-1, len(rows)), 'Helvetica-Bold'))
+        rows.append([group["category"].upper(), "", "", ""])
+        for line in group["lines"]:
+            desc = [Paragraph(escape(line["name"]), style_cell)]
+            if line["description"]:
+                desc.append(Paragraph(escape(line["description"]), style_desc))
+            rows.append([desc, f"{line['qty']:g}", f"{line['units']:g} {line['unit_type']}".strip(), f"${line['amount']:,.2f}"])
+        row_styles.append(('FONTNAME', (0, len(rows)), (-1, len(rows)), 'Helvetica-Bold'))
+        rows.append([f"Subtotal {group['category']}", "", "", f"${group['subtotal']:,.2f}"])
+    row_styles.append(('FONTNAME', (0, len(rows)), (-1, len(rows)), 'Helvetica-Bold'))
+    row_styles.append(('FONTSIZE', (0, len(rows)), (-1, len(rows)), 12))
+    row_styles.append(('LINEABOVE', (0, len(rows)), (-1, len(rows)), 1, colors.black))
+    rows.append(["TOTAL", "", "", f"${content['total']:,.2f}"])
+
+    table = Table(rows, colWidths=[270, 70, 80, 92], repeatRows=1)
+    table.setStyle(TableStyle([
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, -1), 9),
+        ('LINEBELOW', (0, 0), (-1, 0), 1, colors.black),
+        ('LINEBELOW', (0, 1), (-1, -2), 0.25, colors.lightgrey),
+        ('ALIGN', (1, 0), (-1, -1), 'RIGHT'),
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+    ] + row_styles))
+    story.append(table)
+    story.append(Spacer(1, 20))
+    story.append(Paragraph(f"{content['price_source']}. Precios en dólares (USD). Propuesta sujeta a disponibilidad y confirmación de fechas.", style_desc))
+
+    buff = io.BytesIO()
+    doc = SimpleDocTemplate(buff, pagesize=LETTER, leftMargin=50, rightMargin=50, topMargin=120, bottomMargin=50,
+                            title=f"Propuesta {content['activity_name']}", invariant=1)
+    doc.build(story, onFirstPage=lambda c, d: (header(c, d), footer(c, d)), onLaterPages=footer)
+    return buff.getvalue()
+
+def build_proposals_zip(files):
+    # files: [(nombre, bytes)] -> un solo ZIP para el lote
+    import zipfile
+
+    zip_buffer = io.BytesIO()
+    with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
+        for name, data in files:
+            zip_file.writestr(name, data)
+    return zip_buffer.getvalue()
@@ -0,0 +1,79 @@
+import copy
+import streamlit as st
+from sqlalchemy import update, delete
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from database import SessionLocal
+from models import UserDraft
+
+# ==============================================================================
+# BORRADORES DEL USUARIO EN LA BASE DE DATOS
+# ==============================================================================
+# La cotización que se está editando y las filas del recibo Host ya no viven
+# solo en st.session_state (memoria de UN proceso): se guardan por usuario en la
+# tabla user_drafts. Cualquier réplica del servidor puede retomar el trabajo, y
+# si el usuario vuelve a entrar continúa donde lo dejó.
+# st.session_state queda como caché local de la sesión.
+
+_SAVED_PREFIX = "_draft_saved_"
+
+# --- ACCESO A BD ---
+def load_draft(db: Session, user_id, key, default=None):
+    value = db.query(UserDraft.value).filter(UserDraft.user_id == user_id, UserDraft.key == key).scalar()
+    return default if value is None else value
+
+def save_draft(db: Session, user_id, key, value):
+    # Upsert portable (SQLite / Postgres): UPDATE y, si no existía, INSERT
+    result = db.execute(
+        update(UserDraft).where(UserDraft.user_id == user_id, UserDraft.key == key).values(value=value)
+    )
+    if result.rowcount == 0:
+        db.add(UserDraft(user_id=user_id, key=key, value=value))
+        try:
+            db.commit()
+        except IntegrityError:
+            # Otra réplica lo creó al mismo tiempo: se actualiza el suyo
+            db.rollback()
+            db.execute(update(UserDraft).where(UserDraft.user_id == user_id, UserDraft.key == key).values(value=value))
+            db.commit()
+    else:
+        db.commit()
+
+def delete_draft(db: Session, user_id, key):
+    db.execute(delete(UserDraft).where(UserDraft.user_id == user_id, UserDraft.key == key))
+    db.commit()
+
+# --- AYUDAS PARA LAS PÁGINAS (session_state + BD) ---
+def _user_id():
+    return st.session_state.get("user_id")
+
+def draft_state(key, default=None):
+    # Lee de la sesión; si la sesión es nueva (otra réplica, re-login) la retoma de la BD
+    if key not in st.session_state:
+        value = default
+        if _user_id() is not None:
+            with SessionLocal() as s:
+                value = load_draft(s, _user_id(), key, default)
+        st.session_state[key] = copy.deepcopy(value)
+        st.session_state[_SAVED_PREFIX + key] = copy.deepcopy(value)
+    return st.session_state[key]
+
+def set_draft_state(key, value):
+    st.session_state[key] = value
+    autosave_draft(key)
+
+def autosave_draft(key):
+    # Guarda solo si cambió desde el último guardado (no escribe en cada rerun)
+    value = st.session_state.get(key)
+    if _user_id() is None or st.session_state.get(_SAVED_PREFIX + key) == value:
+        return
+    with SessionLocal() as s:
+        save_draft(s, _user_id(), key, value)
+    st.session_state[_SAVED_PREFIX + key] = copy.deepcopy(value)
+
+def clear_draft_state(key, default=None):
+    st.session_state[key] = copy.deepcopy(default)
+    st.session_state[_SAVED_PREFIX + key] = copy.deepcopy(default)
+    if _user_id() is not None:
+        with SessionLocal() as s:
+            delete_draft(s, _user_id(), key)
@@ -0,0 +1,108 @@
+import os
+import threading
+import itertools
+from collections import deque
+
+# ==============================================================================
+# CONTROL DE ADMISIÓN PARA OPERACIONES PESADAS
+# ==============================================================================
+# Cada clase de operación tiene un máximo de ejecuciones simultáneas y una cola
+# limitada. Si la cola está llena la operación se rechaza con un mensaje claro
+# (en vez de saturar el proceso y la BD para todos). Así la edición de
+# cotizaciones sigue rápida aunque haya cierre de mes con exportaciones.
+#   - export / import / pdf / maintenance: trabajos en segundo plano (jobs.py los reparte)
+#   - dashboard: consultas pesadas del Dashboard (compuerta en este proceso)
+
+def _env_int(name, default):
+    return int(os.environ.get(name, str(default)))
+
+OPERATION_LIMITS = {
+    "export": _env_int("COTIZADOR_LIMIT_EXPORT", 1),
+    "import": _env_int("COTIZADOR_LIMIT_IMPORT", 1),
+    "pdf": _env_int("COTIZADOR_LIMIT_PDF", 2),
+    "dashboard": _env_int("COTIZADOR_LIMIT_DASHBOARD", 3),
+    "maintenance": _env_int("COTIZADOR_LIMIT_MAINTENANCE", 1),
+}
+
+MAX_QUEUE = {
+    "export": _env_int("COTIZADOR_QUEUE_EXPORT", 20),
+    "import": _env_int("COTIZADOR_QUEUE_IMPORT", 10),
+    "pdf": _env_int("COTIZADOR_QUEUE_PDF", 30),
+    "dashboard": _env_int("COTIZADOR_QUEUE_DASHBOARD", 10),
+    "maintenance": _env_int("COTIZADOR_QUEUE_MAINTENANCE", 5),
+}
+
+GATE_TIMEOUT = 60 # segundos máximos esperando turno antes de desistir
+
+OPERATION_LABELS = {
+    "export": "exportaciones",
+    "import": "cargas masivas",
+    "pdf": "documentos PDF",
+    "dashboard": "consultas del Dashboard",
+    "maintenance": "tareas de mantenimiento",
+}
+
+class OverloadError(RuntimeError):
+    # La operación se rechazó porque la cola de su clase está llena
+    def __init__(self, op_class):
+        self.op_class = op_class
+        super().__init__(
+            f"El sistema está atendiendo demasiadas {OPERATION_LABELS.get(op_class, op_class)} en este momento. "
+            "Intenta de nuevo en unos minutos."
+        )
+
+class Gate:
+    # Semáforo con cola FIFO: se puede consultar la posición de cada turno
+    def __init__(self, op_class, limit, max_queue):
+        self.op_class = op_class
+        self.limit = max(limit, 1)
+        self.max_queue = max_queue
+        self.running = 0
+        self.waiting = deque()
+        self._cond = threading.Condition()
+        self._tickets = itertools.count(1)
+
+    def enter(self):
+        # Pide turno; devuelve el ticket o lanza OverloadError si la cola está llena
+        with self._cond:
+            if self.running < self.limit and not self.waiting:
+                self.running += 1
+                return None
+            if len(self.waiting) >= self.max_queue:
+                raise OverloadError(self.op_class)
+            ticket = next(self._tickets)
+            self.waiting.append(ticket)
+            return ticket
+
+    def position(self, ticket):
+        with self._cond:
+            return self.waiting.index(ticket) + 1 if ticket in self.waiting else 0
+
+    def wait(self, ticket, timeout):
+        # True cuando el ticket obtuvo lugar; False si pasó el timeout sin turno
+        with self._cond:
+            got_slot = self._cond.wait_for(
+                lambda: self.waiting and self.waiting[0] == ticket and self.running < self.limit,
+                timeout=timeout
+            )
+            if got_slot:
+                self.waiting.popleft()
+                self.running += 1
+                self._cond.notify_all()
+            return got_slot
+
+    def abandon(self, ticket):
+        with self._cond:
+            if ticket in self.waiting:
+                self.waiting.remove(ticket)
+                self._cond.notify_all()
+
+    def leave(self):
+        with self._cond:
+            self.running = max(self.running - 1, 0)
+            self._cond.notify_all()
+
+_GATES = {op: Gate(op, OPERATION_LIMITS[op], MAX_QUEUE[op]) for op in OPERATION_LIMITS}
+
+def get_gate(op_class):
+    return _GATES[op_class]
@@ -0,0 +1,401 @@
+import os
+import socket
+import datetime
+import threading
+import traceback
+import uuid
+import streamlit as st
+from sqlalchemy import update, func, or_
+from sqlalchemy.orm import Session
+from database import SessionLocal
+from models import Job
+from artifacts import UPLOADS_DIR, put_artifact, evict_artifacts
+from governor import OPERATION_LIMITS, MAX_QUEUE, OverloadError
+
+# ==============================================================================
+# TRABAJOS EN SEGUNDO PLANO (COLA EN BD + HILOS TRABAJADORES)
+# ==============================================================================
+# Las páginas encolan el trabajo (submit_job) y consultan su estado; un pool de
+# hilos arrancado UNA vez por servidor lo ejecuta. Recargar la página ya no mata
+# una carga masiva ni una exportación grande.
+
+WORKER_COUNT = int(os.environ.get("COTIZADOR_JOB_WORKERS", "2"))
+POLL_INTERVAL = 2.0 # segundos entre revisiones cuando la cola está vacía
+# Espera antes de reintentar un trabajo fallido: base * 2^(intento - 1), con tope.
+# Un fallo pasajero (BD ocupada, archivo bloqueado) no agota los reintentos en milisegundos.
+RETRY_BASE_SECONDS = float(os.environ.get("COTIZADOR_JOB_RETRY_SECONDS", "10"))
+RETRY_MAX_SECONDS = 600
+
+# --- VARIAS RÉPLICAS DEL SERVIDOR ---
+# Los archivos subidos y los resultados viven en el disco de cada servidor
+# (artifacts/): un trabajo solo lo toma un proceso del MISMO servidor donde se
+# encoló. Si artifacts/ es un volumen compartido (COTIZADOR_SHARED_ARTIFACTS=1),
+# cualquier réplica puede tomarlo.
+# Cada proceso marca sus trabajos en curso con un latido; al arrancar (y
+# periódicamente) solo se reencolan los trabajos cuyo latido se perdió, nunca
+# los que otra réplica viva está ejecutando.
+HOST_NAME = os.environ.get("COTIZADOR_HOST_NAME") or socket.gethostname()
+WORKER_ID = f"{HOST_NAME}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+SHARED_ARTIFACTS = os.environ.get("COTIZADOR_SHARED_ARTIFACTS") == "1"
+HEARTBEAT_INTERVAL = 15 # segundos
+STALE_AFTER = 90        # sin latido por este tiempo = el proceso murió
+
+ACTIVE_STATUSES = ("PENDIENTE", "EN_PROCESO")
+FINAL_STATUSES = ("COMPLETADO", "ERROR", "CANCELADO")
+
+JOB_LABELS = {}
+JOB_CLASSES = {} # kind -> clase de operación (export / import / pdf), ver governor.py
+_HANDLERS = {}
+_wakeup = threading.Event()
+_claim_lock = threading.Lock()
+
+class JobCancelled(Exception):
+    pass
+
+def job_handler(kind, label, op_class):
+    # Registra la función que ejecuta un tipo de trabajo: fn(db, ctx, **params) -> mensaje
+    def register(fn):
+        _HANDLERS[kind] = fn
+        JOB_LABELS[kind] = label
+        JOB_CLASSES[kind] = op_class
+        return fn
+    return register
+
+def _now():
+    return datetime.datetime.utcnow()
+
+class JobContext:
+    # Lo recibe cada handler para reportar avance, revisar cancelación y guardar resultados.
+    # Ojo: progress() escribe con su propia sesión; llámalo sin escrituras pendientes de commit.
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.result = None
+
+    def progress(self, fraction, message=""):
+        with SessionLocal() as s:
+            s.execute(
+                update(Job).where(Job.id == self.job_id)
+                .values(progress=min(max(float(fraction), 0.0), 1.0), message=message, heartbeat_at=_now())
+            )
+            s.commit()
+        self.check_cancelled()
+
+    def check_cancelled(self):
+        with SessionLocal() as s:
+            if s.query(Job.cancel_requested).filter(Job.id == self.job_id).scalar():
+                raise JobCancelled()
+
+    def save_result(self, data: bytes, filename, mime, digest=None):
+        self.result = (put_artifact(data, filename, digest=digest), filename, mime)
+
+def save_upload(uploaded_file):
+    # El archivo subido se guarda en disco: el trabajo lo lee desde ahí
+    os.makedirs(UPLOADS_DIR, exist_ok=True)
+    path = os.path.join(UPLOADS_DIR, f"{uuid.uuid4().hex}_{os.path.basename(uploaded_file.name)}")
+    with open(path, "wb") as f:
+        f.write(uploaded_file.getbuffer())
+    return path
+
+# --- API PARA LAS PÁGINAS ---
+def submit_job(db: Session, kind, params=None, created_by=None, max_attempts=3):
+    if kind not in _HANDLERS:
+        raise ValueError(f"Tipo de trabajo desconocido: {kind}")
+    # Si la cola de esta clase ya está llena, se rechaza en vez de acumular
+    op_class = JOB_CLASSES[kind]
+    pending = db.query(func.count(Job.id)).filter(Job.status == "PENDIENTE", Job.kind.in_(_kinds_of(op_class))).scalar()
+    if pending >= MAX_QUEUE[op_class]:
+        raise OverloadError(op_class)
+    job = Job(kind=kind, params=params or {}, created_by=created_by, max_attempts=max_attempts, message="En cola", host=HOST_NAME)
+    db.add(job)
+    db.commit()
+    # Si se entró directo a una página sin pasar por app.py, el pool arranca aquí
+    start_workers()
+    _wakeup.set()
+    return job.id
+
+def cancel_job(db: Session, job_id):
+    # Pendiente: se cancela directo. En proceso: el handler lo detecta en su próximo progress()
+    db.execute(
+        update(Job).where(Job.id == job_id, Job.status == "PENDIENTE")
+        .values(status="CANCELADO", message="Cancelado", finished_at=_now())
+    )
+    db.execute(update(Job).where(Job.id == job_id, Job.status == "EN_PROCESO").values(cancel_requested=True))
+    db.commit()
+
+def retry_job(db: Session, job_id):
+    db.execute(
+        update(Job).where(Job.id == job_id, Job.status.in_(["ERROR", "CANCELADO"]))
+        .values(status="PENDIENTE", attempts=0, cancel_requested=False, progress=0.0, error=None, message="En cola", finished_at=None, run_after=None)
+    )
+    db.commit()
+    _wakeup.set()
+
+def _kinds_of(op_class):
+    return [k for k, c in JOB_CLASSES.items() if c == op_class]
+
+def queue_position(db: Session, job):
+    # Posición entre los pendientes de la misma clase (1 = el siguiente en correr)
+    return db.query(func.count(Job.id)).filter(
+        Job.status == "PENDIENTE", Job.kind.in_(_kinds_of(JOB_CLASSES.get(job.kind))), Job.id <= job.id
+    ).scalar()
+
+# --- EJECUCIÓN ---
+def _claim_next():
+    with _claim_lock, SessionLocal() as s:
+        # Solo se toman trabajos de clases que no llegaron a su límite simultáneo
+        running = dict(
+            s.query(Job.kind, func.count(Job.id)).filter(Job.status == "EN_PROCESO").group_by(Job.kind).all()
+        )
+        busy = {op: 0 for op in OPERATION_LIMITS}
+        for kind, count in running.items():
+            if kind in JOB_CLASSES:
+                busy[JOB_CLASSES[kind]] += count
+        allowed = [k for k, op in JOB_CLASSES.items() if busy[op] < OPERATION_LIMITS[op]]
+        if not allowed:
+            return None
+
+        q_candidates = s.query(Job.id).filter(
+            Job.status == "PENDIENTE", Job.kind.in_(allowed), or_(Job.run_after.is_(None), Job.run_after <= _now())
+        )
+        if not SHARED_ARTIFACTS:
+            q_candidates = q_candidates.filter(or_(Job.host == HOST_NAME, Job.host.is_(None)))
+        candidate = q_candidates.order_by(Job.id).first()
+        if not candidate:
+            return None
+        # Compare-and-swap: si otro hilo la tomó primero, rowcount = 0
+        result = s.execute(
+            update(Job).where(Job.id == candidate.id, Job.status == "PENDIENTE")
+            .values(status="EN_PROCESO", attempts=Job.attempts + 1, started_at=_now(), progress=0.0, message="Procesando...",
+                    worker_id=WORKER_ID, heartbeat_at=_now())
+        )
+        s.commit()
+        return candidate.id if result.rowcount == 1 else None
+
+def retry_delay(attempts):
+    return min(RETRY_BASE_SECONDS * 2 ** max(attempts - 1, 0), RETRY_MAX_SECONDS)
+
+def run_job(job_id):
+    with SessionLocal() as s:
+        job = s.get(Job, job_id)
+        kind, params = job.kind, dict(job.params or {})
+        attempts, max_attempts = job.attempts or 1, job.max_attempts or 1
+
+    ctx = JobContext(job_id)
+    db = SessionLocal()
+    try:
+        message = _HANDLERS[kind](db, ctx, **params)
+        values = {"status": "COMPLETADO", "progress": 1.0, "message": message or "Listo", "finished_at": _now()}
+        if isinstance(message, dict):
+            # Los handlers de importación devuelven un resumen con errores por fila
+            values["message"] = message["message"]
+            values["error"] = "\n".join(message.get("errors", [])) or None
+        if ctx.result:
+            values["result_key"], values["result_name"], values["result_mime"] = ctx.result
+    except JobCancelled:
+        db.rollback()
+        values = {"status": "CANCELADO", "message": "Cancelado por el usuario", "finished_at": _now()}
+    except Exception as e:
+        db.rollback()
+        if attempts < max_attempts:
+            delay = retry_delay(attempts)
+            values = {
+                "status": "PENDIENTE", "run_after": _now() + datetime.timedelta(seconds=delay),
+                "message": f"Reintentando en {delay:.0f} s ({attempts}/{max_attempts}): {e}"
+            }
+        else:
+            values = {"status": "ERROR", "message": str(e), "error": traceback.format_exc(), "finished_at": _now()}
+    finally:
+        db.close()
+
+    with SessionLocal() as s:
+        s.execute(update(Job).where(Job.id == job_id).values(**values))
+        s.commit()
+    _wakeup.set() # Se liberó un lugar de su clase: otro hilo puede tomar el siguiente
+    return values["status"]
+
+def run_pending_jobs(limit=None):
+    # Ejecuta la cola en el hilo actual (útil fuera de Streamlit)
+    done = 0
+    while limit is None or done < limit:
+        job_id = _claim_next()
+        if job_id is None:
+            break
+        run_job(job_id)
+        done += 1
+    return done
+
+class WorkerPool:
+    def __init__(self, size=WORKER_COUNT, poll_interval=POLL_INTERVAL):
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        self.threads = [
+            threading.Thread(target=self._loop, name=f"job-worker-{i}", daemon=True)
+            for i in range(size)
+        ] + [threading.Thread(target=self._heartbeat_loop, name="job-heartbeat", daemon=True)]
+        for t in self.threads:
+            t.start()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                job_id = _claim_next()
+            except Exception as e:
+                print(f"Error leyendo la cola de trabajos: {e}")
+                job_id = None
+            if job_id is None:
+                _wakeup.wait(self.poll_interval)
+                _wakeup.clear()
+                continue
+            run_job(job_id)
+
+    def _heartbeat_loop(self):
+        # Latido de los trabajos de este proceso (aunque el handler no reporte avance)
+        # y rescate de los de procesos que murieron
+        while not self._stop.wait(HEARTBEAT_INTERVAL):
+            try:
+                heartbeat()
+                if requeue_interrupted():
+                    _wakeup.set()
+            except Exception as e:
+                print(f"Error en el latido de trabajos: {e}")
+
+    def stop(self):
+        self._stop.set()
+        _wakeup.set()
+
+def heartbeat():
+    with SessionLocal() as s:
+        s.execute(update(Job).where(Job.status == "EN_PROCESO", Job.worker_id == WORKER_ID).values(heartbeat_at=_now()))
+        s.commit()
+
+def requeue_interrupted():
+    # Trabajos EN_PROCESO cuyo proceso murió (sin latido reciente) vuelven a la cola.
+    # Los de otras réplicas vivas no se tocan.
+    stale = _now() - datetime.timedelta(seconds=STALE_AFTER)
+    with SessionLocal() as s:
+        result = s.execute(
+            update(Job)
+            .where(Job.status == "EN_PROCESO",
+                   or_(Job.worker_id.is_(None), Job.worker_id != WORKER_ID),
+                   or_(Job.heartbeat_at.is_(None), Job.heartbeat_at < stale))
+            .values(status="PENDIENTE", worker_id=None, message="Reencolado tras reinicio")
+        )
+        s.commit()
+        return result.rowcount
+
+@st.cache_resource(show_spinner=False)
+def start_workers(size=WORKER_COUNT):
+    requeue_interrupted()
+    evict_artifacts()
+    return WorkerPool(size)
+
+# ==============================================================================
+# HANDLERS
+# ==============================================================================
+
+def _import_summary(result):
+    msg = f"✨ {result['created']} nuevos"
+    if result.get("updated"): msg += f" · ✏️ {result['updated']} actualizados"
+    if result.get("skipped"): msg += f" · ⏭️ {result['skipped']} omitidos (ya existían o vacíos)"
+    if result.get("errors"): msg += f" · ❌ {len(result['errors'])} filas con error"
+    return {"message": msg, "errors": result.get("errors", []) + result.get("warnings", [])}
+
+@job_handler("import_insumos", "Carga masiva de Insumos", "import")
+def _job_import_insumos(db, ctx, path, filename):
+    import catalogs
+    return _import_summary(catalogs.import_insumos(db, catalogs.read_insumos_file(path, filename, progress=ctx.progress)))
+
+@job_handler("import_tipos", "Carga masiva de Tipos de Actividad", "import")
+def _job_import_tipos(db, ctx, path, filename):
+    import catalogs
+    return _import_summary(catalogs.import_activity_types(db, catalogs.read_types_file(path, filename, progress=ctx.progress)))
+
+@job_handler("import_ois", "Carga masiva de OIs", "import")
+def _job_import_ois(db, ctx, path, filename):
+    import catalogs
+    return _import_summary(catalogs.import_ois(db, catalogs.read_ois_file(path, filename, progress=ctx.progress)))
+
+@job_handler("import_proveedores", "Carga masiva de Proveedores", "import")
+def _job_import_proveedores(db, ctx, path, filename):
+    import catalogs
+    return _import_summary(catalogs.import_providers(db, catalogs.read_providers_file(path, filename, progress=ctx.progress)))
+
+def _export(ctx, df, basename, fmt):
+    from reports import dataframe_to_bytes, EXPORT_FORMATS
+    if df.empty:
+        return "No hay datos en ese rango de fechas."
+    ctx.progress(0.5, f"Generando {fmt} ({len(df)} filas)...")
+    ext, mime = EXPORT_FORMATS[fmt]
+    ctx.save_result(dataframe_to_bytes(df, fmt), f"{basename}.{ext}", mime)
+    return f"{len(df)} filas exportadas."
+
+@job_handler("export_odc", "Reporte ODC", "export")
+def _job_export_odc(db, ctx, start, end, fmt="CSV"):
+    from reports import odc_report
+    df = odc_report(db, datetime.date.fromisoformat(start), datetime.date.fromisoformat(end))
+    return _export(ctx, df, "reporte_odc", fmt)
+
+@job_handler("export_caja_chica", "Reporte Contable Caja Chica", "export")
+def _job_export_caja_chica(db, ctx, start, end, fmt="CSV"):
+    from reports import caja_chica_report
+    df = caja_chica_report(db, datetime.date.fromisoformat(start), datetime.date.fromisoformat(end))
+    return _export(ctx, df, "caja_chica_contable", fmt)
+
+@job_handler("host_pack", "Documentos Host (Recibo + Contrato)", "pdf")
+def _job_host_pack(db, ctx, expense_id, contract_desc):
+    from models import Expense
+    from documents import build_host_pack_zip
+    exp = db.get(Expense, expense_id)
+    if not exp:
+        raise ValueError(f"El gasto #{expense_id} no existe.")
+    recibo_id_str = f"{exp.id:05d}"
+    ctx.progress(0.3, "Generando PDFs...")
+    rows = [{"desc": l.description, "rate": l.rate, "days": l.days} for l in exp.service_lines]
+    zip_bytes = build_host_pack_zip(exp.company, rows, exp.amount_gtq, exp.date, contract_desc, recibo_id_str)
+    ctx.save_result(zip_bytes, f"Pack_Legal_{exp.company.name}_{recibo_id_str}.zip", "application/zip")
+    return "Documentos listos para descargar"
+
+@job_handler("quote_proposals", "Propuestas para Cliente (PDF)", "pdf")
+def _job_quote_proposals(db, ctx, quote_ids, price_label):
+    from reports import proposal_content
+    from artifacts import artifact_key, artifact_exists, read_artifact
+    from documents import proposal_digest, proposal_filename, proposal_bundle, build_quote_proposal_pdf, build_proposals_zip
+    contents = proposal_content(db, quote_ids, price_label)
+    ids = [i for i in quote_ids if i in contents]
+    if not ids:
+        raise ValueError("Las cotizaciones seleccionadas ya no existen.")
+    files, rendered = [], 0
+    for n, q_id in enumerate(ids):
+        # Solo se generan las propuestas cuyo contenido cambió; las demás salen del almacén
+        digest, name = proposal_digest(contents[q_id]), proposal_filename(contents[q_id])
+        key = artifact_key(digest, name)
+        if artifact_exists(key):
+            data = read_artifact(key)
+        else:
+            data = build_quote_proposal_pdf(contents[q_id])
+            put_artifact(data, name, digest=digest)
+            rendered += 1
+        files.append((name, data))
+        ctx.progress(0.9 * (n + 1) / len(ids), f"Propuesta {n + 1} de {len(ids)}...")
+    digest, name, mime = proposal_bundle(contents, ids)
+    ctx.save_result(files[0][1] if len(files) == 1 else build_proposals_zip(files), name, mime, digest=digest)
+    return f"{len(files)} propuesta(s) lista(s) ({rendered} generada(s), {len(files) - rendered} sin cambios)"
+
+@job_handler("reconcile_spend", "Conciliación de gasto por actividad", "maintenance")
+def _job_reconcile_spend(db, ctx):
+    from services import reconcile_quote_spend
+    ctx.progress(0.2, "Sumando gastos por cotización...")
+    mismatches = reconcile_quote_spend(db, fix=True)
+    if not mismatches:
+        return "✅ Todo cuadra: el gasto acumulado coincide con los gastos registrados."
+    return {
+        "message": f"🛠️ {len(mismatches)} cotizaciones corregidas.",
+        "errors": [f"#{m['id']}: Q{m['spent_gtq']:,.2f} / ${m['spent_usd']:,.2f} ({m['expense_count']} gastos)" for m in mismatches]
+    }
+
+@job_handler("rescore_anomalies", "Revisión de gastos inusuales", "maintenance")
+def _job_rescore_anomalies(db, ctx):
+    from anomalies import rescore_expenses
+    ctx.progress(0.2, "Calculando estadísticas por OI, categoría y proveedor...")
+    flagged = rescore_expenses(db)
+    return f"🚩 {flagged} gastos marcados para revisión." if flagged else "✅ No se encontraron gastos inusuales."
@@ -0,0 +1,124 @@
+import datetime
+from sqlalchemy import inspect, text, select, func, literal
+from database import engine, IS_SQLITE
+from models import SchemaMigration, Expense, HostServiceLine, Quote, QuoteLine, InsumoUsage
+
+# ==============================================================================
+# MIGRACIONES DE DATOS (SE APLICAN UNA SOLA VEZ)
+# ==============================================================================
+# ensure_columns (bootstrap.py) agrega columnas nuevas; aquí van los cambios que
+# transforman datos existentes. Cada migración queda registrada en
+# schema_migrations y no se vuelve a ejecutar.
+
+# Columnas de dinero que pasaron de Float (Q / $) a enteros en centavos
+MONEY_COLUMNS_0001 = {
+    "ois": ["annual_budget_usd"],
+    "budgets": ["budget_usd"],
+    "insumos": ["cost_gtq"],
+    "quotes": ["total_cost_gtq", "total_cost_usd", "suggested_price_usd_m70",
+               "suggested_price_usd_m60", "suggested_price_usd_m50", "final_sale_price_usd"],
+    "quote_lines": ["line_cost_gtq", "line_cost_usd"],
+    "expenses": ["amount_gtq", "amount_usd"],
+}
+
+def _money_to_cents(conn):
+    inspector = inspect(conn)
+    for table, columns in MONEY_COLUMNS_0001.items():
+        if not inspector.has_table(table):
+            continue
+        for col in columns:
+            if IS_SQLITE:
+                # SQLite no cambia tipos de columna: solo se reescriben los valores
+                conn.execute(text(f"UPDATE {table} SET {col} = CAST(ROUND({col} * 100) AS INTEGER) WHERE {col} IS NOT NULL"))
+            else:
+                conn.execute(text(f"ALTER TABLE {table} ALTER COLUMN {col} TYPE BIGINT USING ROUND({col} * 100)"))
+
+def _backfill_host_service_lines(conn):
+    # Las filas del recibo Host estaban en expenses.host_details (JSON): se pasan a su tabla
+    expenses = Expense.__table__
+    rows = conn.execute(
+        select(expenses.c.id, expenses.c.host_details)
+        .where(expenses.c.category == "HOST", expenses.c.host_details.isnot(None))
+    ).all()
+    lines = []
+    for expense_id, details in rows:
+        for line_no, item in enumerate(details or [], start=1):
+            rate = float(item.get("rate") or 0.0)
+            days = float(item.get("days") or 0.0)
+            lines.append({
+                "expense_id": expense_id, "line_no": line_no, "description": item.get("desc", ""),
+                "rate": rate, "days": days, "total": rate * days,
+            })
+    if lines:
+        conn.execute(HostServiceLine.__table__.insert(), lines)
+
+def _backfill_quote_spend(conn):
+    # Valores iniciales de spent_gtq / spent_usd / expense_count (montos en centavos)
+    conn.execute(text("""
+        UPDATE quotes SET
+            spent_gtq = COALESCE((SELECT SUM(e.amount_gtq) FROM expenses e WHERE e.quote_id = quotes.id), 0),
+            spent_usd = COALESCE((SELECT SUM(e.amount_usd) FROM expenses e WHERE e.quote_id = quotes.id), 0),
+            expense_count = (SELECT COUNT(*) FROM expenses e WHERE e.quote_id = quotes.id)
+    """))
+
+def _expense_index(name):
+    # create_all no agrega índices a tablas existentes: cada migración crea solo el suyo
+    def create_index(conn):
+        index = next(i for i in Expense.__table__.indexes if i.name == name)
+        index.create(conn, checkfirst=True)
+    return create_index
+
+def _backfill_insumo_usage(conn):
+    # Uso histórico de insumos: por tipo de actividad y total (tipo 0).
+    # Las plantillas no cuentan (no son uso real).
+    usage = InsumoUsage.__table__
+    lines, quotes = QuoteLine.__table__, Quote.__table__
+    base = lines.join(quotes, quotes.c.id == lines.c.quote_id)
+    counted = (lines.c.insumo_id.isnot(None)) & (quotes.c.status != "PLANTILLA")
+    cols = ["insumo_id", "activity_type_id", "uses", "last_used_at"]
+    conn.execute(usage.insert().from_select(cols,
+        select(lines.c.insumo_id, func.coalesce(quotes.c.activity_type_id, 0), func.count(), func.max(quotes.c.created_at))
+        .select_from(base)
+        .where(counted, func.coalesce(quotes.c.activity_type_id, 0) != 0)
+        .group_by(lines.c.insumo_id, quotes.c.activity_type_id)
+    ))
+    conn.execute(usage.insert().from_select(cols,
+        select(lines.c.insumo_id, literal(0), func.count(), func.max(quotes.c.created_at))
+        .select_from(base)
+        .where(counted)
+        .group_by(lines.c.insumo_id)
+    ))
+
+def _rebuild_insumo_usage(conn):
+    # Los contadores incluían plantillas y líneas borradas: se recalculan desde cero
+    conn.execute(InsumoUsage.__table__.delete())
+    _backfill_insumo_usage(conn)
+
+MIGRATIONS = [
+    ("0001_money_to_cents", _money_to_cents),
+    ("0002_host_service_lines", _backfill_host_service_lines),
+    ("0003_quote_spend", _backfill_quote_spend),
+    ("0004_expense_period_index", _expense_index("ix_expenses_year_month")),
+    ("0005_expense_quote_index", _expense_index("ix_expenses_quote_id")),
+    ("0006_expense_company_index", _expense_index("ix_expenses_company_id")),
+    ("0007_insumo_usage", _backfill_insumo_usage),
+    ("0008_expense_review_index", _expense_index("ix_expenses_review_status")),
+    ("0009_insumo_usage_rebuild", _rebuild_insumo_usage),
+]
+
+def run_migrations(fresh_database=False):
+    # En una BD recién creada las tablas ya nacen con el formato nuevo: solo se marcan
+    applied_now = []
+    with engine.begin() as conn:
+        applied = {row[0] for row in conn.execute(text("SELECT name FROM schema_migrations"))}
+        for name, migrate in MIGRATIONS:
+            if name in applied:
+                continue
+            if not fresh_database:
+                migrate(conn)
+                print(f"🛠️ Migración aplicada: {name}")
+            conn.execute(
+                SchemaMigration.__table__.insert().values(name=name, applied_at=datetime.datetime.utcnow())
+            )
+            applied_now.append(name)
+    return applied_now
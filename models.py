@@ -1,7 +1,8 @@
 import datetime
-from sqlalchemy import Column, Integer, String, Float, Boolean, ForeignKey, Date, DateTime, Text, JSON
+from sqlalchemy import Column, Integer, String, Float, Boolean, ForeignKey, Date, DateTime, Text, JSON, UniqueConstraint, Index
 from sqlalchemy.orm import relationship
 from database import Base
+from money import Money
 
 # --- USUARIOS ---
 class User(Base):
@@ -27,7 +28,7 @@ class OI(Base):
     mall_id = Column(Integer, ForeignKey("malls.id"))
     oi_code = Column(String, unique=True, nullable=False)
     oi_name = Column(String, nullable=False)
-    annual_budget_usd = Column(Float, default=0.0)
+    annual_budget_usd = Column(Money, default=0.0)
     is_active = Column(Boolean, default=True)
     mall = relationship("Mall", back_populates="ois")
 
@@ -38,7 +39,7 @@ class Budget(Base):
     oi_id = Column(Integer, ForeignKey("ois.id"))
     year = Column(Integer, nullable=False)
     month = Column(Integer, nullable=False)
-    budget_usd = Column(Float, default=0.0)
+    budget_usd = Column(Money, default=0.0)
     updated_at = Column(DateTime, default=datetime.datetime.utcnow)
     oi = relationship("OI")
 
@@ -64,7 +65,7 @@ class Insumo(Base):
     id = Column(Integer, primary_key=True)
     name = Column(String, unique=True)
     unit_type = Column(String) 
-    cost_gtq = Column(Float, default=0.0)
+    cost_gtq = Column(Money, default=0.0)
     billing_mode = Column(String) 
     is_active = Column(Boolean, default=True)
     category = Column(String, nullable=True)
@@ -79,14 +80,21 @@ class Quote(Base):
     activity_name = Column(String, nullable=False)
     activity_type_id = Column(Integer, ForeignKey("activity_types.id"))
     status = Column(String, default="BORRADOR") 
-    total_cost_gtq = Column(Float, default=0.0)
-    total_cost_usd = Column(Float, default=0.0)
-    suggested_price_usd_m70 = Column(Float, default=0.0)
-    suggested_price_usd_m60 = Column(Float, default=0.0)
-    suggested_price_usd_m50 = Column(Float, default=0.0)
-    final_sale_price_usd = Column(Float, nullable=True)
+    total_cost_gtq = Column(Money, default=0.0)
+    total_cost_usd = Column(Money, default=0.0)
+    suggested_price_usd_m70 = Column(Money, default=0.0)
+    suggested_price_usd_m60 = Column(Money, default=0.0)
+    suggested_price_usd_m50 = Column(Money, default=0.0)
+    final_sale_price_usd = Column(Money, nullable=True)
+    # Gasto real acumulado: se actualiza en la misma transacción de cada gasto
+    # (services.py) y se verifica con la conciliación (reconcile_quote_spend)
+    spent_gtq = Column(Money, nullable=False, default=0.0, server_default="0")
+    spent_usd = Column(Money, nullable=False, default=0.0, server_default="0")
+    expense_count = Column(Integer, nullable=False, default=0, server_default="0")
     notes = Column(Text)
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    # Control de concurrencia optimista: cada cambio de estado incrementa la versión
+    version = Column(Integer, nullable=False, default=1, server_default="1")
     
     creator = relationship("User")
     activity_type = relationship("ActivityType")
@@ -101,11 +109,19 @@ class QuoteLine(Base):
     insumo_id = Column(Integer, ForeignKey("insumos.id"))
     qty_personas = Column(Float, default=1.0)
     units_value = Column(Float, default=1.0)
-    line_cost_gtq = Column(Float, default=0.0)
-    line_cost_usd = Column(Float, default=0.0)
+    line_cost_gtq = Column(Money, default=0.0)
+    line_cost_usd = Column(Money, default=0.0)
     quote = relationship("Quote", back_populates="lines")
     insumo = relationship("Insumo")
 
+# --- USO DE INSUMOS (ORDENA EL SELECTOR DEL COTIZADOR) ---
+class InsumoUsage(Base):
+    __tablename__ = "insumo_usage"
+    insumo_id = Column(Integer, ForeignKey("insumos.id"), primary_key=True)
+    activity_type_id = Column(Integer, primary_key=True) # 0 = todos los tipos
+    uses = Column(Integer, nullable=False, default=0) # Líneas de cotización con este insumo
+    last_used_at = Column(DateTime)
+
 # --- GASTOS ---
 class ExpenseType(Base):
     __tablename__ = "expense_types"
@@ -136,20 +152,94 @@ class Expense(Base):
     quote_id = Column(Integer, ForeignKey("quotes.id"), nullable=False)
     category = Column(String) 
     description = Column(String)
-    amount_gtq = Column(Float)
-    amount_usd = Column(Float)
+    amount_gtq = Column(Money)
+    amount_usd = Column(Money)
     doc_number = Column(String, nullable=True) 
     odc_number = Column(String, nullable=True) 
     text_additional = Column(String, nullable=True) 
-    host_details = Column(JSON, nullable=True) 
+    host_details = Column(JSON, nullable=True) # Histórico: las filas Host ahora viven en host_service_lines
     company_id = Column(Integer, ForeignKey("proveedores.id"))
     
     # --- NUEVO CAMPO ---
     pay_to = Column(String, nullable=True)
+
+    # Detección de montos inusuales (anomalies.py): REVISAR / OK / vacío
+    anomaly_score = Column(Float, nullable=True)
+    review_status = Column(String, nullable=True)
     
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
     
     mall = relationship("Mall")
     oi = relationship("OI")
     company = relationship("Proveedor")
-    quote = relationship("Quote")
\ No newline at end of file
+    quote = relationship("Quote")
+    service_lines = relationship("HostServiceLine", back_populates="expense", order_by="HostServiceLine.line_no", cascade="all, delete-orphan")
+
+    # Series mensuales del Dashboard: filtro por rango de años + agrupación por mes.
+    # quote_id: suma de gastos por cotización (rentabilidad por actividad).
+    # company_id: análisis de proveedores
+    __table_args__ = (
+        Index("ix_expenses_year_month", "year", "month"),
+        Index("ix_expenses_quote_id", "quote_id"),
+        Index("ix_expenses_company_id", "company_id"),
+        Index("ix_expenses_review_status", "review_status"),
+    )
+
+# --- FILAS DEL RECIBO HOST (UNA POR SERVICIO COBRADO) ---
+class HostServiceLine(Base):
+    __tablename__ = "host_service_lines"
+    id = Column(Integer, primary_key=True)
+    expense_id = Column(Integer, ForeignKey("expenses.id"), nullable=False, index=True)
+    line_no = Column(Integer, default=1)
+    description = Column(String)
+    rate = Column(Money, default=0.0) # Tarifa Q
+    days = Column(Float, default=0.0) # Días / Cantidad
+    total = Column(Money, default=0.0) # rate * days
+    expense = relationship("Expense", back_populates="service_lines")
+
+# --- TRABAJOS EN SEGUNDO PLANO ---
+class Job(Base):
+    __tablename__ = "jobs"
+    id = Column(Integer, primary_key=True)
+    kind = Column(String, nullable=False)
+    status = Column(String, default="PENDIENTE", index=True) # PENDIENTE, EN_PROCESO, COMPLETADO, ERROR, CANCELADO
+    params = Column(JSON, nullable=True)
+    progress = Column(Float, default=0.0)
+    message = Column(String, nullable=True)
+    attempts = Column(Integer, default=0)
+    max_attempts = Column(Integer, default=3)
+    cancel_requested = Column(Boolean, default=False)
+    result_key = Column(String, nullable=True) # Clave en el almacén de archivos (artifacts.py)
+    result_name = Column(String, nullable=True)
+    result_mime = Column(String, nullable=True)
+    error = Column(Text, nullable=True)
+    created_by = Column(Integer, ForeignKey("users.id"), nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    run_after = Column(DateTime, nullable=True) # Reintentos: no se toma antes de esta hora
+    host = Column(String, nullable=True)         # Servidor donde se encoló (ahí están sus archivos)
+    worker_id = Column(String, nullable=True)    # Proceso que lo está ejecutando
+    heartbeat_at = Column(DateTime, nullable=True)
+
+# --- BORRADORES DEL USUARIO (ESTADO DE TRABAJO EN CURSO) ---
+class UserDraft(Base):
+    __tablename__ = "user_drafts"
+    __table_args__ = (UniqueConstraint("user_id", "key", name="uq_user_draft_key"),)
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    key = Column(String, nullable=False) # Ej: current_quote_id, host_rows
+    value = Column(JSON, nullable=True)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
+# --- MIGRACIONES DE DATOS APLICADAS ---
+class SchemaMigration(Base):
+    __tablename__ = "schema_migrations"
+    name = Column(String, primary_key=True)
+    applied_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+# --- VERSIÓN DE DATOS (INVALIDA CACHÉS DE REPORTES) ---
+class DataVersion(Base):
+    __tablename__ = "data_versions"
+    name = Column(String, primary_key=True) # p.ej. "expenses"
+    version = Column(Integer, nullable=False, default=0)
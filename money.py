@@ -0,0 +1,73 @@
+import numpy as np
+from sqlalchemy import BigInteger
+from sqlalchemy.types import TypeDecorator
+
+# ==============================================================================
+# DINERO EN CENTAVOS (ENTEROS)
+# ==============================================================================
+# En la BD los montos se guardan como ENTEROS en centavos: las sumas son exactas
+# (no se acumulan errores de Float) y las comparaciones no necesitan redondeo.
+# En Python el ORM los sigue entregando como Q / $ (float redondeado a 2
+# decimales), así que las páginas no cambian.
+# Para agregaciones grandes usar las funciones *_cents (enteros de NumPy).
+
+CENTS = 100
+
+def to_cents(value):
+    # Escalar -> int; lista / array -> array int64. Redondeo al centavo más cercano.
+    if value is None:
+        return None
+    cents = np.round(np.asarray(value, dtype=float) * CENTS).astype(np.int64)
+    return int(cents) if cents.ndim == 0 else cents
+
+def from_cents(cents):
+    if cents is None:
+        return None
+    values = np.asarray(cents, dtype=np.int64) / CENTS
+    return float(values) if values.ndim == 0 else values
+
+def round_money(value):
+    # Redondea un monto (o array) a centavos exactos
+    return from_cents(to_cents(value))
+
+def sum_cents(cents):
+    # Suma exacta en enteros
+    return int(np.asarray(cents, dtype=np.int64).sum())
+
+def group_sum_cents(keys, cents):
+    # Suma exacta en enteros agrupando por llave: devuelve (llaves únicas, sumas int64).
+    # bincount trabaja en float64; aquí se ordena y se usa reduceat sobre int64.
+    keys = np.asarray(keys)
+    cents = np.asarray(cents, dtype=np.int64)
+    if keys.size == 0:
+        return keys, np.zeros(0, dtype=np.int64)
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    uniq, starts = np.unique(sorted_keys, return_index=True)
+    return uniq, np.add.reduceat(cents[order], starts)
+
+def allocate_cents(total_cents, weights):
+    # Reparte un total (centavos) proporcional a los pesos; los centavos que
+    # sobran al truncar van a las mayores fracciones: la suma cuadra exacto.
+    weights = np.asarray(weights, dtype=float)
+    if weights.size == 0:
+        return np.zeros(0, dtype=np.int64)
+    if weights.sum() <= 0:
+        weights = np.ones(weights.size)
+    exact = total_cents * weights / weights.sum()
+    shares = np.floor(exact).astype(np.int64)
+    rest = int(total_cents - shares.sum())
+    shares[np.argsort(shares - exact, kind="stable")[:rest]] += 1
+    return shares
+
+class Money(TypeDecorator):
+    # Columna de dinero: BIGINT en centavos en la BD, float con 2 decimales en Python
+    impl = BigInteger
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return to_cents(value)
+
+    def process_result_value(self, value, dialect):
+        # SQLite puede devolver REAL (p.ej. SUM o columnas migradas): se normaliza a entero
+        return None if value is None else int(round(value)) / CENTS
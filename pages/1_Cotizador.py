@@ -1,18 +1,110 @@
 import streamlit as st
 import pandas as pd
-from database import get_db
-from models import Quote, QuoteLine, ActivityType, Insumo, Mall
+from database import page_db
+from models import Quote, ActivityType, Insumo, Mall
 from auth import require_role
-from services import calculate_quote_totals, get_active_rate
+from services import calculate_quote_totals, add_quote_line, update_quote_lines, delete_quote_lines, clone_quote, fan_out_quote, ranked_insumos
+from services import transition_quote, QuoteConflictError, InvalidTransitionError
+from ui import seen_version, show_conflict, submit_job_or_warn, job_panel, download_artifact
+from drafts import draft_state, set_draft_state, clear_draft_state
+from similarity import similar_quotes
+from reports import PROPOSAL_PRICES, proposal_content
+from documents import proposal_bundle
+from artifacts import artifact_key, artifact_exists
 
 require_role(["VENDEDOR", "AUTORIZADO", "ADMIN"])
-db = next(get_db())
+db = page_db()
 
 st.title("Generador de Cotizaciones")
 
+# --- FRAGMENTO: AGREGAR ELEMENTOS ---
+# Cambiar la categoría, el insumo o las cantidades solo vuelve a ejecutar esta
+# sección (no la tabla editable ni los totales de la cotización).
+def _pick_suggested():
+    # Click en un sugerido: se selecciona en el selector (mostrando todas las categorías)
+    picked = st.session_state.get("ins_suggested")
+    if picked is not None:
+        st.session_state["filtro_cat"] = "Todas"
+        st.session_state["sel_insumo"] = picked
+        st.session_state["ins_suggested"] = None
+
+@st.fragment
+def add_items_section(quote_id):
+    st.markdown("##### ➕ Agregar Elementos")
+    
+    # Cargamos todos los activos, ya ordenados por uso (más usados en este tipo de actividad primero)
+    db = page_db(f"add_items:{quote_id}")
+    type_id = db.query(Quote.activity_type_id).filter(Quote.id == quote_id).scalar()
+    ranked = ranked_insumos(db, type_id)
+    all_insumos = [i for i, _, _ in ranked]
+    by_id = {i.id: i for i in all_insumos}
+    
+    if all_insumos:
+        # --- SUGERIDOS: los más usados en este tipo de actividad ---
+        suggested = [i.id for i, type_uses, _ in ranked[:5] if type_uses > 0]
+        if suggested:
+            st.pills(
+                "⭐ Sugeridos para este tipo de actividad", suggested,
+                format_func=lambda x: by_id[x].name, key="ins_suggested", on_change=_pick_suggested
+            )
+
+        # --- FILA 1: FILTRO Y SELECCIÓN ---
+        col_cat, col_sel = st.columns([1, 3])
+        
+        with col_cat:
+            # Obtenemos categorías únicas (evitando nulos)
+            cats_disponibles = sorted({i.category for i in all_insumos if i.category})
+            cats_disponibles = ["Todas"] + cats_disponibles
+            filtro_cat = st.selectbox("📂 Filtrar Categoría", cats_disponibles, key="filtro_cat")
+        
+        # Aplicamos el filtro en memoria
+        if filtro_cat != "Todas":
+            insumos_filtrados = [i.id for i in all_insumos if i.category == filtro_cat]
+        else:
+            insumos_filtrados = [i.id for i in all_insumos]
+
+        with col_sel:
+            sel_id = st.selectbox(
+                "Seleccionar Insumo", 
+                insumos_filtrados, 
+                format_func=lambda x: f"{by_id[x].name} (Q{by_id[x].cost_gtq})",
+                placeholder="Escribe para buscar...",
+                key="sel_insumo"
+            )
+            sel_ins = by_id.get(sel_id)
+
+        # --- FILA 2: DESCRIPCIÓN (REQUERIMIENTO NUEVO) ---
+        # Solo se muestra si el insumo tiene descripción
+        if sel_ins and sel_ins.description:
+            st.info(f"ℹ️ **Detalle:** {sel_ins.description}")
+
+        # --- FILA 3: CANTIDADES Y BOTÓN ---
+        c_q, c_u, c_b = st.columns([1, 1, 1])
+        
+        with c_q:
+            qty = st.number_input("Personas", min_value=1, value=1, step=1, format="%d")
+        
+        with c_u:
+            # Lógica de unidades según modo de cobro
+            if sel_ins.billing_mode == "MULTIPLICABLE":
+                u_val = st.number_input(f"Cant. ({sel_ins.unit_type})", min_value=1, value=1, step=1, format="%d")
+            else:
+                st.caption(f"Cobro fijo ({sel_ins.unit_type})") # Caption se ve más limpio que info aquí
+                u_val = 1
+        
+        with c_b:
+            st.write("") # Espaciadores para alinear el botón abajo
+            st.write("")
+            if st.button("➕ Agregar a la Lista", use_container_width=True):
+                # Costo calculado por el motor de precios compartido + recálculo de totales
+                add_quote_line(db, quote_id, sel_ins, qty, u_val)
+                # Rerun completo: la tabla y los totales de abajo cambian
+                st.rerun()
+
 # --- SECCIÓN 1: CREAR NUEVA (DESDE CERO O PLANTILLA) ---
 # Solo mostramos esto si no estamos editando una actualmente
-if 'current_quote_id' not in st.session_state:
+# La cotización en edición se guarda como borrador del usuario en la BD (se retoma en cualquier réplica / sesión)
+if draft_state('current_quote_id') is None:
     
     # Pestañas para elegir método de creación
     tab1, tab2 = st.tabs(["✨ Crear desde Cero", "📂 Cargar Plantilla"])
@@ -43,7 +135,7 @@ if 'current_quote_id' not in st.session_state:
                     new_quote = Quote(created_by=st.session_state["user_id"], activity_name=act_name, activity_type_id=act_type.id, mall_id=mall.id if mall else None, notes=notes)
                     db.add(new_quote)
                     db.commit()
-                    st.session_state['current_quote_id'] = new_quote.id
+                    set_draft_state('current_quote_id', new_quote.id)
                     st.success("Creado. Ahora agrega los insumos.")
                     st.rerun()
 
@@ -59,54 +151,36 @@ if 'current_quote_id' not in st.session_state:
             sel_template_preview = c_temp.selectbox("Elegir Plantilla", templates, format_func=lambda x: f"{x.activity_name} (Total: ${x.total_cost_usd:,.2f})")
             new_name_from_temp = c_new_name.text_input("Nombre para esta nueva cotización", value=f"Copia de {sel_template_preview.activity_name}")
             
+            fan_out = st.checkbox(
+                "🏬 Crear una cotización por cada Mall activo",
+                help="Genera en una sola operación una copia de la plantilla para cada Mall activo (nombre: '<Nombre> - <Mall>')."
+            )
+            
             if st.button("⚡ Crear usando esta Plantilla"):
-                # TRUCO: Volvemos a cargar la plantilla con la sesión ACTUAL para evitar el error "DetachedInstance"
-                sel_template = db.query(Quote).get(sel_template_preview.id)
-                
-                # 1. Duplicar Cabecera
-                cloned_quote = Quote(
-                    created_by=st.session_state["user_id"],
-                    activity_name=new_name_from_temp,
-                    activity_type_id=sel_template.activity_type_id,
-                    mall_id=sel_template.mall_id,
-                    notes=sel_template.notes,
-                    status="BORRADOR", # Nace como borrador editable
-                    total_cost_gtq=sel_template.total_cost_gtq,
-                    total_cost_usd=sel_template.total_cost_usd,
-                    suggested_price_usd_m70=sel_template.suggested_price_usd_m70,
-                    suggested_price_usd_m60=sel_template.suggested_price_usd_m60,
-                    suggested_price_usd_m50=sel_template.suggested_price_usd_m50
-                )
-                db.add(cloned_quote)
-                db.commit()
-                
-                # 2. Duplicar Líneas (Ahora sí funcionará porque sel_template está fresco)
-                if sel_template.lines:
-                    for l in sel_template.lines:
-                        new_line = QuoteLine(
-                            quote_id=cloned_quote.id,
-                            insumo_id=l.insumo_id,
-                            qty_personas=l.qty_personas,
-                            units_value=l.units_value,
-                            line_cost_gtq=l.line_cost_gtq,
-                            line_cost_usd=l.line_cost_usd
-                        )
-                        db.add(new_line)
-                    db.commit()
-                
-                # 3. Entrar a editar
-                st.session_state['current_quote_id'] = cloned_quote.id
-                st.success("¡Plantilla cargada exitosamente!")
-                st.rerun()
+                if fan_out:
+                    # Abanico: N cotizaciones (una por Mall) copiadas en el servidor
+                    new_ids = fan_out_quote(db, sel_template_preview.id, st.session_state["user_id"], new_name_from_temp)
+                    if new_ids:
+                        st.success(f"¡Se crearon {len(new_ids)} borradores (uno por Mall activo)!")
+                    else:
+                        st.warning("No hay Malls activos para generar copias.")
+                else:
+                    # Cabecera + líneas copiadas con INSERT ... SELECT en una sola transacción
+                    new_id = clone_quote(db, sel_template_preview.id, st.session_state["user_id"], new_name_from_temp)
+                    
+                    # Entrar a editar
+                    set_draft_state('current_quote_id', new_id)
+                    st.success("¡Plantilla cargada exitosamente!")
+                    st.rerun()
 
 # --- SECCIÓN 2: EDICIÓN DE COTIZACIÓN ACTIVA ---
-if 'current_quote_id' in st.session_state:
-    q_id = st.session_state['current_quote_id']
+if draft_state('current_quote_id') is not None:
+    q_id = draft_state('current_quote_id')
     quote = db.query(Quote).get(q_id)
     
     # Validación por si se borró
     if not quote:
-        del st.session_state['current_quote_id']
+        clear_draft_state('current_quote_id')
         st.rerun()
 
     st.divider()
@@ -115,90 +189,15 @@ if 'current_quote_id' in st.session_state:
     col_tit, col_back = st.columns([4, 1])
     col_tit.subheader(f"🛠️ Editando: {quote.activity_name} (#{quote.id})")
     if col_back.button("🔙 Salir / Volver"):
-        del st.session_state['current_quote_id']
+        clear_draft_state('current_quote_id')
         st.rerun()
     
     # SOLO SI ESTÁ EN BORRADOR PERMITIMOS AGREGAR/EDITAR
     if quote.status == "BORRADOR":
         
         # 2.1 AGREGAR NUEVO INSUMO
-        with st.container():
-            st.markdown("##### ➕ Agregar Elementos")
-            
-            # Cargamos todos los activos
-            all_insumos = db.query(Insumo).filter(Insumo.is_active==True).all()
-            
-            if all_insumos:
-                # --- FILA 1: FILTRO Y SELECCIÓN ---
-                col_cat, col_sel = st.columns([1, 3])
-                
-                with col_cat:
-                    # Obtenemos categorías únicas (evitando nulos)
-                    cats_disponibles = sorted({i.category for i in all_insumos if i.category})
-                    cats_disponibles = ["Todas"] + cats_disponibles
-                    filtro_cat = st.selectbox("📂 Filtrar Categoría", cats_disponibles)
-                
-                # Aplicamos el filtro en memoria
-                if filtro_cat != "Todas":
-                    insumos_filtrados = [i for i in all_insumos if i.category == filtro_cat]
-                else:
-                    insumos_filtrados = all_insumos
-
-                with col_sel:
-                    sel_ins = st.selectbox(
-                        "Seleccionar Insumo", 
-                        insumos_filtrados, 
-                        format_func=lambda x: f"{x.name} (Q{x.cost_gtq})",
-                        placeholder="Escribe para buscar..."
-                    )
+        add_items_section(quote.id)
 
-                # --- FILA 2: DESCRIPCIÓN (REQUERIMIENTO NUEVO) ---
-                # Solo se muestra si el insumo tiene descripción
-                if sel_ins and sel_ins.description:
-                    st.info(f"ℹ️ **Detalle:** {sel_ins.description}")
-
-                # --- FILA 3: CANTIDADES Y BOTÓN ---
-                c_q, c_u, c_b = st.columns([1, 1, 1])
-                
-                with c_q:
-                    qty = st.number_input("Personas", min_value=1, value=1, step=1, format="%d")
-                
-                with c_u:
-                    # Lógica de unidades según modo de cobro
-                    if sel_ins.billing_mode == "MULTIPLICABLE":
-                        u_val = st.number_input(f"Cant. ({sel_ins.unit_type})", min_value=1, value=1, step=1, format="%d")
-                    else:
-                        st.caption(f"Cobro fijo ({sel_ins.unit_type})") # Caption se ve más limpio que info aquí
-                        u_val = 1
-                
-                with c_b:
-                    st.write("") # Espaciadores para alinear el botón abajo
-                    st.write("")
-                    if st.button("➕ Agregar a la Lista", use_container_width=True):
-                        # Cálculo del costo
-                        if sel_ins.billing_mode == "MULTIPLICABLE":
-                            cost_gtq = sel_ins.cost_gtq * qty * u_val
-                        else:
-                            cost_gtq = sel_ins.cost_gtq * qty
-                            
-                        rate = get_active_rate(db)
-                        
-                        # Crear la línea
-                        line = QuoteLine(
-                            quote_id=quote.id, 
-                            insumo_id=sel_ins.id, 
-                            qty_personas=qty, 
-                            units_value=u_val, 
-                            line_cost_gtq=cost_gtq, 
-                            line_cost_usd=cost_gtq/rate
-                        )
-                        db.add(line)
-                        db.commit()
-                        
-                        # Recalcular totales y refrescar
-                        calculate_quote_totals(db, quote.id)
-                        st.rerun()
-                        
         # 2.2 TABLA EDITABLE (MODIFICAR / BORRAR)
         st.markdown("##### 📝 Listado de Elementos")
         
@@ -235,33 +234,45 @@ if 'current_quote_id' in st.session_state:
             )
             
             if st.button("🔄 Aplicar Cambios (Editar/Borrar)"):
-                rate = get_active_rate(db)
                 records = edited_df.to_dict('records')
-                changes_made = False
-                for row in records:
-                    line_obj = db.query(QuoteLine).get(row['id'])
-                    if line_obj:
-                        if row['Borrar']:
-                            db.delete(line_obj)
-                            changes_made = True
-                        else:
-                            new_qty = float(row['Personas'])
-                            new_units = float(row['Unidades'])
-                            if line_obj.qty_personas != new_qty or line_obj.units_value != new_units:
-                                line_obj.qty_personas = new_qty
-                                line_obj.units_value = new_units
-                                insumo = line_obj.insumo
-                                cost_gtq = (insumo.cost_gtq * new_qty * new_units) if insumo.billing_mode == "MULTIPLICABLE" else (insumo.cost_gtq * new_qty)
-                                line_obj.line_cost_gtq = cost_gtq
-                                line_obj.line_cost_usd = cost_gtq / rate
-                                changes_made = True
+                current = {l.id: l for l in lines}
+                to_delete = [row['id'] for row in records if row['Borrar'] and row['id'] in current]
+                to_update = [
+                    {"id": row['id'], "qty_personas": float(row['Personas']), "units_value": float(row['Unidades'])}
+                    for row in records
+                    if not row['Borrar'] and row['id'] in current
+                    and (current[row['id']].qty_personas != float(row['Personas']) or current[row['id']].units_value != float(row['Unidades']))
+                ]
                 
-                if changes_made:
+                if to_delete or to_update:
+                    if to_delete:
+                        delete_quote_lines(db, to_delete)
+                    # Todas las filas editadas se recalculan juntas con el motor de precios
+                    update_quote_lines(db, to_update)
                     db.commit()
                     calculate_quote_totals(db, quote.id)
                     st.success("Cambios aplicados.")
                     st.rerun()
 
+            # Referencia: cotizaciones históricas con una mezcla parecida de insumos y su resultado real
+            with st.expander("🔍 Cotizaciones similares (históricas)"):
+                matches = similar_quotes(db, [(l.insumo_id, l.qty_personas, l.units_value) for l in lines], k=5, exclude_id=quote.id)
+                if not matches:
+                    st.caption("No hay cotizaciones aprobadas con insumos en común.")
+                else:
+                    found = {q.id: q for q in db.query(Quote).filter(Quote.id.in_([qid for qid, _ in matches]))}
+                    st.dataframe(pd.DataFrame([{
+                        "Similitud": f"{score * 100:.0f}%",
+                        "Actividad": found[qid].activity_name,
+                        "Mall": found[qid].mall.name if found[qid].mall else "Global",
+                        "Estado": found[qid].status,
+                        "Presupuesto USD": found[qid].total_cost_usd,
+                        "Gasto Real USD": found[qid].spent_usd,
+                        "Venta USD": found[qid].final_sale_price_usd or found[qid].suggested_price_usd_m60,
+                    } for qid, score in matches if qid in found]).style.format({
+                        "Presupuesto USD": "${:,.2f}", "Gasto Real USD": "${:,.2f}", "Venta USD": "${:,.2f}"
+                    }), use_container_width=True, hide_index=True)
+
         # 2.3 TOTALES Y ACCIONES
         st.divider()
         st.markdown(f"### Total Costo: ${quote.total_cost_usd:,.2f}")
@@ -281,50 +292,28 @@ if 'current_quote_id' in st.session_state:
             with st.expander("💾 Guardar como Plantilla"):
                 temp_name = st.text_input("Nombre de la Plantilla", value=quote.activity_name)
                 if st.button("Confirmar Guardado de Plantilla"):
-                    # Clonamos como Status = PLANTILLA
-                    template_quote = Quote(
-                        created_by=st.session_state["user_id"],
-                        activity_name=temp_name,
-                        activity_type_id=quote.activity_type_id,
-                        mall_id=quote.mall_id,
-                        notes=quote.notes,
-                        status="PLANTILLA", # <--- ESTE ES EL TRUCO
-                        total_cost_gtq=quote.total_cost_gtq,
-                        total_cost_usd=quote.total_cost_usd,
-                        suggested_price_usd_m70=quote.suggested_price_usd_m70,
-                        suggested_price_usd_m60=quote.suggested_price_usd_m60,
-                        suggested_price_usd_m50=quote.suggested_price_usd_m50
-                    )
-                    db.add(template_quote)
-                    db.commit()
-                    
-                    # Clonamos líneas
-                    for l in quote.lines:
-                        db.add(QuoteLine(
-                            quote_id=template_quote.id,
-                            insumo_id=l.insumo_id,
-                            qty_personas=l.qty_personas,
-                            units_value=l.units_value,
-                            line_cost_gtq=l.line_cost_gtq,
-                            line_cost_usd=l.line_cost_usd
-                        ))
-                    db.commit()
+                    # Clonamos como Status = PLANTILLA (cabecera + líneas en el servidor)
+                    clone_quote(db, quote.id, st.session_state["user_id"], temp_name, status="PLANTILLA")
                     st.success(f"¡Plantilla '{temp_name}' guardada! La encontrarás en la pestaña 'Cargar Plantilla' al inicio.")
 
         # BOTÓN 2: ENVIAR A APROBACIÓN
         with col_send:
             st.write("") # Espacio
             st.write("") 
+            send_version = seen_version(quote)
             if st.button("📤 ENVIAR A APROBACIÓN", type="primary", use_container_width=True):
                 if not quote.lines:
                     st.error("Cotización vacía.")
                 else:
-                    quote.status = "ENVIADA"
-                    db.commit()
-                    del st.session_state['current_quote_id']
-                    st.balloons()
-                    st.success("¡Enviada al administrador!")
-                    st.rerun()
+                    try:
+                        transition_quote(db, quote.id, "ENVIADA", expected_version=send_version)
+                    except (QuoteConflictError, InvalidTransitionError) as e:
+                        show_conflict(e)
+                    else:
+                        clear_draft_state('current_quote_id')
+                        st.balloons()
+                        st.success("¡Enviada al administrador!")
+                        st.rerun()
 
     else:
         # VISTA DE LECTURA
@@ -333,4 +322,47 @@ if 'current_quote_id' in st.session_state:
         if lines:
             data = [{"Insumo": l.insumo.name, "Cant": l.qty_personas, "Unidades": l.units_value, "Costo USD": f"${l.line_cost_usd:.2f}"} for l in lines]
             st.dataframe(pd.DataFrame(data), use_container_width=True)
-            st.markdown(f"**Total USD: ${quote.total_cost_usd:,.2f}**")
\ No newline at end of file
+            st.markdown(f"**Total USD: ${quote.total_cost_usd:,.2f}**")
+
+# --- SECCIÓN 3: PROPUESTAS PARA CLIENTE (PDF) ---
+# Cambiar la selección solo vuelve a ejecutar esta sección. Si ninguna de las
+# cotizaciones cambió desde la última vez, el archivo ya está en el almacén y
+# se descarga directo; si no, se genera en segundo plano (solo lo que cambió).
+@st.fragment
+def proposals_section():
+    st.divider()
+    st.subheader("📄 Propuestas para Cliente")
+    db = page_db("proposals")
+    q_quotes = db.query(Quote.id, Quote.activity_name, Quote.status).filter(Quote.status != "PLANTILLA")
+    if st.session_state.get("role") == "VENDEDOR":
+        q_quotes = q_quotes.filter(Quote.created_by == st.session_state.get("user_id"))
+    options = {r.id: f"{r.activity_name} (#{r.id}) · {r.status}" for r in q_quotes.order_by(Quote.id.desc())}
+    if not options:
+        st.caption("Aún no hay cotizaciones para exportar.")
+        return
+
+    current_id = draft_state('current_quote_id')
+    c1, c2 = st.columns([3, 1])
+    sel_ids = c1.multiselect(
+        "Cotizaciones", list(options), format_func=options.get,
+        default=[current_id] if current_id in options else [], key="proposal_ids"
+    )
+    price_label = c2.selectbox("Precio a mostrar", list(PROPOSAL_PRICES), key="proposal_price")
+    if not sel_ids:
+        return
+
+    contents = proposal_content(db, sel_ids, price_label)
+    fallback = [options[i] for i in sel_ids if i in contents and contents[i]["price_source"] != "Precio final"]
+    if price_label == "Precio final" and fallback:
+        st.warning(f"⚠️ Sin precio final todavía (se usará el sugerido de 70% e irá rotulado como 'Precio sugerido'): {', '.join(fallback)}")
+    digest, name, mime = proposal_bundle(contents, sel_ids)
+    key = artifact_key(digest, name)
+    if artifact_exists(key):
+        download_artifact(f"⬇️ Descargar {name}", key, name, mime, key="dl_proposal")
+        return
+    if st.button(f"📄 Generar {'propuesta' if len(sel_ids) == 1 else f'{len(sel_ids)} propuestas'}", key="btn_proposal"):
+        submit_job_or_warn(db, "quote_proposals", {"quote_ids": sel_ids, "price_label": price_label}, "job_proposals")
+    if "job_proposals" in st.session_state:
+        job_panel(st.session_state["job_proposals"], key="proposals")
+
+proposals_section()
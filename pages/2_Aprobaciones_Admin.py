@@ -1,15 +1,131 @@
 import streamlit as st
 import pandas as pd
-from database import get_db
+from database import page_db
 from models import Quote, User, QuoteLine, Insumo
 from auth import require_role
-from services import calculate_quote_totals
+from services import (
+    add_quote_line, transition_quote, bulk_transition_quotes, QuoteConflictError, InvalidTransitionError,
+    SUGGESTED_MARGINS
+)
+from ui import seen_version, show_conflict, submit_job_or_warn, job_panel
 
 require_role(["ADMIN", "AUTORIZADO"])
-db = next(get_db())
+db = page_db()
 
 st.title("Panel de Control de Actividades")
 
+# --- FRAGMENTO: PRECIO FINAL + APROBAR / RECHAZAR ---
+# Escribir el precio recalcula el margen SOLO en esta sección: no se vuelven a
+# consultar las demás cotizaciones, líneas ni pestañas.
+@st.fragment
+def price_decision(quote_id):
+    # --- D. ANÁLISIS FINANCIERO Y PRECIO FINAL ---
+    db = page_db(f"price_decision:{quote_id}")
+    q = db.query(Quote).get(quote_id)
+    if not q or q.status != "ENVIADA":
+        st.info("Esta cotización ya fue procesada.")
+        return
+    costo_usd = q.total_cost_usd
+    
+    # 1. Calculamos Sugerido (70%)
+    precio_sugerido = costo_usd / 0.30 if costo_usd > 0 else 0
+    
+    # Layout de decisión
+    st.markdown("### 🎯 Definición de Precio de Venta")
+    st.caption("El sistema sugiere un precio basado en margen del 70%, pero tú defines el final.")
+
+    col_metrics, col_input = st.columns([2, 2])
+    
+    with col_metrics:
+        # Mostramos métricas de referencia
+        st.metric("Costo Total (Base)", f"${costo_usd:,.2f}")
+        st.metric("Sugerido (70% Margen)", f"${precio_sugerido:,.2f}", delta="Target Ideal")
+
+    with col_input:
+        # --- INPUT CLAVE: PRECIO REAL ---
+        # Por defecto ponemos el sugerido, pero es editable
+        final_price_input = st.number_input(
+            "💰 Precio Final de Venta (USD)",
+            min_value=0.0,
+            value=float(precio_sugerido), # Valor inicial sugerido
+            step=10.0,
+            help="Este es el valor que se verá en el Dashboard de Ventas.",
+            key=f"final_price_{q.id}"
+        )
+        
+        # Calculamos utilidad real en vivo basada en el input
+        utilidad_real = final_price_input - costo_usd
+        margen_real = (utilidad_real / final_price_input * 100) if final_price_input > 0 else 0
+        
+        if margen_real < 30:
+            st.error(f"⚠️ Margen bajo: {margen_real:.1f}%")
+        else:
+            st.success(f"✅ Margen saludable: {margen_real:.1f}%")
+
+    st.divider()
+
+    # --- E. BOTONES DE ACCIÓN ---
+    btn_col1, btn_col2 = st.columns(2)
+    # Versión que el admin tenía en pantalla (si otro la cambió, no se pisa)
+    q_version = seen_version(q)
+    
+    if btn_col1.button("✅ APROBAR CON ESTE PRECIO", key=f"ap_{q.id}", type="primary"):
+        try:
+            transition_quote(
+                db, q.id, "APROBADA", expected_version=q_version,
+                # --- AQUÍ GUARDAMOS EL DATO PARA EL DASHBOARD ---
+                final_sale_price_usd=final_price_input, # <--- ESTO ES LO IMPORTANTE
+                suggested_price_usd_m70=precio_sugerido # Guardamos el sugerido como referencia histórica
+            )
+        except (QuoteConflictError, InvalidTransitionError) as e:
+            show_conflict(e)
+        else:
+            st.balloons()
+            st.success(f"Actividad aprobada. Venta registrada: ${final_price_input:,.2f}")
+            st.rerun()
+    
+    if btn_col2.button("❌ RECHAZAR", key=f"rej_{q.id}"):
+        try:
+            transition_quote(db, q.id, "BORRADOR", expected_version=q_version)
+        except (QuoteConflictError, InvalidTransitionError) as e:
+            show_conflict(e)
+        else:
+            st.toast("Devuelta a borrador.")
+            st.rerun()
+
+# --- ACCIONES MASIVAS ---
+# Todas las seleccionadas se mueven con un solo UPDATE; las que no se pueden
+# (otro usuario las cambió, estado no permitido, sin costo) se reportan aparte.
+def run_bulk(quotes, seen, new_status, result_key, verb, margin=None):
+    applied, skipped = bulk_transition_quotes(db, {q.id: seen[q.id] for q in quotes}, new_status, margin=margin)
+    st.session_state[result_key] = {
+        "verb": verb,
+        "applied": len(applied),
+        "skipped": [
+            {"ID": q.id, "Actividad": q.activity_name, "Motivo": skipped[q.id]} for q in quotes if q.id in skipped
+        ],
+    }
+    st.rerun()
+
+def show_bulk_result(result_key):
+    result = st.session_state.pop(result_key, None)
+    if not result:
+        return
+    if result["applied"]:
+        st.success(f"✅ {result['applied']} actividad(es) {result['verb']}.")
+    if result["skipped"]:
+        st.warning(f"⚠️ {len(result['skipped'])} no se procesaron:")
+        st.dataframe(pd.DataFrame(result["skipped"]), use_container_width=True, hide_index=True)
+
+def bulk_selection(quotes, key, label):
+    # Multiselect con atajo "todas" (cierre de mes con cientos de actividades)
+    select_all = st.checkbox(f"Seleccionar todas ({len(quotes)})", key=f"{key}_all")
+    if select_all:
+        return quotes
+    return st.multiselect(
+        label, quotes, format_func=lambda x: f"{x.activity_name} (#{x.id}) · ${x.total_cost_usd:,.2f}", key=key
+    )
+
 # 3 Fases del Flujo
 tab_pend, tab_act, tab_liq = st.tabs([
     "⏳ 1. Pendientes de Aprobación", 
@@ -24,9 +140,35 @@ with tab_pend:
     # Traemos las pendientes
     pending_quotes = db.query(Quote).filter(Quote.status == "ENVIADA").all()
     
+    show_bulk_result("bulk_pend_result")
+    
     if not pending_quotes:
         st.success("✅ Todo al día. No hay aprobaciones pendientes.")
     else:
+        # Versiones vistas por el admin (si otro cambia alguna, esa se omite)
+        pend_seen = {q.id: seen_version(q, prefix="qvb") for q in pending_quotes}
+        with st.expander("⚡ Acciones Masivas", expanded=False):
+            bulk_pend = bulk_selection(pending_quotes, "bulk_pend", "Cotizaciones a procesar")
+            price_mode = st.radio(
+                "Precio de venta al aprobar", ["Sugerido (70% Margen)", "Margen personalizado"],
+                horizontal=True, key="bulk_price_mode"
+            )
+            margin = SUGGESTED_MARGINS["suggested_price_usd_m70"]
+            if price_mode == "Margen personalizado":
+                margin = st.slider("Margen (%)", min_value=0, max_value=90, value=60, step=5, key="bulk_margin") / 100
+            if bulk_pend:
+                total_cost = sum(q.total_cost_usd for q in bulk_pend)
+                st.caption(
+                    f"{len(bulk_pend)} seleccionada(s) · Costo ${total_cost:,.2f} · "
+                    f"Venta estimada ${total_cost / (1 - margin):,.2f}"
+                )
+
+            b1, b2 = st.columns(2)
+            if b1.button("✅ APROBAR SELECCIONADAS", type="primary", disabled=not bulk_pend, key="btn_bulk_ap"):
+                run_bulk(bulk_pend, pend_seen, "APROBADA", "bulk_pend_result", "aprobada(s)", margin=margin)
+            if b2.button("❌ RECHAZAR SELECCIONADAS", disabled=not bulk_pend, key="btn_bulk_rej"):
+                run_bulk(bulk_pend, pend_seen, "BORRADOR", "bulk_pend_result", "devuelta(s) a borrador")
+
         for q in pending_quotes:
             # 1. Obtener nombre del usuario creador
             user_creator = db.query(User).filter(User.id == q.created_by).first()
@@ -71,114 +213,51 @@ with tab_pend:
                     units_add = col_add3.number_input("Días/Unid", min_value=1.0, value=1.0, key=f"unit_{q.id}")
                     
                     if col_add4.button("Agregar", key=f"btn_add_{q.id}"):
-                        costo_linea_gtq = insumo_add.cost_gtq * qty_add * units_add
-                        costo_linea_usd = costo_linea_gtq / 7.8 
-                        new_line = QuoteLine(
-                            quote_id=q.id, insumo_id=insumo_add.id,
-                            qty_personas=qty_add, units_value=units_add,
-                            line_cost_gtq=costo_linea_gtq, line_cost_usd=costo_linea_usd
-                        )
-                        db.add(new_line)
-                        q.total_cost_gtq += costo_linea_gtq
-                        q.total_cost_usd += costo_linea_usd
-                        db.commit()
+                        # Mismo motor que el Cotizador: respeta billing_mode y la tasa activa
+                        add_quote_line(db, q.id, insumo_add, qty_add, units_add)
                         st.rerun()
 
                 st.divider()
 
-                # --- D. ANÁLISIS FINANCIERO Y PRECIO FINAL ---
-                costo_usd = q.total_cost_usd
-                
-                # 1. Calculamos Sugerido (70%)
-                precio_sugerido = costo_usd / 0.30 if costo_usd > 0 else 0
-                
-                # Layout de decisión
-                st.markdown("### 🎯 Definición de Precio de Venta")
-                st.caption("El sistema sugiere un precio basado en margen del 70%, pero tú defines el final.")
-
-                col_metrics, col_input = st.columns([2, 2])
-                
-                with col_metrics:
-                    # Mostramos métricas de referencia
-                    st.metric("Costo Total (Base)", f"${costo_usd:,.2f}")
-                    st.metric("Sugerido (70% Margen)", f"${precio_sugerido:,.2f}", delta="Target Ideal")
-
-                with col_input:
-                    # --- INPUT CLAVE: PRECIO REAL ---
-                    # Por defecto ponemos el sugerido, pero es editable
-                    final_price_input = st.number_input(
-                        "💰 Precio Final de Venta (USD)",
-                        min_value=0.0,
-                        value=float(precio_sugerido), # Valor inicial sugerido
-                        step=10.0,
-                        help="Este es el valor que se verá en el Dashboard de Ventas.",
-                        key=f"final_price_{q.id}"
-                    )
-                    
-                    # Calculamos utilidad real en vivo basada en el input
-                    utilidad_real = final_price_input - costo_usd
-                    margen_real = (utilidad_real / final_price_input * 100) if final_price_input > 0 else 0
-                    
-                    if margen_real < 30:
-                        st.error(f"⚠️ Margen bajo: {margen_real:.1f}%")
-                    else:
-                        st.success(f"✅ Margen saludable: {margen_real:.1f}%")
-
-                st.divider()
-
-                # --- E. BOTONES DE ACCIÓN ---
-                btn_col1, btn_col2 = st.columns(2)
-                
-                if btn_col1.button("✅ APROBAR CON ESTE PRECIO", key=f"ap_{q.id}", type="primary"):
-                    q.status = "APROBADA"
-                    
-                    # --- AQUÍ GUARDAMOS EL DATO PARA EL DASHBOARD ---
-                    q.final_sale_price_usd = final_price_input # <--- ESTO ES LO IMPORTANTE
-                    q.suggested_price_usd_m70 = precio_sugerido # Guardamos el sugerido como referencia histórica
-                    
-                    db.commit()
-                    st.balloons()
-                    st.success(f"Actividad aprobada. Venta registrada: ${final_price_input:,.2f}")
-                    st.rerun()
-                
-                if btn_col2.button("❌ RECHAZAR", key=f"rej_{q.id}"):
-                    q.status = "BORRADOR"
-                    db.commit()
-                    st.toast("Devuelta a borrador.")
-                    st.rerun()
+                price_decision(q.id)
 
 # --- TAB 2: ACTIVAS (DONDE SE GASTA) ---
 with tab_act:
     st.info("Estas actividades están visibles para que los usuarios carguen gastos.")
     
     active_quotes = db.query(Quote).filter(Quote.status == "APROBADA").all()
+    show_bulk_result("bulk_liq_result")
     
     if not active_quotes:
         st.warning("No hay actividades activas actualmente.")
     else:
-        # Tabla resumen
+        # Tabla resumen (el gasto viene acumulado en la cotización, sin sumar gastos aquí)
         data_active = [{
             "ID": q.id,
             "Actividad": q.activity_name, 
             "Presupuesto": f"${q.total_cost_usd:,.2f}",
+            "Gastado": f"${q.spent_usd:,.2f}",
+            "Disponible": f"${q.total_cost_usd - q.spent_usd:,.2f}",
+            "# Gastos": q.expense_count,
             "Creada": q.created_at.strftime("%d/%m/%Y")
         } for q in active_quotes]
         st.dataframe(pd.DataFrame(data_active), use_container_width=True)
+
+        with st.expander("🧮 Conciliar gasto acumulado"):
+            st.caption("Recalcula el gasto de cada actividad contra los gastos registrados y corrige diferencias.")
+            if st.button("Ejecutar conciliación", key="btn_reconcile"):
+                submit_job_or_warn(db, "reconcile_spend", {}, "job_reconcile")
+            job_panel(st.session_state.get("job_reconcile"), key="reconcile")
         
         st.divider()
         st.subheader("🔒 Liquidar / Cerrar Actividad")
         st.caption("Al liquidar, la actividad desaparece del menú de gastos pero se mantiene en el Dashboard.")
         
-        # Selector para liquidar
-        q_to_close = st.selectbox("Seleccionar Actividad para Liquidar", active_quotes, format_func=lambda x: f"{x.activity_name} (#{x.id})")
+        act_seen = {q.id: seen_version(q, prefix="qvl") for q in active_quotes}
+        to_close = bulk_selection(active_quotes, "bulk_liq", "Seleccionar Actividades para Liquidar")
         
-        if st.button("🏁 LIQUIDAR ACTIVIDAD", type="primary"):
-            if q_to_close:
-                q_to_close.status = "LIQUIDADA" # <--- CAMBIA A ESTADO FINAL
-                db.commit()
-                st.balloons()
-                st.success(f"{q_to_close.activity_name} ha sido liquidada correctamente.")
-                st.rerun()
+        if st.button("🏁 LIQUIDAR ACTIVIDADES", type="primary", disabled=not to_close):
+            run_bulk(to_close, act_seen, "LIQUIDADA", "bulk_liq_result", "liquidada(s)") # <--- CAMBIA A ESTADO FINAL
 
 # --- TAB 3: LIQUIDADAS (HISTÓRICO) ---
 with tab_liq:
@@ -197,10 +276,14 @@ with tab_liq:
         # Opción de Emergencia: Reactivar
         with st.expander("🛠️ Zona de Peligro: Reactivar Actividad"):
             q_reactivate = st.selectbox("Elegir actividad para reactivar", closed_quotes, format_func=lambda x: x.activity_name)
+            reactivate_version = seen_version(q_reactivate)
             if st.button("🔄 Reactivar (Volver a Aprobada)"):
-                q_reactivate.status = "APROBADA"
-                db.commit()
-                st.success("Actividad reactivada.")
-                st.rerun()
+                try:
+                    transition_quote(db, q_reactivate.id, "APROBADA", expected_version=reactivate_version)
+                except (QuoteConflictError, InvalidTransitionError) as e:
+                    show_conflict(e)
+                else:
+                    st.success("Actividad reactivada.")
+                    st.rerun()
     else:
         st.write("No hay actividades liquidadas aún.")
\ No newline at end of file
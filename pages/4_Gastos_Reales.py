@@ -1,34 +1,132 @@
 import streamlit as st
 import pandas as pd
 import datetime
-import os
-import zipfile 
-from database import get_db
-from models import Expense, Mall, OI, Proveedor, Quote
+from database import page_db
+from models import Expense, Mall, OI, Proveedor, Quote, HostServiceLine
 from auth import require_role
 from services import get_active_rate
-import io
-from reportlab.lib.pagesizes import LETTER
-from reportlab.pdfgen import canvas
-from reportlab.lib import colors
-from reportlab.lib.enums import TA_JUSTIFY, TA_CENTER, TA_RIGHT
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.platypus import Paragraph
+from reports import EXPORT_FORMATS, HOST_PAYOUT_GROUPS, host_payouts
+from ui import job_panel, submit_job_or_warn
+from drafts import draft_state, autosave_draft, clear_draft_state
+from money import to_cents, from_cents, sum_cents
+from anomalies import flag_expense, REVIEW_PENDING, REVIEW_OK
 
 require_role(["ADMIN", "AUTORIZADO", "VENDEDOR"])
-db = next(get_db())
+db = page_db()
 
 st.title("💸 Registro de Gastos Reales")
 
-tab_odc, tab_caja, tab_host = st.tabs(["📝 ODC", "📦 Caja Chica", "🎤 Host / Talento"])
+tab_odc, tab_caja, tab_host, tab_review = st.tabs(["📝 ODC", "📦 Caja Chica", "🎤 Host / Talento", "🚩 Revisión"])
+
+# --- PESTAÑA 4: REVISIÓN DE GASTOS INUSUALES ---
+# Va antes de la carga de actividades: los gastos marcados se revisan aunque no haya actividades aprobadas
+can_review = st.session_state.get("role") in ("ADMIN", "AUTORIZADO")
+
+with tab_review:
+    st.subheader("🚩 Gastos con Monto Inusual")
+    st.caption("Montos muy lejos de lo normal para su OI, categoría y proveedor (p.ej. un cero de más).")
+
+    flagged = (
+        db.query(Expense).filter(Expense.review_status == REVIEW_PENDING)
+        .order_by(Expense.date.desc(), Expense.id.desc()).limit(200).all()
+    )
+    if not flagged:
+        st.success("✅ No hay gastos pendientes de revisión.")
+    else:
+        # Solo se corrigen montos de actividades en curso: lo liquidado ya está cerrado
+        quote_status = dict(db.query(Quote.id, Quote.status).filter(Quote.id.in_({e.quote_id for e in flagged})))
+        df_flag = pd.DataFrame([{
+            "id": e.id, "Fecha": e.date, "Categoría": e.category,
+            "OI": e.oi.oi_code if e.oi else "", "Proveedor": e.company.name if e.company else "",
+            "Actividad": quote_status.get(e.quote_id, ""),
+            "Monto Q": e.amount_gtq, "Desvío (z)": e.anomaly_score, "Descripción": e.description,
+            "OK": False
+        } for e in flagged])
+        if not can_review:
+            # VENDEDOR solo consulta: no puede dar por buenos sus propios gastos marcados
+            st.dataframe(df_flag.drop(columns=["id", "OK"]), hide_index=True, use_container_width=True,
+                         column_config={"Monto Q": st.column_config.NumberColumn(format="Q%.2f")})
+            st.info("🔒 Un ADMIN o AUTORIZADO debe revisar estos gastos.")
+        else:
+            st.caption("Si fue un error de captura, corrige el **Monto Q** (solo actividades APROBADAS); si el monto es correcto, marca ✅.")
+            edited_flag = st.data_editor(
+                df_flag, hide_index=True, use_container_width=True, key="editor_review",
+                column_config={
+                    "id": None,
+                    "Monto Q": st.column_config.NumberColumn(format="Q%.2f", min_value=0.0),
+                    "OK": st.column_config.CheckboxColumn("¿Correcto?", help="Marca los gastos revisados que sí son correctos")
+                },
+                disabled=[c for c in df_flag.columns if c not in ("OK", "Monto Q")]
+            )
+            originals = {e.id: e for e in flagged}
+            rows = edited_flag.to_dict("records")
+            fixes = {int(r["id"]): float(r["Monto Q"]) for r in rows
+                     if to_cents(r["Monto Q"]) != to_cents(originals[int(r["id"])].amount_gtq)}
+            ok_ids = [int(r["id"]) for r in rows if r["OK"] and int(r["id"]) not in fixes]
+            locked = [i for i in fixes if quote_status.get(originals[i].quote_id) != "APROBADA"]
+
+            confirmed = True
+            if locked:
+                st.error(f"⛔ {len(locked)} gasto(s) son de actividades que ya no están APROBADAS: su monto no se puede corregir aquí.")
+            elif fixes:
+                st.warning("✏️ Correcciones: " + " · ".join(
+                    f"Q{originals[i].amount_gtq:,.2f} → Q{amt:,.2f}" for i, amt in fixes.items()
+                ))
+                confirmed = st.checkbox("Confirmo las correcciones de monto", key="confirm_review_fix")
+
+            if st.button("✅ Aplicar revisión", disabled=bool(locked) or not confirmed):
+                for expense_id, amount in fixes.items():
+                    e = originals[expense_id]
+                    # Se conserva la tasa con la que se registró el gasto; before_update ajusta el gasto acumulado
+                    rate = e.amount_gtq / e.amount_usd if e.amount_usd else get_active_rate(db)
+                    note = f"[Monto corregido en revisión: Q{e.amount_gtq:,.2f} → Q{amount:,.2f}, {st.session_state.get('username', '')}]"
+                    e.description = f"{e.description} {note}".strip() if e.description else note
+                    e.amount_gtq = amount
+                    e.amount_usd = amount / rate
+                    e.review_status = REVIEW_OK
+                if ok_ids:
+                    db.query(Expense).filter(Expense.id.in_(ok_ids)).update(
+                        {Expense.review_status: REVIEW_OK}, synchronize_session=False
+                    )
+                if fixes or ok_ids:
+                    db.commit()
+                    # Las ediciones del editor se guardan por posición de fila: se limpian al cambiar la lista
+                    for k in ("editor_review", "confirm_review_fix"):
+                        st.session_state.pop(k, None)
+                    st.rerun()
+
+    if can_review:
+        with st.expander("🔁 Recalcular todo el historial"):
+            st.caption("Vuelve a calificar todos los gastos con las estadísticas actuales (no toca los ya revisados).")
+            if st.button("Recalcular", key="btn_rescore"):
+                submit_job_or_warn(db, "rescore_anomalies", {}, "job_rescore")
+            if "job_rescore" in st.session_state:
+                job_panel(st.session_state["job_rescore"], key="rescore")
 
 # --- CARGA INICIAL DE ACTIVIDADES ---
 active_quotes = db.query(Quote).filter(Quote.status == "APROBADA").all()
 
 if not active_quotes:
-    st.warning("⚠️ No hay actividades activas (Aprobadas) para cargar gastos.")
-    st.info("Pide al administrador que apruebe una cotización o reactiva una liquidada.")
-    st.stop() # Detiene la app aquí si no hay nada
+    for tab in (tab_odc, tab_caja, tab_host):
+        with tab:
+            st.warning("⚠️ No hay actividades activas (Aprobadas) para cargar gastos.")
+            st.info("Pide al administrador que apruebe una cotización o reactiva una liquidada.")
+    st.stop() # Detiene la captura aquí; la pestaña de revisión ya se dibujó
+
+def save_expense(db, expense):
+    # Guarda el gasto; si el monto es inusual para su OI / categoría / proveedor queda marcado para revisión
+    unusual = flag_expense(db, expense)
+    db.add(expense)
+    db.commit()
+    if unusual:
+        st.warning(
+            f"🚩 Monto inusual: Q{expense.amount_gtq:,.2f} (lo normal ronda Q{unusual[1]:,.2f}). "
+            "Quedó marcado para revisión; si es un error de captura, pide a un ADMIN o AUTORIZADO que corrija el monto en 🚩 Revisión."
+        )
+
+def activity_label(q):
+    # Nombre + saldo disponible (gasto acumulado en la cotización, sin consultar gastos)
+    return f"{q.activity_name} ({q.mall.name if q.mall else 'Global'}) · Disp: ${q.total_cost_usd - q.spent_usd:,.2f} de ${q.total_cost_usd:,.2f}"
 
 # --- PESTAÑA 1: ODC ---
 with tab_odc:
@@ -56,7 +154,7 @@ with tab_odc:
         act_sel = st.selectbox(
             "Actividad", 
             active_quotes, # <--- ANTES DECÍA acts
-            format_func=lambda x: f"{x.activity_name} ({x.mall.name if x.mall else 'Global'})", 
+            format_func=activity_label, 
             key="act_odc"
         )
         
@@ -64,8 +162,8 @@ with tab_odc:
             if not act_sel or not oi_sel: st.error("Datos faltantes")
             else:
                 rate = get_active_rate(db)
-                db.add(Expense(date=date_odc, year=date_odc.year, month=date_odc.month, mall_id=act_sel.mall_id, oi_id=oi_sel.id, quote_id=act_sel.id, category="ODC", description=desc_odc, amount_gtq=amount_q, amount_usd=amount_q/rate, odc_number=odc_text, company_id=prov_sel.id if prov_sel else None))
-                db.commit(); st.success("Guardado")
+                save_expense(db, Expense(date=date_odc, year=date_odc.year, month=date_odc.month, mall_id=act_sel.mall_id, oi_id=oi_sel.id, quote_id=act_sel.id, category="ODC", description=desc_odc, amount_gtq=amount_q, amount_usd=amount_q/rate, odc_number=odc_text, company_id=prov_sel.id if prov_sel else None))
+                st.success("Guardado")
 
     st.divider()
     st.markdown("⬇️ **Descargar Reporte ODC**")
@@ -73,17 +171,17 @@ with tab_odc:
     start_d = d1.date_input("Desde", datetime.date.today().replace(day=1), key="d1_odc")
     end_d = d2.date_input("Hasta", datetime.date.today(), key="d2_odc")
     
-    if st.button("Generar CSV ODC"):
-        data = db.query(Expense).filter(Expense.category=="ODC", Expense.date >= start_d, Expense.date <= end_d).all()
-        if data:
-            df = pd.DataFrame([{
-                "Fecha": e.date, "ODC": e.odc_number, "OI": e.oi.oi_code, 
-                "Proveedor": e.company.name if e.company else "", 
-                "Monto Q": e.amount_gtq, "Descripcion": e.description,
-                "Actividad": e.quote.activity_name
-            } for e in data])
-            st.download_button("Descargar CSV", df.to_csv(index=False).encode('utf-8'), "reporte_odc.csv", "text/csv")
-        else: st.warning("No hay datos.")
+    fmt_odc = st.radio("Formato", list(EXPORT_FORMATS), horizontal=True, key="fmt_odc")
+    
+    if st.button("Generar Reporte ODC"):
+        submit_job_or_warn(
+            db, "export_odc",
+            {"start": start_d.isoformat(), "end": end_d.isoformat(), "fmt": fmt_odc},
+            "job_odc"
+        )
+
+    if "job_odc" in st.session_state:
+        job_panel(st.session_state["job_odc"], key="odc")
 
 # --- PESTAÑA 2: CAJA CHICA ---
 with tab_caja:
@@ -113,13 +211,13 @@ with tab_caja:
         act_cc = st.selectbox(
             "Actividad", 
             active_quotes,  # <--- ANTES DECÍA acts
-            format_func=lambda x: f"{x.activity_name} ({x.mall.name if x.mall else 'Global'})", 
+            format_func=activity_label, 
             key="act_cc"
         )
         
         if st.form_submit_button("💾 Guardar Caja Chica"):
             rate = get_active_rate(db)
-            db.add(Expense(
+            save_expense(db, Expense(
                 date=date_cc, year=date_cc.year, month=date_cc.month, 
                 mall_id=act_cc.mall_id, oi_id=oi_cc.id, quote_id=act_cc.id, 
                 category="CAJA_CHICA", description=f"Factura {fact_cc}", 
@@ -128,7 +226,7 @@ with tab_caja:
                 text_additional=txt_add,
                 pay_to=pay_to_txt
             ))
-            db.commit(); st.success("Guardado")
+            st.success("Guardado")
 
     st.divider()
     st.markdown("⬇️ **Reporte Contable Caja Chica**")
@@ -137,50 +235,49 @@ with tab_caja:
     start_d_cc = col_d1.date_input("Desde", datetime.date.today().replace(day=1), key="d1_cc")
     end_d_cc = col_d2.date_input("Hasta", datetime.date.today(), key="d2_cc")
     
-    if st.button("Generar CSV Contable"):
-        data_cc = db.query(Expense).filter(
-            Expense.category=="CAJA_CHICA", 
-            Expense.date >= start_d_cc, 
-            Expense.date <= end_d_cc
-        ).all()
-        
-        if data_cc:
-            export_data = []
-            for e in data_cc:
-                export_data.append({
-                    "Operación Contable": "COSTO O GASTO GRAVADO", 
-                    "Monto": e.amount_gtq, 
-                    "ST.doc": "", 
-                    "Ind.Impuesto": "V1", 
-                    "Libro Mayor": "7006080000",
-                    "NIT": e.company.nit if e.company else "", 
-                    "RAZÓN SOCIAL": e.company.legal_name if e.company else "",
-                    "Fecha Documento": e.date, 
-                    "# FACT": e.doc_number, 
-                    "Orden Interna": e.oi.oi_code, 
-                    "Texto": "B", 
-                    "Texto Adicional 2": e.text_additional,
-                    "Pagar A": e.pay_to,
-                    "Actividad": e.quote.activity_name
-                })
-            df_cc = pd.DataFrame(export_data)
-            st.download_button("Descargar CSV Contable", df_cc.to_csv(index=False).encode('utf-8'), "caja_chica_contable.csv", "text/csv")
-        else:
-            st.warning("No hay gastos en ese rango de fechas.")
+    fmt_cc = st.radio("Formato", list(EXPORT_FORMATS), horizontal=True, key="fmt_cc")
+    
+    if st.button("Generar Reporte Contable"):
+        submit_job_or_warn(
+            db, "export_caja_chica",
+            {"start": start_d_cc.isoformat(), "end": end_d_cc.isoformat(), "fmt": fmt_cc},
+            "job_caja_chica"
+        )
+
+    if "job_caja_chica" in st.session_state:
+        job_panel(st.session_state["job_caja_chica"], key="caja_chica")
 
 # --- PESTAÑA 3: HOST ---
-def format_date_es(d):
-    meses = ["", "enero", "febrero", "marzo", "abril", "mayo", "junio", "julio", "agosto", "septiembre", "octubre", "noviembre", "diciembre"]
-    return f"{d.day} de {meses[d.month]} de {d.year}"
+# Fragmento: agregar/quitar filas de cobro, escribir tarifas o elegir talento solo
+# vuelve a ejecutar ESTA pestaña (no las consultas ni formularios de ODC / Caja Chica).
+def new_host_rows():
+    return [{"desc": "", "rate": 0.0, "days": 0}]
+
+def _reset_host_rows():
+    # Limpia el borrador y los valores de los inputs de cada fila
+    for k in [k for k in st.session_state if str(k).startswith(("hd_", "hr_", "hdy_"))]:
+        del st.session_state[k]
+    clear_draft_state("host_rows", new_host_rows())
+
+def _add_host_row():
+    st.session_state["host_rows"].append({"desc": "", "rate": 0.0, "days": 0})
+
+def _remove_host_row(idx):
+    if len(st.session_state["host_rows"]) > 1:
+        st.session_state["host_rows"].pop(idx)
+
+@st.fragment
+def host_tab():
+    db = page_db("host")
+    provs = db.query(Proveedor).filter(Proveedor.is_active==True).all()
+    active_quotes = db.query(Quote).filter(Quote.status == "APROBADA").all()
 
-with tab_host:
     st.header("🎤 Gestión de Talentos (Host)")
 
     # --- PASO 1: DATOS DEL TALENTO ---
     st.markdown("### 1️⃣ Ingresar Datos del Servicio")
     col_h1, col_h2 = st.columns(2)
     
-    # Selección de Proveedor (Solo necesitamos cargarlos una vez, ya están en provs)
     prov_host = col_h1.selectbox("Seleccionar Talento (Proveedor)", provs, format_func=lambda x: x.name, key="prov_host")
     
     if prov_host:
@@ -194,8 +291,8 @@ with tab_host:
     contract_desc_form = st.text_input("Descripción Legal para el Contrato", placeholder="Ej: promoción de marca, conducción de evento, creación de contenido...")
 
     st.markdown("**Detalle de Cobros (Filas del Recibo)**")
-    if "host_rows" not in st.session_state:
-        st.session_state["host_rows"] = [{"desc": "", "rate": 0.0, "days": 0}]
+    # Las filas se retoman del borrador guardado en BD (otra sesión / réplica)
+    draft_state("host_rows", new_host_rows())
 
     for idx, row in enumerate(st.session_state["host_rows"]):
         c_desc, c_rate, c_days, c_del = st.columns([3, 1, 1, 0.5])
@@ -203,15 +300,14 @@ with tab_host:
         row["rate"] = c_rate.number_input(f"Tarifa Q {idx+1}", value=row["rate"], step=50.0, key=f"hr_{idx}")
         row["days"] = c_days.number_input(f"Días/Cant {idx+1}", value=row["days"], step=1, key=f"hdy_{idx}")
         
-        if c_del.button("🗑️", key=f"del_{idx}"):
-            if len(st.session_state["host_rows"]) > 1:
-                st.session_state["host_rows"].pop(idx)
-                st.rerun()
+        # Callbacks: la lista se actualiza antes del rerun del fragmento (sin st.rerun extra)
+        c_del.button("🗑️", key=f"del_{idx}", on_click=_remove_host_row, args=(idx,))
 
     if len(st.session_state["host_rows"]) < 10:
-        if st.button("➕ Agregar otra fila de cobro"):
-            st.session_state["host_rows"].append({"desc": "", "rate": 0.0, "days": 0})
-            st.rerun()
+        st.button("➕ Agregar otra fila de cobro", on_click=_add_host_row)
+
+    # Autoguardado: solo escribe en BD si las filas cambiaron
+    autosave_draft("host_rows")
 
     total_host = sum([r["rate"] * r["days"] for r in st.session_state["host_rows"]])
     st.info(f"💰 **Total a Pagar: Q{total_host:,.2f}**")
@@ -222,11 +318,10 @@ with tab_host:
     st.markdown("### 2️⃣ Registrar en Actividad")
     st.caption("Selecciona de dónde saldrá el dinero para pagar esto.")
     
-    # --- CORRECCIÓN AQUÍ TAMBIÉN: Usamos active_quotes ---
     act_host_selection = st.selectbox(
         "Seleccionar Actividad (Presupuesto)", 
         active_quotes, 
-        format_func=lambda x: f"{x.activity_name} | {x.mall.name if x.mall else 'Global'}", 
+        format_func=activity_label, 
         key="act_host"
     )
 
@@ -258,134 +353,47 @@ with tab_host:
                 mall_id=act_fresh.mall_id, oi_id=oi_id_final, quote_id=act_fresh.id,
                 category="HOST", description=f"Host {prov_host.name} - {contract_desc_form}", 
                 amount_gtq=total_host, amount_usd=total_host/rate,
-                company_id=prov_host.id, host_details=st.session_state["host_rows"]
+                company_id=prov_host.id,
+                service_lines=[
+                    HostServiceLine(line_no=i, description=r["desc"], rate=r["rate"], days=r["days"], total=r["rate"] * r["days"])
+                    for i, r in enumerate(st.session_state["host_rows"], start=1)
+                ]
             )
-            db.add(new_exp)
-            db.commit()
-            
-
-            # 2. Generar PDF Recibo
-            recibo_id_str = f"{new_exp.id:05d}"
-            header_img_path = "header_spectrummedia.png"
-            width, height = LETTER
-            
-            buff_recibo = io.BytesIO()
-            p = canvas.Canvas(buff_recibo, pagesize=LETTER)
-            if os.path.exists(header_img_path): p.drawImage(header_img_path, 0, height-100, width=width, height=100, preserveAspectRatio=False, mask='auto')
-            else: p.setFillColor(colors.black); p.rect(0, height-80, width, 80, fill=1); p.setFillColor(colors.white); p.setFont("Helvetica-Bold", 24); p.drawString(50, height-50, "spectrum media")
+            save_expense(db, new_exp)
             
-            p.setFillColor(colors.white); p.setFont("Helvetica-Bold", 18); p.drawRightString(width - 50, height - 50, f"RECIBO #{recibo_id_str}")
-            p.setFillColor(colors.black); p.setFont("Helvetica-Bold", 12); y = height - 130
-            p.drawString(400, y, f"FECHA: {date_host.strftime('%d/%m/%Y')}")
-            p.drawString(50, y, "RECIBO DE: SPECTRUM MEDIA LAB"); p.drawString(50, y-20, f"RECIBO PARA: {prov_host.name.upper()}")
-            p.setFont("Helvetica", 10); p.drawString(50, y-60, f"Banco: {prov_host.bank_name}"); p.drawString(50, y-75, f"Nombre: {prov_host.name}"); p.drawString(50, y-90, f"Cuenta: {prov_host.account_number}")
-            
-            y_table = y - 140; p.setFont("Helvetica-Bold", 10)
-            p.drawString(50, y_table, "DESCRIPCION"); p.drawString(350, y_table, "TARIFA"); p.drawString(420, y_table, "DIAS"); p.drawString(500, y_table, "TOTAL")
-            p.line(50, y_table-5, 550, y_table-5)
-            
-            y_row = y_table - 25; p.setFont("Helvetica", 10)
-            for row in st.session_state["host_rows"]:
-                p.drawString(50, y_row, row["desc"])
-                p.drawString(350, y_row, f"Q{row['rate']:,.2f}")
-                p.drawString(430, y_row, str(row['days']))
-                p.drawString(500, y_row, f"Q{row['rate']*row['days']:,.2f}")
-                p.line(50, y_row-5, 550, y_row-5); y_row -= 25
-            
-            p.setFont("Helvetica-Bold", 14); p.drawString(50, y_row-20, "TOTAL PAGADO"); p.drawString(500, y_row-20, f"Q{total_host:,.2f}")
-            p.line(200, 100, 400, 100); p.setFont("Helvetica", 8); p.drawCentredString(300, 85, "FIRMA DE CONFORMIDAD"); p.save(); buff_recibo.seek(0)
 
-            # 3. Generar PDF Contrato (MODELO EXACTO SEGÚN REFERENCIA)
-            buff_contrato = io.BytesIO()
-            c = canvas.Canvas(buff_contrato, pagesize=LETTER)
-            
-            # --- Encabezado (Imagen superior) ---
-            if os.path.exists(header_img_path):
-                c.drawImage(header_img_path, 0, height-100, width=width, height=100, preserveAspectRatio=False, mask='auto')
-            
-            styles = getSampleStyleSheet()
-            
-            # --- Asunto y Fecha (Alineado a la derecha) ---
-            style_right = ParagraphStyle(name='Right', parent=styles['Normal'], alignment=TA_RIGHT, fontSize=10, leading=14)
-            fecha_str = format_date_es(date_host)
-            p_asunto = Paragraph(f"<b>Asunto: Brand Activation Ambassador</b><br/><br/>En la fecha: <b>{fecha_str}</b>.", style_right)
-            w, h = p_asunto.wrap(width - 100, 100)
-            p_asunto.drawOn(c, 50, height - 160)
-            
-            # --- Cuerpo del Contrato (Justificado) ---
-            style_justify = ParagraphStyle(name='Justify', parent=styles['Normal'], alignment=TA_JUSTIFY, fontSize=10, leading=14, spaceAfter=14)
-            cui_val = getattr(prov_host, 'cui', 'N/A')
-            
-            txt_1 = f"Yo, <b>{prov_host.name}</b> me identifico con el Documento Personal de Identificación (DPI) con Código Único de Identificación (CUI) No. <b>{cui_val}</b>, por medio de la presente acuerdo prestar servicios como <b>BRAND ACTIVATION AMBASSADOR - {contract_desc_form.upper()}</b> para SPECTRUM MEDIA prestando un servicio y realizando actividades relacionadas con promoción de producto, eventos o generación de contenido, según lo asignado."
-            
-            txt_2 = f"Como compensación por estos servicios, se entregará un pago único de <b>Q.{total_host:,.2f}</b>, el día y lugar que me ha sido notificado previamente."
-            
-            txt_3 = "En consecuencia, ambas partes reconocen expresamente que:<br/>• No existe entre ellas relación laboral de ningún tipo, conforme a la legislación laboral vigente.<br/>• No se genera ninguna obligación de carácter laboral, tales como pago de salarios, prestaciones laborales, indemnizaciones, o cualquier otro derecho laboral que derive de una relación de trabajo subordinado.<br/>• Cada parte actúa de forma autónoma, sin que exista dependencia, ni vínculo permanente más allá del objeto del contrato de servicios."
-            
-            txt_4 = f"La presente notificación tiene como finalidad reiterar la naturaleza de la prestación de servicios, y dejar claro que no se establece, ni se presumirá, ningún tipo de vínculo laboral entre Spectrum Media y {prov_host.name}."
-            
-            # Dibujar los párrafos en orden calculando el alto dinámicamente
-            y_curr = height - 210 
-            for txt in [txt_1, txt_2, txt_3, txt_4]:
-                p = Paragraph(txt, style_justify)
-                w, h = p.wrap(width - 100, height)
-                p.drawOn(c, 50, y_curr - h)
-                y_curr -= (h + 16) # Espacio entre párrafos
-            
-            # --- ZONA DE FIRMAS (Centradas) ---
-            center_x = width / 2
-            style_center = ParagraphStyle(name='Center', parent=styles['Normal'], alignment=TA_CENTER, fontSize=9, leading=11)
-            
-            # 1. Línea y texto del Talento (Brand Ambassador)
-            y_sig1_line = y_curr - 40
-            c.setLineWidth(1)
-            c.setStrokeColor(colors.black)
-            c.line(center_x - 120, y_sig1_line, center_x + 120, y_sig1_line)
-            
-            p_sig1 = Paragraph(f"<b>Firma del Brand Ambassador</b><br/>{prov_host.name}", style_center)
-            w, h = p_sig1.wrap(240, 50)
-            p_sig1.drawOn(c, center_x - 120, y_sig1_line - h - 5)
-            
-            # 2. Insertar Imagen de la Firma (en medio)
-            firma_img_path = "firma.png"
-            y_sig2_line = y_sig1_line - 100 # Espacio hacia la segunda línea
-            
-            if os.path.exists(firma_img_path):
-                img_w, img_h = 130, 60 # Tamaño aproximado de la firma
-                img_x = center_x - (img_w / 2)
-                img_y = y_sig2_line + 15 # Posicionada un poco por encima de la segunda línea
-                c.drawImage(firma_img_path, img_x, img_y, width=img_w, height=img_h, mask='auto', preserveAspectRatio=True)
-            
-            # 3. Línea y texto de la Empresa
-            c.line(center_x - 120, y_sig2_line, center_x + 120, y_sig2_line)
-            
-            p_sig2 = Paragraph("<b>Firma del responsable de la empresa:</b><br/>Maria Jose Aguilar, Product Executive", style_center)
-            w, h = p_sig2.wrap(240, 50)
-            p_sig2.drawOn(c, center_x - 120, y_sig2_line - h - 5)
-            
-            c.save()
-            buff_contrato.seek(0)
-            # 4. Crear ZIP y GUARDAR EN MEMORIA (st.session_state)
-            zip_buffer = io.BytesIO()
-            with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
-                zip_file.writestr(f"Recibo_{recibo_id_str}.pdf", buff_recibo.getvalue())
-                zip_file.writestr(f"Contrato_{recibo_id_str}.pdf", buff_contrato.getvalue())
-            
-            # Guardamos los bytes del ZIP en la memoria de Streamlit
-            st.session_state["zip_data_host"] = zip_buffer.getvalue()
-            st.session_state["zip_name_host"] = f"Pack_Legal_{prov_host.name}_{recibo_id_str}.zip"
+            # 2. Recibo + Contrato + ZIP se generan en segundo plano (ReportLab no bloquea la página)
+            submit_job_or_warn(
+                db, "host_pack",
+                {"expense_id": new_exp.id, "contract_desc": contract_desc_form},
+                "job_host"
+            )
             
-            st.success("✅ Gasto Registrado en Base de Datos y Documentos Listos")
+            _reset_host_rows()
+            st.success("✅ Gasto Registrado en Base de Datos. Generando documentos...")
             st.balloons()
 
-    # --- BOTÓN DE DESCARGA: AFUERA del 'if st.button' ---
-    # Solo se muestra si el ZIP ya está en memoria
-    if "zip_data_host" in st.session_state:
-        st.info("Tus documentos están listos para descargar:")
-        st.download_button(
-            label="⬇️ DESCARGAR DOCUMENTOS (CLICK AQUÍ)", 
-            data=st.session_state["zip_data_host"], 
-            file_name=st.session_state["zip_name_host"], 
-            mime="application/zip",
-            key="dl_btn_final"
-        )
\ No newline at end of file
+    # --- ESTADO / DESCARGA: AFUERA del 'if st.button' ---
+    if "job_host" in st.session_state:
+        job_panel(st.session_state["job_host"], key="host")
+
+    st.divider()
+
+    # --- REPORTE DE PAGOS A TALENTOS ---
+    with st.expander("📊 Pagos a Talentos (por talento, mes o actividad)"):
+        col_p1, col_p2, col_p3 = st.columns(3)
+        start_pay = col_p1.date_input("Desde", datetime.date.today().replace(month=1, day=1), key="d1_host_pay")
+        end_pay = col_p2.date_input("Hasta", datetime.date.today(), key="d2_host_pay")
+        group_pay = col_p3.selectbox("Agrupar por", list(HOST_PAYOUT_GROUPS), key="group_host_pay")
+        
+        df_pay = host_payouts(db, start_pay, end_pay, group_pay)
+        if df_pay.empty:
+            st.info("No hay pagos Host en ese rango de fechas.")
+        else:
+            st.dataframe(df_pay, hide_index=True, use_container_width=True, column_config={
+                "Total Q": st.column_config.NumberColumn(format="Q%.2f")
+            })
+            st.caption(f"Total pagado: Q{from_cents(sum_cents(to_cents(df_pay['Total Q'].to_numpy()))):,.2f}")
+
+with tab_host:
+    host_tab()
@@ -1,14 +1,20 @@
 import streamlit as st
 import pandas as pd
-import altair as alt
 import datetime
-from database import get_db
+from database import page_db
 from models import Expense, OI, Mall, ActivityType, Quote
 from auth import require_role
 from services import get_active_rate
+from ui import admission_gate
+from money import to_cents, from_cents, sum_cents
+from analytics import (
+    CHART_TOP_N, OI_CHART_RANKINGS, oi_chart_data,
+    MONTHLY_DIMENSIONS, monthly_spend, monthly_pivot, mall_month_heatmap,
+    PROFITABILITY_SORTS, PROFITABILITY_PAGE_SIZE, quote_profitability
+)
 
 require_role(["ADMIN", "AUTORIZADO", "VENDEDOR"])
-db = next(get_db())
+db = page_db(read=True)
 
 st.title("📊 Dashboard Financiero")
 
@@ -89,25 +95,28 @@ if sel_types:
 if sel_quotes:
     q_sales = q_sales.filter(Quote.id.in_([q.id for q in sel_quotes]))
 
-sales_data = q_sales.all()
-ids_quotes_visible = [q.id for q in sales_data]
+# Consultas pesadas: pasan por la compuerta de admisión (límite de Dashboards simultáneos)
+with admission_gate("dashboard"):
+    sales_data = q_sales.all()
+    ids_quotes_visible = [q.id for q in sales_data]
+
+    # Gasto Real (Query a BD de gastos asociados a estas cotizaciones)
+    if ids_quotes_visible:
+        gastos_reales_list = db.query(Expense).filter(Expense.quote_id.in_(ids_quotes_visible)).all()
+        total_gasto_real_usd = from_cents(sum_cents(to_cents([e.amount_usd for e in gastos_reales_list])))
+    else:
+        total_gasto_real_usd = 0.0
 
 # 2. CÁLCULOS
 # Venta Total (Si no hay precio final, usa el sugerido como proyección)
-total_venta_usd = sum([
+# (sumas exactas en centavos enteros)
+total_venta_usd = from_cents(sum_cents(to_cents([
     q.final_sale_price_usd if q.final_sale_price_usd else q.suggested_price_usd_m60 
     for q in sales_data
-])
+])))
 
 # Costo Presupuestado (Teórico según cotización)
-total_costo_presupuesto_usd = sum([q.total_cost_usd for q in sales_data])
-
-# Gasto Real (Query a BD de gastos asociados a estas cotizaciones)
-if ids_quotes_visible:
-    gastos_reales_list = db.query(Expense).filter(Expense.quote_id.in_(ids_quotes_visible)).all()
-    total_gasto_real_usd = sum([e.amount_usd for e in gastos_reales_list])
-else:
-    total_gasto_real_usd = 0.0
+total_costo_presupuesto_usd = from_cents(sum_cents(to_cents([q.total_cost_usd for q in sales_data])))
 
 # Utilidades
 utilidad_real_usd = total_venta_usd - total_gasto_real_usd
@@ -173,6 +182,49 @@ c_var.metric(
     help="Diferencia entre lo Presupuestado y lo Real."
 )
 
+# RANKING POR ACTIVIDAD (orden, filtro y paginación en SQL: solo viaja la página visible)
+@st.fragment
+def profitability_section():
+    st.subheader("🏆 Rentabilidad por Actividad")
+    f1, f2, f3, f4 = st.columns([3, 2, 2, 1])
+    search = f1.text_input("Buscar actividad", key="prof_search", placeholder="Nombre...")
+    sort_by = f2.selectbox("Ordenar por", list(PROFITABILITY_SORTS), key="prof_sort")
+    ascending = f3.toggle("Ascendente (peores primero)", value=True, key="prof_asc")
+    only_losses = f4.checkbox("Solo pérdidas", key="prof_losses")
+
+    def load(page):
+        with admission_gate("dashboard"):
+            return quote_profitability(
+                db, start_filter, end_filter,
+                mall_ids=[m.id for m in sel_malls], type_ids=[t.id for t in sel_types], quote_ids=[q.id for q in sel_quotes],
+                search=search.strip() or None, only_losses=only_losses, sort_by=sort_by, ascending=ascending,
+                page=page, page_size=PROFITABILITY_PAGE_SIZE
+            )
+
+    page = st.session_state.get("prof_page", 1)
+    df_prof, total = load(page)
+    pages = max(1, (total + PROFITABILITY_PAGE_SIZE - 1) // PROFITABILITY_PAGE_SIZE)
+    if page > pages:
+        # Los filtros dejaron menos páginas: se vuelve a la última
+        page = st.session_state["prof_page"] = pages
+        df_prof, total = load(page)
+
+    if total == 0:
+        st.info("No hay actividades con los filtros actuales.")
+        return
+    st.dataframe(
+        df_prof.style.format({
+            'Venta USD': '${:,.2f}', 'Presupuesto USD': '${:,.2f}', 'Gasto Real USD': '${:,.2f}',
+            'Utilidad USD': '${:,.2f}', 'Desvío USD': '${:,.2f}', 'Margen %': '{:.1f}%'
+        }, na_rep="-"),
+        use_container_width=True, hide_index=True
+    )
+    p1, p2 = st.columns([1, 3])
+    p1.number_input("Página", min_value=1, max_value=pages, step=1, key="prof_page")
+    p2.caption(f"{total} actividades · página {page} de {pages}")
+
+profitability_section()
+
 st.divider()
 
 # ==============================================================================
@@ -203,7 +255,58 @@ if sel_types:
 if sel_quotes:
     query_exp = query_exp.filter(Expense.quote_id.in_([q.id for q in sel_quotes]))
 
-expenses = query_exp.all()
+with admission_gate("dashboard"):
+    expenses = query_exp.all()
+
+def _oi_chart_drill(chart_key, malls):
+    # Callback del click en la gráfica: entra al detalle del mall seleccionado
+    picked = st.session_state[chart_key].selection.get("pick") or []
+    if picked and picked[0].get("Mall") in malls:
+        st.session_state["oi_chart_mall"] = picked[0]["Mall"]
+        st.session_state["oi_chart_gen"] = st.session_state.get("oi_chart_gen", 0) + 1
+
+def _oi_chart_back():
+    st.session_state["oi_chart_mall"] = None
+    st.session_state["oi_chart_gen"] = st.session_state.get("oi_chart_gen", 0) + 1
+
+@st.fragment
+def oi_chart_section(df_ois):
+    # Click en una barra = drill-down a las OIs de ese mall (solo se re-ejecuta este fragmento)
+    import altair as alt # Altair se carga solo cuando hay datos que graficar
+    st.subheader("Comparativa por Cuenta (OI)")
+    g1, g2 = st.columns(2)
+    rank_by = g1.radio("Ordenar por", list(OI_CHART_RANKINGS), horizontal=True, key="oi_chart_rank")
+    top_n = g2.slider("OIs individuales", 5, 30, CHART_TOP_N, step=5, key="oi_chart_top")
+
+    malls = set(df_ois['Mall'])
+    drill_mall = st.session_state.get("oi_chart_mall")
+    if drill_mall not in malls:
+        drill_mall = None
+    if drill_mall:
+        st.caption(f"🔎 Detalle de **{drill_mall}**")
+        st.button("⬅️ Volver a todos los malls", key="oi_chart_back", on_click=_oi_chart_back)
+    else:
+        st.caption("Haz click en una barra para ver el detalle de las OIs de ese mall.")
+
+    df_chart = oi_chart_data(df_ois, top_n=top_n, rank_by=rank_by, mall=drill_mall)
+
+    domain = ['budget_usd', 'real_usd']
+    range_ = ['#e0e0e0', '#ff4b4b'] 
+    pick = alt.selection_point(fields=['Mall'], name="pick")
+
+    chart = alt.Chart(df_chart).mark_bar().encode(
+        x=alt.X('Etiqueta', sort=None, title="OI (Mall)"),
+        y='Monto USD',
+        color=alt.Color('Tipo', scale=alt.Scale(domain=domain, range=range_), legend=alt.Legend(title="Indicador")),
+        tooltip=['Etiqueta', 'Mall', 'OIs', 'Tipo', alt.Tooltip('Monto USD', format="$,.2f")]
+    ).add_params(pick).properties(height=400)
+
+    # La llave cambia al entrar / salir del detalle para limpiar la selección anterior
+    chart_key = f"oi_chart_{st.session_state.get('oi_chart_gen', 0)}"
+    st.altair_chart(
+        chart, use_container_width=True, key=chart_key,
+        on_select="ignore" if drill_mall else (lambda: _oi_chart_drill(chart_key, malls))
+    )
 
 # --- PROCESAMIENTO DE DATOS ---
 oi_data = {}
@@ -216,11 +319,11 @@ if not sel_quotes:
             'Nombre': oi_names.get(code, ""),
             'Mall': oi_malls.get(code, ""),
             'budget_usd': budget,
-            'real_usd': 0.0,
-            'real_gtq': 0.0
+            'real_usd': 0,
+            'real_gtq': 0
         }
 
-# Sumar Gastos Reales
+# Sumar Gastos Reales (en centavos enteros: sin error acumulado de Float)
 for e in expenses:
     code = e.oi.oi_code
     if code not in oi_data:
@@ -229,20 +332,22 @@ for e in expenses:
             'Nombre': e.oi.oi_name, 
             'Mall': e.mall.name if e.mall else "N/A",
             'budget_usd': e.oi.annual_budget_usd, 
-            'real_usd': 0.0, 
-            'real_gtq': 0.0
+            'real_usd': 0, 
+            'real_gtq': 0
         }
-    oi_data[code]['real_usd'] += e.amount_usd
-    oi_data[code]['real_gtq'] += e.amount_gtq
+    oi_data[code]['real_usd'] += to_cents(e.amount_usd)
+    oi_data[code]['real_gtq'] += to_cents(e.amount_gtq)
 
 if not oi_data:
     st.info("No hay datos para mostrar con los filtros actuales.")
 else:
     df = pd.DataFrame(list(oi_data.values()))
+    df['real_usd'] = from_cents(df['real_usd'].to_numpy())
+    df['real_gtq'] = from_cents(df['real_gtq'].to_numpy())
     
     # Cálculos
-    total_budget = df['budget_usd'].sum()
-    total_real = df['real_usd'].sum()
+    total_budget = from_cents(sum_cents(to_cents(df['budget_usd'].to_numpy())))
+    total_real = from_cents(sum_cents(to_cents(df['real_usd'].to_numpy())))
     pct_total = (total_real / total_budget * 100) if total_budget > 0 else 0
     
     df['% Ejecución'] = (df['real_usd'] / df['budget_usd']).fillna(0) * 100
@@ -257,22 +362,8 @@ else:
     
     st.progress(min(pct_total / 100, 1.0))
 
-    # GRÁFICA COMPARATIVA
-    st.subheader("Comparativa por Cuenta (OI)")
-    df['Etiqueta'] = df['OI'] + " (" + df['Mall'] + ")"
-    df_chart = df[['Etiqueta', 'budget_usd', 'real_usd', 'Mall']].melt(['Etiqueta', 'Mall'], var_name='Tipo', value_name='Monto USD')
-    
-    domain = ['budget_usd', 'real_usd']
-    range_ = ['#e0e0e0', '#ff4b4b'] 
-
-    chart = alt.Chart(df_chart).mark_bar().encode(
-        x=alt.X('Etiqueta', sort=None, title="OI (Mall)"),
-        y='Monto USD',
-        color=alt.Color('Tipo', scale=alt.Scale(domain=domain, range=range_), legend=alt.Legend(title="Indicador")),
-        tooltip=['Etiqueta', 'Mall', 'Tipo', alt.Tooltip('Monto USD', format="$,.2f")]
-    ).properties(height=400)
-    
-    st.altair_chart(chart, use_container_width=True)
+    # GRÁFICA COMPARATIVA (datos agregados en el servidor: top N + "Otras" por mall)
+    oi_chart_section(df[['OI', 'Mall', 'budget_usd', 'real_usd']])
 
     # TABLA DETALLE
     with st.expander("Ver Detalle Financiero por OI", expanded=True):
@@ -284,4 +375,42 @@ else:
                 'Disponible USD': '${:,.2f}'
             }),
             use_container_width=True
-        )
\ No newline at end of file
+        )
+
+st.divider()
+
+# ==============================================================================
+# SECCIÓN 3: GASTO MENSUAL (SERIES DE TIEMPO)
+# ==============================================================================
+st.header("📅 Gasto Mensual")
+
+@st.fragment
+def monthly_section(df_monthly, start_year, end_year):
+    # Cambiar la dimensión solo re-pivotea el resultado (no vuelve a consultar la BD)
+    import altair as alt
+    dimension = st.radio("Ver por", list(MONTHLY_DIMENSIONS), horizontal=True, key="monthly_dim")
+    st.line_chart(monthly_pivot(df_monthly, dimension, start_year, end_year), y_label="USD")
+
+    st.subheader("Mapa de Calor: Mall × Mes")
+    heat = alt.Chart(mall_month_heatmap(df_monthly)).mark_rect().encode(
+        x=alt.X('Mes:O', title="Mes"),
+        y=alt.Y('Mall:N', title="Mall"),
+        color=alt.Color('Monto USD:Q', scale=alt.Scale(scheme="reds")),
+        tooltip=['Mall', 'Mes', alt.Tooltip('Monto USD', format="$,.2f"), alt.Tooltip('gastos', title="# Gastos")]
+    ).properties(height=max(200, 28 * df_monthly['Mall'].nunique()))
+    st.altair_chart(heat, use_container_width=True)
+
+start_year, end_year = st.select_slider(
+    "Rango de años", options=list(range(sel_year - 4, sel_year + 1)), value=(sel_year - 1, sel_year)
+)
+
+with admission_gate("dashboard"):
+    df_monthly = monthly_spend(
+        db, start_year, end_year,
+        mall_ids=[m.id for m in sel_malls], type_ids=[t.id for t in sel_types], quote_ids=[q.id for q in sel_quotes]
+    )
+
+if df_monthly.empty:
+    st.info("No hay gastos en el rango seleccionado.")
+else:
+    monthly_section(df_monthly, start_year, end_year)
@@ -1,27 +1,24 @@
 import streamlit as st
 import pandas as pd
-from database import get_db
+from database import page_db
 from models import Insumo, Mall, ActivityType, Proveedor, OI, User
 from auth import require_role, hash_password
-import bcrypt
-import streamlit as st
-from database import engine
-from models import Base
-from sqlalchemy import func
+from catalogs import read_insumos_file, read_types_file, preview_upload, PREVIEW_ROWS
+from jobs import save_upload
+from ui import job_panel, submit_job_or_warn
 
 require_role(["ADMIN", "AUTORIZADO"])
-db = next(get_db())
+db = page_db()
 
 with st.sidebar:
     st.divider()
     st.error("⚠️ ZONA DE PELIGRO")
     if st.button("☢️ HARD RESET DB (Borrar Todo)", type="primary"):
         try:
-            # 1. Borra las tablas viejas en la nube
-            Base.metadata.drop_all(bind=engine)
-            
-            # 2. Crea las tablas nuevas (con category y description)
-            Base.metadata.create_all(bind=engine)
+            # Borra las tablas, las vuelve a crear y re-siembra el admin
+            # (el DDL vive en bootstrap; se importa solo si se presiona el botón)
+            from bootstrap import reset_database
+            reset_database()
             
             st.success("✅ ¡Base de datos en la nube reseteada!")
             st.rerun()
@@ -61,47 +58,12 @@ with tab1:
     uploaded_insumos = st.file_uploader("Subir CSV de Insumos", type=["csv"], key="csv_insumos")
 
     if uploaded_insumos:
-        # --- LÓGICA DE LECTURA ROBUSTA (UTF-8 y LATIN-1) ---
+        # --- LECTURA EN UNA PASADA (detecta UTF-8 / LATIN-1 y COMA / PUNTO Y COMA) + MAPEO ESPAÑOL -> INGLÉS ---
         try:
-            # Intento 1: Leer normal (UTF-8 y coma)
-            df_insumos = pd.read_csv(uploaded_insumos)
-            
-            # Chequeo de Separador: Si solo detectó 1 columna, seguro era punto y coma
-            if df_insumos.shape[1] < 2:
-                uploaded_insumos.seek(0)
-                df_insumos = pd.read_csv(uploaded_insumos, sep=';')
-
-        except UnicodeDecodeError:
-            # Intento 2: Si falla por tildes/ñ, probamos codificación 'latin-1' (Excel Español)
-            uploaded_insumos.seek(0)
-            try:
-                df_insumos = pd.read_csv(uploaded_insumos, encoding='latin-1')
-                if df_insumos.shape[1] < 2:
-                    uploaded_insumos.seek(0)
-                    df_insumos = pd.read_csv(uploaded_insumos, sep=';', encoding='latin-1')
-            except Exception as e:
-                st.error(f"❌ Error leyendo formato 'Latin-1': {e}")
-                st.stop()
-                
+            df_insumos = preview_upload(read_insumos_file(uploaded_insumos, chunksize=PREVIEW_ROWS))
         except Exception as e:
-            # Si es otro error, lo mostramos explícitamente para saber qué es
             st.error(f"❌ Error técnico: {e}")
             st.stop()
-
-        # --- A PARTIR DE AQUÍ SIGUE TU CÓDIGO NORMAL DE NORMALIZACIÓN ---
-        # Normalizar columnas (minúsculas y sin espacios)
-        df_insumos.columns = [c.lower().strip() for c in df_insumos.columns]        
-        # --- MAPEO INTELIGENTE (ESPAÑOL -> INGLÉS) ---
-        rename_map = {
-            'nombre': 'name', 'insumo': 'name', 'item': 'name',
-            'costo': 'cost_gtq', 'precio': 'cost_gtq', 'cost': 'cost_gtq',
-            'unidad': 'unit_type', 'medida': 'unit_type', 'tipo': 'unit_type',
-            'cobro': 'billing_mode', 'modo': 'billing_mode',
-            # NUEVOS CAMPOS
-            'categoria': 'category', 'cat': 'category', 'categoría': 'category',
-            'descripcion': 'description', 'detalle': 'description', 'desc': 'description'
-        }
-        df_insumos.rename(columns=rename_map, inplace=True)
         
         st.write("Columnas detectadas:", df_insumos.columns.tolist()) # Para depuración
         st.dataframe(df_insumos.head())
@@ -111,48 +73,15 @@ with tab1:
             st.error("❌ Error: No se encuentra la columna 'Nombre' o 'Name'. Revisa tu archivo.")
         else:
             if st.button("🚀 Procesar Carga Insumos"):
-                existing_names = {i.name for i in db.query(Insumo).all()}
-                new_objects = []
-                skipped_count = 0
-                
-                for index, row in df_insumos.iterrows():
-                    name_val = str(row['name']).strip()
-                    
-                    if name_val in existing_names or name_val == "nan":
-                        skipped_count += 1
-                        continue 
-                    
-                    # Manejo seguro de valores numéricos
-                    try:
-                        cost_val = float(str(row.get('cost_gtq', 0)).replace(',', '').replace('Q', ''))
-                    except:
-                        cost_val = 0.0
-
-                    # Limpieza de textos nuevos
-                    cat_val = row.get('category', None)
-                    if pd.isna(cat_val): cat_val = "Varios" # Default si no trae
-                    
-                    desc_val = row.get('description', "")
-                    if pd.isna(desc_val): desc_val = ""
-
-                    new_obj = Insumo(
-                        name=name_val,
-                        unit_type=row.get('unit_type', 'UNIDAD'), 
-                        cost_gtq=cost_val,
-                        billing_mode=row.get('billing_mode', 'MULTIPLICABLE'),
-                        category=str(cat_val),        # <--- NUEVO
-                        description=str(desc_val)     # <--- NUEVO
-                    )
-                    new_objects.append(new_obj)
-                    existing_names.add(name_val) 
+                # Se procesa en segundo plano: la página no se congela y recargar no la interrumpe
+                submit_job_or_warn(
+                    db, "import_insumos",
+                    {"path": save_upload(uploaded_insumos), "filename": uploaded_insumos.name},
+                    "job_insumos"
+                )
 
-                if new_objects:
-                    db.add_all(new_objects)
-                    db.commit()
-                    st.success(f"✅ Se agregaron {len(new_objects)} nuevos insumos.")
-                
-                if skipped_count > 0:
-                    st.warning(f"⚠️ Se omitieron {skipped_count} insumos (ya existían o vacíos).")
+    if "job_insumos" in st.session_state:
+        job_panel(st.session_state["job_insumos"], key="insumos")
 
 
     with st.expander("➕ Crear Nuevo Insumo"):
@@ -333,105 +262,15 @@ with tab2:
             uploaded_oi = st.file_uploader("Sube archivo", type=["xlsx", "csv"])
             
             if uploaded_oi and st.button("Procesar Archivo"):
-                try:
-                    # 1. LECTURA BLINDADA (Forzamos a que el Código sea Texto para no perder dígitos)
-                    if uploaded_oi.name.endswith('.csv'):
-                        # Para CSV: Detectamos separador automático y forzamos string
-                        df_load = pd.read_csv(
-                            uploaded_oi, 
-                            encoding='utf-8-sig', 
-                            sep=None, 
-                            engine='python', 
-                            dtype={'Codigo': str} # <--- ¡ESTO ES VITAL!
-                        )
-                    else:
-                        # Para EXCEL: Esta es la mejor opción
-                        df_load = pd.read_excel(
-                            uploaded_oi, 
-                            dtype={'Codigo': str} # <--- Lee "300000002352" tal cual, sin redondear
-                        )
-                    
-                    # Limpieza de nombres de columnas (quita espacios extra)
-                    df_load.columns = df_load.columns.str.strip()
-                    
-                    # Validación de columnas
-                    if 'Mall' not in df_load.columns or 'Codigo' not in df_load.columns:
-                        st.error(f"Error: No encuentro las columnas 'Mall' o 'Codigo'. Detectadas: {list(df_load.columns)}")
-                        st.stop()
-
-                    # Mapeo de Malls
-                    malls_map = {m.name.strip().lower(): m.id for m in db.query(Mall).all()}
-                    
-                    created_count = 0
-                    updated_count = 0
-                    errors = []
-
-                    for index, row in df_load.iterrows():
-                        try:
-                            # Datos básicos
-                            mall_input = str(row['Mall']).strip()
-                            mall_key = mall_input.lower()
-                            
-                            # --- RECUPERACIÓN DEL CÓDIGO EXACTO ---
-                            # Al leer como string, debería venir como "300000002352"
-                            raw_code = str(row['Codigo']).strip()
-                            
-                            # Solo si por desgracia viene como notación científica (ej: "3.00E+11"), intentamos convertirlo
-                            # Pero si subes el Excel, esto NO debería pasar.
-                            if 'E+' in raw_code:
-                                st.warning(f"Fila {index+1}: El código venía en notación científica ({raw_code}). Se perderá precisión. Usa .xlsx mejor.")
-                                clean_code = str(int(float(raw_code)))
-                            elif raw_code.endswith('.0'):
-                                clean_code = raw_code[:-2]
-                            else:
-                                clean_code = raw_code # Aquí tomamos el "300000002352" original
-                            # --------------------------------------
-
-                            if mall_key not in malls_map:
-                                errors.append(f"Fila {index+1}: Mall '{mall_input}' no existe.")
-                                continue
-                            
-                            mall_id_found = malls_map[mall_key]
-                            
-                            # Upsert (Actualizar o Crear)
-                            existing_oi = db.query(OI).filter(OI.oi_code == clean_code).first()
-                            
-                            if existing_oi:
-                                existing_oi.mall_id = mall_id_found
-                                existing_oi.oi_name = str(row['Nombre']).strip()
-                                existing_oi.annual_budget_usd = float(row['Presupuesto'])
-                                updated_count += 1
-                            else:
-                                new_oi = OI(
-                                    mall_id=mall_id_found,
-                                    oi_code=clean_code, # Guardamos el código exacto
-                                    oi_name=str(row['Nombre']).strip(),
-                                    annual_budget_usd=float(row['Presupuesto']),
-                                    is_active=True
-                                )
-                                db.add(new_oi)
-                                created_count += 1
-                                
-                        except Exception as row_e:
-                            errors.append(f"Error fila {index+1}: {row_e}")
-
-                    db.commit()
-                    
-                    if created_count > 0 or updated_count > 0:
-                        st.success(f"✅ Procesado: {created_count} nuevos y {updated_count} actualizados.")
-                        st.balloons()
-                        st.rerun()
-                    elif not errors:
-                        st.warning("⚠️ No hubo cambios en la base de datos.")
-                        
-                    if errors:
-                        st.error("Errores encontrados:")
-                        for e in errors:
-                            st.write(f"- {e}")
+                # El Código se lee como texto (no se pierden dígitos) y se hace upsert por código
+                submit_job_or_warn(
+                    db, "import_ois",
+                    {"path": save_upload(uploaded_oi), "filename": uploaded_oi.name},
+                    "job_ois"
+                )
 
-                except Exception as e:
-                    db.rollback()
-                    st.error(f"Error crítico: {e}")
+            if "job_ois" in st.session_state:
+                job_panel(st.session_state["job_ois"], key="ois")
 
         st.write("---")
         st.subheader("📋 Listado y Edición de OIs")
@@ -550,23 +389,11 @@ with tab3:
 
     if uploaded_types:
         try:
-            df_types = pd.read_csv(uploaded_types)
-            if df_types.shape[1] < 2:
-                uploaded_types.seek(0)
-                df_types = pd.read_csv(uploaded_types, sep=';')
-        except:
+            # Normaliza encabezados y aplica el MAPEO INTELIGENTE (Español -> Inglés)
+            df_types = preview_upload(read_types_file(uploaded_types, chunksize=PREVIEW_ROWS))
+        except Exception:
             st.error("Error leyendo el archivo. Asegúrate que sea un CSV válido.")
             st.stop()
-
-        # Normalizar encabezados
-        df_types.columns = [c.lower().strip() for c in df_types.columns]
-        
-        # MAPEO INTELIGENTE (Español -> Inglés)
-        rename_map = {
-            'nombre': 'name', 'tipo': 'name', 'actividad': 'name',
-            'descripcion': 'description', 'descripción': 'description', 'detalle': 'description'
-        }
-        df_types.rename(columns=rename_map, inplace=True)
         
         st.write("Columnas detectadas:", df_types.columns.tolist())
         
@@ -574,34 +401,14 @@ with tab3:
             st.error("❌ Error: Falta la columna 'Nombre' o 'Tipo'.")
         else:
             if st.button("🚀 Procesar Carga Tipos"):
-                existing_types = {t.name for t in db.query(ActivityType).all()}
-                new_types = []
-                skipped = 0
-                
-                for index, row in df_types.iterrows():
-                    name_val = str(row['name']).strip()
-                    
-                    if name_val in existing_types or name_val == "nan" or name_val == "":
-                        skipped += 1
-                        continue
-                    
-                    desc_val = str(row.get('description', ''))
-                    if desc_val == "nan": desc_val = ""
-
-                    new_obj = ActivityType(
-                        name=name_val,
-                        description=desc_val
-                    )
-                    new_types.append(new_obj)
-                    existing_types.add(name_val)
+                submit_job_or_warn(
+                    db, "import_tipos",
+                    {"path": save_upload(uploaded_types), "filename": uploaded_types.name},
+                    "job_tipos"
+                )
 
-                if new_types:
-                    db.add_all(new_types)
-                    db.commit()
-                    st.success(f"✅ Se agregaron {len(new_types)} nuevos tipos.")
-                
-                if skipped > 0:
-                    st.warning(f"⚠️ Se omitieron {skipped} tipos duplicados.")
+    if "job_tipos" in st.session_state:
+        job_panel(st.session_state["job_tipos"], key="tipos")
 
     with st.expander("➕ Nueva Actividad", expanded=True):
         with st.form("na"):
@@ -722,10 +529,10 @@ with tab4:
                     user.username = u_name
                     user.role = row["role"]
                     if pw and pw not in ["", "nan"]:
-                        user.password_hash = bcrypt.hashpw(pw.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+                        user.password_hash = hash_password(pw)
             else:
                 if pw and pw not in ["", "nan"]:
-                    hash_pw = bcrypt.hashpw(pw.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+                    hash_pw = hash_password(pw)
                     db.add(User(username=u_name, role=row["role"], password_hash=hash_pw))
         
         db.commit()
@@ -742,94 +549,15 @@ with tab5:
     uploaded_prov = st.file_uploader("Sube CSV o Excel", type=["csv", "xlsx"], key="upload_prov_full")
 
     if uploaded_prov and st.button("Procesar Proveedores"):
-        try:
-            # --- 1. LECTURA INTELIGENTE ---
-            if uploaded_prov.name.endswith('.csv'):
-                try:
-                    # Intento A: UTF-8 + Auto-separador
-                    df_prov = pd.read_csv(uploaded_prov, sep=None, engine='python', encoding='utf-8-sig', dtype=str)
-                except:
-                    # Intento B: Latin-1 (Excel español)
-                    uploaded_prov.seek(0)
-                    df_prov = pd.read_csv(uploaded_prov, sep=';', encoding='latin-1', dtype=str)
-            else:
-                # Excel (dtype=str para que el NIT o Cuenta no pierdan ceros o se vuelvan notación científica)
-                df_prov = pd.read_excel(uploaded_prov, dtype=str)
-            
-            # Limpiar encabezados (quitar espacios y poner todo bonito)
-            df_prov.columns = df_prov.columns.str.strip()
-            
-            # --- 2. MAPEO DE COLUMNAS (BUSCADOR INTELIGENTE) ---
-            # Función para buscar columna ignorando mayúsculas/tildes
-            def find_col(options):
-                for col in df_prov.columns:
-                    if col.lower().strip() in [o.lower() for o in options]:
-                        return col
-                return None
-
-            # Buscamos las columnas basándonos en tu formulario
-            c_nombre = find_col(['Nombre Comercial', 'Nombre', 'Empresa', 'Proveedor'])
-            c_razon  = find_col(['Razón Social', 'Razon Social', 'Legal'])
-            c_tipo   = find_col(['Tipo', 'Categoria', 'Servicio'])
-            c_nit    = find_col(['NIT', 'Nit'])
-            c_cui    = find_col(['CUI', 'DPI', 'Identificacion'])
-            c_banco  = find_col(['Banco', 'Bank'])
-            c_cuenta = find_col(['No. de Cuenta', 'No Cuenta', 'Cuenta', 'Numero Cuenta'])
-
-            # Validación mínima: El nombre comercial es obligatorio
-            if not c_nombre:
-                st.error(f"⚠️ Error: No encuentro la columna 'Nombre Comercial'. Columnas leídas: {list(df_prov.columns)}")
-                st.stop()
-
-            count_new = 0
-            count_skipped = 0
-            progress_bar = st.progress(0)
-            total_rows = len(df_prov)
-
-            for i, (index, row) in enumerate(df_prov.iterrows()):
-                # Obtener y limpiar datos
-                nombre_input = str(row[c_nombre]).strip()
-                
-                if not nombre_input or nombre_input.lower() == 'nan': 
-                    continue
-
-                # --- 3. PROTECCIÓN CONTRA DUPLICADOS ---
-                # Buscamos por Nombre Comercial (insensible a mayúsculas)
-                existing = db.query(Proveedor).filter(func.lower(Proveedor.name) == nombre_input.lower()).first()
-                # Opcional: Podrías buscar también por NIT si quisieras ser más estricto
-                # existing = db.query(Proveedor).filter(Proveedor.nit == str(row[c_nit]).strip()).first()
-                
-                if not existing:
-                    # Crear nuevo objeto con TODOS los campos
-                    new_p = Proveedor(
-                        name = nombre_input,  # Nombre Comercial
-                        
-                        # Asignamos los campos extra si existen en el Excel, si no, quedan vacíos
-                        legal_name = str(row[c_razon]).strip() if c_razon and pd.notna(row[c_razon]) else "",
-                        provider_type = str(row[c_tipo]).strip() if c_tipo and pd.notna(row[c_tipo]) else "Certificado", # Valor por defecto
-                        nit = str(row[c_nit]).strip() if c_nit and pd.notna(row[c_nit]) else "",
-                        cui = str(row[c_cui]).strip() if c_cui and pd.notna(row[c_cui]) else "",
-                        bank_name = str(row[c_banco]).strip() if c_banco and pd.notna(row[c_banco]) else "",
-                        account_number = str(row[c_cuenta]).strip() if c_cuenta and pd.notna(row[c_cuenta]) else ""
-                    )
-                    db.add(new_p)
-                    count_new += 1
-                else:
-                    count_skipped += 1
-                
-                progress_bar.progress((i + 1) / total_rows)
-            
-            db.commit()
-            st.success(f"✅ Procesado: {count_new} proveedores nuevos. {count_skipped} ya existían.")
-            st.balloons()
-            
-            import time
-            time.sleep(1.5)
-            st.rerun()
+        # Columnas detectadas con el buscador inteligente (ignora mayúsculas) y sin duplicar por Nombre Comercial
+        submit_job_or_warn(
+            db, "import_proveedores",
+            {"path": save_upload(uploaded_prov), "filename": uploaded_prov.name},
+            "job_proveedores"
+        )
 
-        except Exception as e:
-            db.rollback()
-            st.error(f"❌ Error técnico: {e}. (Verifica que tu base de datos tenga las columnas 'nit', 'cui', 'bank', etc.)")
+    if "job_proveedores" in st.session_state:
+        job_panel(st.session_state["job_proveedores"], key="proveedores")
         
     with st.expander("➕ Agregar Nuevo Proveedor", expanded=True):
         with st.form("new_prov_form"):
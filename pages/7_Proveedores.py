@@ -0,0 +1,96 @@
+import streamlit as st
+from sqlalchemy import func
+from database import page_db
+from models import Expense
+from auth import require_role
+from services import data_version
+from ui import admission_gate
+from analytics import (
+    PROVIDER_TOP_N, provider_spend, provider_ranking, provider_concentration,
+    provider_monthly, provider_breakdown
+)
+
+require_role(["ADMIN", "AUTORIZADO"])
+db = page_db(read=True)
+
+st.title("🏢 Análisis de Proveedores")
+
+# El resultado agrupado se cachea por (versión de gastos, rango): mientras nadie
+# registre / modifique gastos, cambiar de vista no vuelve a consultar la BD.
+@st.cache_data(ttl=6 * 3600, max_entries=32, show_spinner="Calculando gasto por proveedor...")
+def cached_provider_spend(_db, expenses_version, start_year, end_year):
+    return provider_spend(_db, start_year, end_year)
+
+min_year, max_year = db.query(func.min(Expense.year), func.max(Expense.year)).one()
+if min_year is None:
+    st.info("Aún no hay gastos registrados.")
+    st.stop()
+
+# --- FILTRO DE PERIODO ---
+if min_year < max_year:
+    start_year, end_year = st.select_slider(
+        "Periodo (años)", options=list(range(min_year, max_year + 1)), value=(min_year, max_year)
+    )
+else:
+    start_year = end_year = min_year
+    st.caption(f"Periodo: {min_year}")
+
+with admission_gate("dashboard"):
+    df = cached_provider_spend(db, data_version(db, "expenses"), start_year, end_year)
+
+if df.empty:
+    st.info("No hay gastos en el periodo seleccionado.")
+    st.stop()
+
+ranking = provider_ranking(df)
+conc = provider_concentration(ranking)
+
+# --- KPIs ---
+k1, k2, k3, k4 = st.columns(4)
+k1.metric("Gasto Total", f"Q{ranking['Monto Q'].sum():,.2f}")
+k2.metric("Proveedores", conc["proveedores"])
+k3.metric("Top 5 concentran", f"{conc['top5_pct']:.1f}%")
+k4.metric(
+    "Índice HHI", f"{conc['hhi']:,.0f}",
+    help=f"Concentración del gasto (0 - 10,000). Más de 2,500 = muy concentrado. "
+         f"{conc['para_80']} proveedores acumulan el 80% del gasto."
+)
+
+st.divider()
+
+# --- TOP PROVEEDORES ---
+st.subheader(f"🥇 Top {PROVIDER_TOP_N} Proveedores")
+top = ranking.head(PROVIDER_TOP_N)
+st.bar_chart(top.set_index("Proveedor")["Monto Q"], horizontal=True, y_label="Q")
+with st.expander("Ver ranking completo"):
+    st.dataframe(
+        ranking.style.format({'Monto Q': 'Q{:,.2f}', '% del Total': '{:.1f}%', '% Acumulado': '{:.1f}%'}),
+        use_container_width=True, hide_index=True
+    )
+
+st.divider()
+
+# --- TENDENCIA MENSUAL ---
+st.subheader("📈 Tendencia Mensual")
+sel_provs = st.multiselect(
+    "Proveedores", ranking["Proveedor"].tolist(), default=top["Proveedor"].head(5).tolist(), key="prov_trend"
+)
+if sel_provs:
+    st.line_chart(provider_monthly(df, sel_provs), y_label="Q")
+
+st.divider()
+
+# --- DESGLOSE POR CATEGORÍA Y OI ---
+st.subheader("🧾 Desglose")
+tab_cat, tab_oi = st.tabs(["Por Categoría", "Por OI"])
+with tab_cat:
+    by_cat = provider_breakdown(df, "Categoria", top["Proveedor"].tolist())
+    st.dataframe(by_cat.loc[top["Proveedor"]].style.format('Q{:,.2f}'), use_container_width=True)
+with tab_oi:
+    prov_oi = st.selectbox("Proveedor", ranking["Proveedor"].tolist(), key="prov_oi")
+    by_oi = provider_breakdown(df, "OI", [prov_oi]).T
+    by_oi.columns = ["Monto Q"]
+    st.dataframe(
+        by_oi.sort_values("Monto Q", ascending=False).style.format('Q{:,.2f}'),
+        use_container_width=True
+    )
@@ -0,0 +1,97 @@
+"""Perfil de arranque: tiempo de imports y de primer render por página.
+
+Cada página se mide en un proceso nuevo (imports en frío, sin cachés de
+Streamlit) con una sesión de ADMIN ya autenticada.
+
+Uso:
+    python profile_startup.py                        # app.py + todas las páginas
+    python profile_startup.py pages/1_Cotizador.py   # solo las indicadas
+"""
+import ast
+import glob
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+ADMIN_SESSION = {"authenticated": True, "user_id": 1, "username": "admin", "role": "ADMIN"}
+
+def default_pages():
+    return ["app.py"] + sorted(glob.glob("pages/*.py"))
+
+def _time_imports(page_path):
+    # Ejecuta SOLO las sentencias import de nivel superior de la página
+    tree = ast.parse(open(page_path, encoding="utf-8").read(), filename=page_path)
+    timings = []
+    namespace = {}
+    for node in tree.body:
+        if not isinstance(node, (ast.Import, ast.ImportFrom)):
+            continue
+        code = compile(ast.Module(body=[node], type_ignores=[]), page_path, "exec")
+        t0 = time.perf_counter()
+        exec(code, namespace)
+        timings.append((ast.unparse(node), (time.perf_counter() - t0) * 1000))
+    return timings
+
+def _child(page_path):
+    # 1. Imports en frío
+    import_timings = _time_imports(page_path)
+
+    # 2. Esquema y semillas (lo que hace bootstrap() una vez por proceso)
+    from bootstrap import prepare_database
+    t0 = time.perf_counter()
+    prepare_database()
+    bootstrap_ms = (time.perf_counter() - t0) * 1000
+
+    # 3. Primer render completo del script
+    from streamlit.testing.v1 import AppTest
+    at = AppTest.from_file(os.path.join(ROOT, page_path), default_timeout=120)
+    for key, value in ADMIN_SESSION.items():
+        at.session_state[key] = value
+    t0 = time.perf_counter()
+    at.run()
+    render_ms = (time.perf_counter() - t0) * 1000
+
+    print(json.dumps({
+        "page": page_path,
+        "import_ms": sum(ms for _, ms in import_timings),
+        "slowest_imports": sorted(import_timings, key=lambda x: -x[1])[:3],
+        "bootstrap_ms": bootstrap_ms,
+        "render_ms": render_ms,
+        "errors": [e.value for e in at.exception],
+    }))
+
+def main(argv):
+    pages = argv or default_pages()
+    results = []
+    for page in pages:
+        proc = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child", page],
+            cwd=ROOT, capture_output=True, text=True,
+        )
+        lines = [l for l in proc.stdout.splitlines() if l.startswith("{")]
+        if proc.returncode != 0 or not lines:
+            print(f"❌ {page}: falló el perfilado\n{proc.stderr.strip()}", file=sys.stderr)
+            continue
+        results.append(json.loads(lines[-1]))
+
+    print(f"{'Página':<40} {'Imports (ms)':>13} {'Primer render (ms)':>19}")
+    print("-" * 74)
+    for r in results:
+        flag = " ⚠️" if r["errors"] else ""
+        print(f"{r['page']:<40} {r['import_ms']:>13.0f} {r['render_ms']:>19.0f}{flag}")
+        for stmt, ms in r["slowest_imports"]:
+            print(f"    {ms:>8.0f} ms  {stmt}")
+        for err in r["errors"]:
+            print(f"    error: {err}")
+    return 0 if len(results) == len(pages) else 1
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "--child":
+        os.chdir(ROOT)
+        sys.path.insert(0, ROOT)
+        _child(sys.argv[2])
+    else:
+        sys.exit(main(sys.argv[1:]))
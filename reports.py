@@ -0,0 +1,156 @@
+import io
+import pandas as pd
+from sqlalchemy import func
+from sqlalchemy.orm import Session, joinedload
+from models import Expense, HostServiceLine, Proveedor, Quote, QuoteLine, Insumo
+from money import to_cents, from_cents, allocate_cents
+
+# ==============================================================================
+# REPORTES EXPORTABLES (CSV / XLSX)
+# ==============================================================================
+
+EXPORT_FORMATS = {
+    "CSV": ("csv", "text/csv"),
+    "XLSX": ("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+}
+
+def _expenses(db: Session, category, start_d, end_d):
+    return (
+        db.query(Expense)
+        .options(joinedload(Expense.oi), joinedload(Expense.company), joinedload(Expense.quote))
+        .filter(Expense.category == category, Expense.date >= start_d, Expense.date <= end_d)
+        .order_by(Expense.date, Expense.id)
+        .all()
+    )
+
+def odc_report(db: Session, start_d, end_d):
+    data = _expenses(db, "ODC", start_d, end_d)
+    return pd.DataFrame([{
+        "Fecha": e.date, "ODC": e.odc_number, "OI": e.oi.oi_code,
+        "Proveedor": e.company.name if e.company else "",
+        "Monto Q": e.amount_gtq, "Descripcion": e.description,
+        "Actividad": e.quote.activity_name
+    } for e in data])
+
+def caja_chica_report(db: Session, start_d, end_d):
+    data = _expenses(db, "CAJA_CHICA", start_d, end_d)
+    return pd.DataFrame([{
+        "Operación Contable": "COSTO O GASTO GRAVADO",
+        "Monto": e.amount_gtq,
+        "ST.doc": "",
+        "Ind.Impuesto": "V1",
+        "Libro Mayor": "7006080000",
+        "NIT": e.company.nit if e.company else "",
+        "RAZÓN SOCIAL": e.company.legal_name if e.company else "",
+        "Fecha Documento": e.date,
+        "# FACT": e.doc_number,
+        "Orden Interna": e.oi.oi_code,
+        "Texto": "B",
+        "Texto Adicional 2": e.text_additional,
+        "Pagar A": e.pay_to,
+        "Actividad": e.quote.activity_name
+    } for e in data])
+
+# --- PAGOS A TALENTOS (HOST) ---
+# Una sola consulta agregada sobre host_service_lines (sin leer JSON en Python)
+HOST_PAYOUT_GROUPS = {
+    "Talento": lambda: [Proveedor.name.label("Talento")],
+    "Mes": lambda: [Expense.year.label("Año"), Expense.month.label("Mes")],
+    "Actividad": lambda: [Quote.activity_name.label("Actividad")],
+    "Talento y Mes": lambda: [Proveedor.name.label("Talento"), Expense.year.label("Año"), Expense.month.label("Mes")],
+}
+
+def host_payouts(db: Session, start_d, end_d, group_by="Talento"):
+    keys = HOST_PAYOUT_GROUPS[group_by]()
+    rows = (
+        db.query(
+            *keys,
+            func.count(func.distinct(Expense.id)).label("Recibos"),
+            func.sum(HostServiceLine.days).label("Días"),
+            func.sum(HostServiceLine.total).label("Total Q"),
+        )
+        .select_from(HostServiceLine)
+        .join(Expense, HostServiceLine.expense_id == Expense.id)
+        .outerjoin(Proveedor, Expense.company_id == Proveedor.id)
+        .outerjoin(Quote, Expense.quote_id == Quote.id)
+        .filter(Expense.category == "HOST", Expense.date >= start_d, Expense.date <= end_d)
+        .group_by(*keys)
+        .order_by(func.sum(HostServiceLine.total).desc())
+        .all()
+    )
+    return pd.DataFrame(rows, columns=[k.name for k in keys] + ["Recibos", "Días", "Total Q"])
+
+# --- PROPUESTA PARA CLIENTE (PDF) ---
+# Precio de venta que se muestra: final (si ya se aprobó) o uno de los sugeridos
+PROPOSAL_PRICES = {
+    "Precio final": "final_sale_price_usd",
+    "Sugerido (70% Margen)": "suggested_price_usd_m70",
+    "Sugerido (60% Margen)": "suggested_price_usd_m60",
+    "Sugerido (50% Margen)": "suggested_price_usd_m50",
+}
+
+def proposal_content(db: Session, quote_ids, price_label="Precio final"):
+    # Datos planos de cada propuesta: {quote_id: dict}. Dos consultas para todo el lote.
+    # El precio de venta se reparte entre las líneas según su costo (en centavos,
+    # la suma cuadra exacto) y se agrupa por categoría del insumo. Nada de costos
+    # internos sale en el documento.
+    price_col = PROPOSAL_PRICES[price_label]
+    quotes = (
+        db.query(Quote)
+        .options(joinedload(Quote.mall), joinedload(Quote.activity_type))
+        .filter(Quote.id.in_(list(quote_ids)))
+        .all()
+    )
+    lines = (
+        db.query(QuoteLine.quote_id, QuoteLine.qty_personas, QuoteLine.units_value, QuoteLine.line_cost_usd,
+                 Insumo.name, Insumo.category, Insumo.unit_type, Insumo.description)
+        .outerjoin(Insumo, QuoteLine.insumo_id == Insumo.id)
+        .filter(QuoteLine.quote_id.in_([q.id for q in quotes]))
+        .order_by(QuoteLine.quote_id, QuoteLine.id)
+        .all()
+    )
+    by_quote = {}
+    for l in lines:
+        by_quote.setdefault(l.quote_id, []).append(l)
+
+    contents = {}
+    for q in quotes:
+        q_lines = by_quote.get(q.id, [])
+        price = getattr(q, price_col)
+        price_source = "Precio final" if price_col == "final_sale_price_usd" else "Precio sugerido"
+        if price is None: # Sin precio final todavía: se usa el sugerido de 70% y así se indica en el documento
+            price = q.suggested_price_usd_m70 or 0.0
+            price_source = "Precio sugerido"
+        amounts = allocate_cents(to_cents(price), [l.line_cost_usd or 0.0 for l in q_lines])
+        groups = {}
+        for l, cents in zip(q_lines, amounts):
+            groups.setdefault(l.category or "General", []).append({
+                "name": l.name or "Elemento",
+                "description": l.description or "",
+                "qty": float(l.qty_personas or 0),
+                "units": float(l.units_value or 0),
+                "unit_type": l.unit_type or "",
+                "amount": from_cents(int(cents)),
+            })
+        contents[q.id] = {
+            "id": q.id,
+            "activity_name": q.activity_name,
+            "mall": q.mall.name if q.mall else "",
+            "activity_type": q.activity_type.name if q.activity_type else "",
+            "date": q.created_at.date().isoformat() if q.created_at else "",
+            "total": float(price),
+            "price_source": price_source,
+            "groups": [
+                {"category": cat, "subtotal": from_cents(sum(to_cents(i["amount"]) for i in items)), "lines": items}
+                for cat, items in sorted(groups.items())
+            ],
+        }
+    return contents
+
+def dataframe_to_bytes(df, fmt="CSV"):
+    if fmt == "XLSX":
+        # openpyxl lo carga pandas solo aquí
+        buffer = io.BytesIO()
+        df.to_excel(buffer, index=False)
+        return buffer.getvalue()
+    return df.to_csv(index=False).encode('utf-8')
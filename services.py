@@ -1,7 +1,38 @@
 import os
-from sqlalchemy.orm import Session
-from models import ExchangeRate, Quote, QuoteLine, User, ExpenseType
+import datetime
+import numpy as np
+from sqlalchemy import update, insert, select, literal, true, func, event, inspect, case, type_coerce, cast, tuple_, bindparam, Integer, String, DateTime
+from sqlalchemy.orm import Session, aliased
+from sqlalchemy.dialects import sqlite, postgresql
+from database import IS_SQLITE
+from models import ExchangeRate, Quote, QuoteLine, User, ExpenseType, Insumo, Mall, Expense, DataVersion, InsumoUsage, OI
 from auth import hash_password
+from money import to_cents, from_cents, round_money, group_sum_cents
+
+# Máquina de estados de una cotización (estado actual -> estados permitidos).
+# PLANTILLA queda fuera: las plantillas no avanzan en el flujo.
+QUOTE_TRANSITIONS = {
+    "BORRADOR": {"ENVIADA"},
+    "ENVIADA": {"APROBADA", "BORRADOR"},     # aprobar o rechazar (vuelve a borrador)
+    "APROBADA": {"EJECUTADA", "LIQUIDADA"},
+    "EJECUTADA": {"LIQUIDADA"},
+    "LIQUIDADA": {"APROBADA"},               # reactivación de emergencia
+}
+
+class QuoteConflictError(Exception):
+    # Otro usuario cambió la cotización entre que se mostró y se confirmó la acción.
+    # Es reintentable: basta recargar los datos y volver a confirmar.
+    retryable = True
+
+class InvalidTransitionError(ValueError):
+    pass
+
+# Márgenes con los que se calculan los precios sugeridos (columna -> margen)
+SUGGESTED_MARGINS = {
+    "suggested_price_usd_m70": 0.70,
+    "suggested_price_usd_m60": 0.60,
+    "suggested_price_usd_m50": 0.50,
+}
 
 def init_db_seeds(db: Session):
     # Crea admin inicial si no existe
@@ -17,26 +48,556 @@ def init_db_seeds(db: Session):
         db.add(ExchangeRate(gtq_per_usd=7.8, is_active=True))
         db.commit()
 
+def ensure_admin_user(db: Session):
+    # Garantiza que siempre exista el usuario "admin" (p.ej. tras un reset)
+    admin_user = db.query(User).filter(User.username == "admin").first()
+    if not admin_user:
+        db.add(User(username="admin", password_hash=hash_password("admin123"), role="ADMIN"))
+        db.commit()
+        print("✅ Usuario Admin creado automáticamente.")
+
 def get_active_rate(db: Session):
     rate = db.query(ExchangeRate).filter(ExchangeRate.is_active == True).first()
     return rate.gtq_per_usd if rate else 7.8
 
+# ==============================================================================
+# MOTOR DE PRECIOS (ÚNICO PARA TODAS LAS PÁGINAS)
+# ==============================================================================
+
+def price_lines(cost_gtq, billing_mode, qty, units, rate):
+    # Costo por línea en una sola pasada vectorizada.
+    # MULTIPLICABLE: costo * personas * unidades. Cualquier otro modo (FIJO,
+    # POR_ACTIVIDAD): costo * personas (las unidades no cuentan).
+    # Cada línea queda redondeada al centavo: los totales se suman en enteros.
+    cost_gtq = np.asarray(cost_gtq, dtype=float)
+    qty = np.asarray(qty, dtype=float)
+    units = np.asarray(units, dtype=float)
+    multiplicable = np.asarray(billing_mode, dtype=object) == "MULTIPLICABLE"
+
+    line_gtq = round_money(cost_gtq * qty * np.where(multiplicable, units, 1.0))
+    line_usd = round_money(line_gtq / rate)
+    return line_gtq, line_usd
+
+def suggested_prices(total_usd):
+    # Precio sugerido por margen: costo / (1 - margen). Acepta escalares o arrays.
+    total_usd = np.asarray(total_usd, dtype=float)
+    return {col: round_money(total_usd / (1 - margin)) for col, margin in SUGGESTED_MARGINS.items()}
+
+def quote_totals(quote_ids, line_gtq, line_usd):
+    # Agrupa líneas por cotización: devuelve ids únicos y sus totales GTQ/USD
+    # (suma exacta en centavos enteros)
+    uniq, total_gtq = group_sum_cents(quote_ids, to_cents(line_gtq))
+    _, total_usd = group_sum_cents(quote_ids, to_cents(line_usd))
+    return uniq, from_cents(total_gtq), from_cents(total_usd)
+
+def _quote_total_rows(quote_ids, total_gtq, total_usd):
+    sugg = suggested_prices(total_usd)
+    rows = []
+    for i, q_id in enumerate(quote_ids):
+        row = {"id": int(q_id), "total_cost_gtq": float(total_gtq[i]), "total_cost_usd": float(total_usd[i])}
+        for col, values in sugg.items():
+            row[col] = float(values[i])
+        rows.append(row)
+    return rows
+
+def add_quote_line(db: Session, quote_id: int, insumo: Insumo, qty, units, rate=None):
+    # Agrega una línea con el motor de precios y recalcula los totales
+    rate = rate or get_active_rate(db)
+    line_gtq, line_usd = price_lines([insumo.cost_gtq], [insumo.billing_mode], [qty], [units], rate)
+    db.add(QuoteLine(
+        quote_id=quote_id,
+        insumo_id=insumo.id,
+        qty_personas=qty,
+        units_value=units,
+        line_cost_gtq=float(line_gtq[0]),
+        line_cost_usd=float(line_usd[0])
+    ))
+    db.commit()
+    return calculate_quote_totals(db, quote_id)
+
+def update_quote_lines(db: Session, changes, rate=None):
+    # changes: lista de {"id", "qty_personas", "units_value"}. Una consulta para
+    # leer costos/modos y un UPDATE masivo, en vez de objeto por objeto.
+    # Se actualiza en sitio (sin borrar / reinsertar): el uso de insumos no cambia.
+    if not changes:
+        return 0
+    rate = rate or get_active_rate(db)
+    by_id = {int(c["id"]): c for c in changes}
+    rows = (
+        db.query(QuoteLine.id, Insumo.cost_gtq, Insumo.billing_mode)
+        .join(Insumo, QuoteLine.insumo_id == Insumo.id)
+        .filter(QuoteLine.id.in_(list(by_id)))
+        .all()
+    )
+    if not rows:
+        return 0
+    ids = [r.id for r in rows]
+    qty = [by_id[i]["qty_personas"] for i in ids]
+    units = [by_id[i]["units_value"] for i in ids]
+    line_gtq, line_usd = price_lines([r.cost_gtq or 0.0 for r in rows], [r.billing_mode for r in rows], qty, units, rate)
+
+    db.execute(update(QuoteLine), [
+        {"id": ids[i], "qty_personas": float(qty[i]), "units_value": float(units[i]),
+         "line_cost_gtq": float(line_gtq[i]), "line_cost_usd": float(line_usd[i])}
+        for i in range(len(ids))
+    ])
+    return len(ids)
+
 def calculate_quote_totals(db: Session, quote_id: int):
     quote = db.query(Quote).get(quote_id)
-    rate = get_active_rate(db)
-    total_gtq = 0
-    total_usd = 0
-    for line in quote.lines:
-        total_gtq += line.line_cost_gtq
-        total_usd += line.line_cost_usd
-    
+    # SUM sobre centavos enteros: exacto
+    total_gtq, total_usd = db.query(
+        func.coalesce(func.sum(QuoteLine.line_cost_gtq), 0), func.coalesce(func.sum(QuoteLine.line_cost_usd), 0)
+    ).filter(QuoteLine.quote_id == quote_id).one()
+
     quote.total_cost_gtq = total_gtq
     quote.total_cost_usd = total_usd
     # Margenes sugeridos
-    quote.suggested_price_usd_m70 = total_usd / (1 - 0.70) if total_usd else 0
-    quote.suggested_price_usd_m60 = total_usd / (1 - 0.60) if total_usd else 0
-    quote.suggested_price_usd_m50 = total_usd / (1 - 0.50) if total_usd else 0
-    
+    for col, value in suggested_prices(total_usd).items():
+        setattr(quote, col, float(value))
+
     db.commit()
     db.refresh(quote)
-    return quote
\ No newline at end of file
+    return quote
+
+# Lo aprobado / en ejecución ya tiene precio acordado: no se recalcula salvo que se pida
+REPRICE_STATUSES = ("BORRADOR", "ENVIADA")
+
+def reprice_quotes(db: Session, quote_ids=None, statuses=REPRICE_STATUSES, rate=None):
+    # Entrada por lotes: recalcula TODAS las líneas (con el costo vigente del insumo
+    # y la tasa activa) y los totales de muchas cotizaciones en una sola pasada.
+    # statuses=None recalcula cualquier estado.
+    rate = rate or get_active_rate(db)
+
+    q_quotes = db.query(Quote.id)
+    if quote_ids is not None:
+        q_quotes = q_quotes.filter(Quote.id.in_(list(quote_ids)))
+    if statuses:
+        q_quotes = q_quotes.filter(Quote.status.in_(list(statuses)))
+    target_ids = [r.id for r in q_quotes.all()]
+    if not target_ids:
+        return 0
+
+    # outerjoin: una línea cuyo insumo ya no existe conserva su costo guardado (no se pierde del total)
+    lines = (
+        db.query(QuoteLine.id, QuoteLine.quote_id, QuoteLine.qty_personas, QuoteLine.units_value,
+                 QuoteLine.line_cost_gtq, QuoteLine.line_cost_usd,
+                 Insumo.id.label("insumo_found"), Insumo.cost_gtq, Insumo.billing_mode)
+        .outerjoin(Insumo, QuoteLine.insumo_id == Insumo.id)
+        .filter(QuoteLine.quote_id.in_(target_ids))
+        .all()
+    )
+
+    totals = {}
+    if lines:
+        line_gtq, line_usd = price_lines(
+            [l.cost_gtq or 0.0 for l in lines], [l.billing_mode for l in lines],
+            [l.qty_personas or 0.0 for l in lines], [l.units_value or 0.0 for l in lines], rate
+        )
+        orphan = np.array([l.insumo_found is None for l in lines])
+        line_gtq = np.where(orphan, [l.line_cost_gtq or 0.0 for l in lines], line_gtq)
+        line_usd = np.where(orphan, [l.line_cost_usd or 0.0 for l in lines], line_usd)
+        repriced = [
+            {"id": l.id, "line_cost_gtq": float(line_gtq[i]), "line_cost_usd": float(line_usd[i])}
+            for i, l in enumerate(lines) if not orphan[i]
+        ]
+        if repriced:
+            db.execute(update(QuoteLine), repriced)
+        uniq, total_gtq, total_usd = quote_totals([l.quote_id for l in lines], line_gtq, line_usd)
+        totals = {row["id"]: row for row in _quote_total_rows(uniq, total_gtq, total_usd)}
+
+    # Las cotizaciones sin líneas quedan en cero
+    empty = [q_id for q_id in target_ids if q_id not in totals]
+    if empty:
+        totals.update({row["id"]: row for row in _quote_total_rows(empty, np.zeros(len(empty)), np.zeros(len(empty)))})
+
+    db.execute(update(Quote), list(totals.values()))
+    db.commit()
+    return len(target_ids)
+
+# ==============================================================================
+# CLONADO DE COTIZACIONES (PLANTILLAS Y ABANICO POR MALL)
+# ==============================================================================
+# Todo se copia del lado del servidor con INSERT ... SELECT en una sola
+# transacción: el costo para la UI no depende del tamaño de la plantilla.
+
+_QUOTE_COPIED_COLS = [
+    "activity_type_id", "notes", "total_cost_gtq", "total_cost_usd",
+    "suggested_price_usd_m70", "suggested_price_usd_m60", "suggested_price_usd_m50",
+]
+_LINE_COPIED_COLS = ["insumo_id", "qty_personas", "units_value", "line_cost_gtq", "line_cost_usd"]
+
+def _clone_quotes(db: Session, source_id: int, created_by: int, status: str, name_expr, mall_expr, mall_filter=None):
+    # 1. Cabeceras: una por fila del SELECT (1 para clon simple, N para abanico)
+    header_sel = select(
+        literal(created_by, Integer),
+        name_expr,
+        mall_expr,
+        literal(status, String),
+        literal(datetime.datetime.utcnow(), DateTime),
+        *[getattr(Quote, c) for c in _QUOTE_COPIED_COLS]
+    ).where(Quote.id == source_id)
+    if mall_filter is not None:
+        header_sel = header_sel.join(Mall, true()).where(mall_filter)
+
+    new_ids = db.execute(
+        insert(Quote)
+        .from_select(["created_by", "activity_name", "mall_id", "status", "created_at"] + _QUOTE_COPIED_COLS, header_sel)
+        .returning(Quote.id)
+    ).scalars().all()
+    if not new_ids:
+        db.rollback()
+        return []
+
+    # 2. Líneas: producto cartesiano (nuevas cabeceras x líneas de la fuente)
+    new_quote = aliased(Quote)
+    lines_sel = (
+        select(new_quote.id, *[getattr(QuoteLine, c) for c in _LINE_COPIED_COLS])
+        .select_from(QuoteLine)
+        .join(new_quote, new_quote.id.in_(new_ids))
+        .where(QuoteLine.quote_id == source_id)
+    )
+    db.execute(insert(QuoteLine).from_select(["quote_id"] + _LINE_COPIED_COLS, lines_sel))
+
+    # El INSERT ... SELECT no dispara eventos del ORM: el uso de insumos se suma aquí
+    # (guardar como plantilla no cuenta como uso)
+    if status not in USAGE_EXCLUDED_STATUSES:
+        source = db.query(Quote.activity_type_id).filter(Quote.id == source_id).scalar()
+        per_insumo = (
+            db.query(QuoteLine.insumo_id, func.count(QuoteLine.id))
+            .filter(QuoteLine.quote_id == source_id, QuoteLine.insumo_id.isnot(None))
+            .group_by(QuoteLine.insumo_id)
+            .all()
+        )
+        record_insumo_usage(db.connection(), [(i, source, n * len(new_ids)) for i, n in per_insumo])
+    db.commit()
+    return new_ids
+
+def clone_quote(db: Session, source_id: int, created_by: int, activity_name: str, status: str = "BORRADOR"):
+    # Copia cabecera + líneas. Sirve para "usar plantilla" y "guardar como plantilla".
+    new_ids = _clone_quotes(db, source_id, created_by, status, literal(activity_name, String), Quote.mall_id)
+    return new_ids[0] if new_ids else None
+
+def fan_out_quote(db: Session, source_id: int, created_by: int, name_prefix: str, mall_ids=None, status: str = "BORRADOR"):
+    # Crea una cotización por Mall (por defecto, todos los activos) en una sola operación
+    mall_filter = Mall.id.in_(list(mall_ids)) if mall_ids is not None else Mall.is_active == True
+    name_expr = literal(f"{name_prefix} - ", String) + Mall.name
+    return _clone_quotes(db, source_id, created_by, status, name_expr, Mall.id, mall_filter=mall_filter)
+
+# ==============================================================================
+# TRANSICIONES DE ESTADO (COMPARE-AND-SWAP)
+# ==============================================================================
+
+def transition_quote(db: Session, quote_id: int, new_status: str, expected_version=None, **fields):
+    # Cambia el estado solo si (estado, versión) siguen siendo los que vio el usuario.
+    # No se retienen bloqueos entre reruns: el UPDATE condicional hace todo el trabajo.
+    current = db.query(Quote.status, Quote.version).filter(Quote.id == quote_id).first()
+    if not current:
+        raise InvalidTransitionError(f"La cotización #{quote_id} no existe.")
+    if expected_version is not None and current.version != expected_version:
+        raise QuoteConflictError(f"La cotización #{quote_id} fue modificada por otro usuario.")
+    if new_status not in QUOTE_TRANSITIONS.get(current.status, set()):
+        raise InvalidTransitionError(f"No se puede pasar de {current.status} a {new_status}.")
+
+    result = db.execute(
+        update(Quote)
+        .where(Quote.id == quote_id, Quote.status == current.status, Quote.version == current.version)
+        .values(status=new_status, version=Quote.version + 1, **fields)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != 1:
+        db.rollback()
+        raise QuoteConflictError(f"La cotización #{quote_id} fue modificada por otro usuario.")
+    db.commit()
+    return current.version + 1
+
+def _price_at_margin(margin):
+    # Precio = costo / (1 - margen), calculado en centavos dentro del UPDATE
+    return cast(func.round(type_coerce(Quote.total_cost_usd, Integer) / (1 - margin)), Integer)
+
+def bulk_transition_quotes(db: Session, seen_versions, new_status, margin=None, per_quote=None):
+    # Versión masiva de transition_quote: seen_versions es {quote_id: versión vista}.
+    # Cada cotización se valida por separado (existe, nadie la cambió, transición
+    # permitida) y las válidas se mueven con UN solo UPDATE condicional.
+    # Con margin (aprobación) el precio final se calcula en la BD a partir del costo.
+    # per_quote: {quote_id: {columna: valor}} distinto por cotización (p.ej. oi_id al
+    # ejecutar); va en el mismo UPDATE como CASE sobre el id.
+    # Devuelve (ids aplicados, {id: motivo} de las omitidas).
+    skipped = {}
+    ids = list(seen_versions)
+    current = {
+        r.id: r for r in db.query(Quote.id, Quote.status, Quote.version, Quote.total_cost_usd).filter(Quote.id.in_(ids))
+    }
+    valid = []
+    for q_id in ids:
+        row, seen = current.get(q_id), seen_versions[q_id]
+        if row is None:
+            skipped[q_id] = "La cotización no existe."
+        elif seen is not None and row.version != seen:
+            skipped[q_id] = "Fue modificada por otro usuario."
+        elif new_status not in QUOTE_TRANSITIONS.get(row.status, set()):
+            skipped[q_id] = f"No se puede pasar de {row.status} a {new_status}."
+        elif margin is not None and not (row.total_cost_usd or 0) > 0:
+            skipped[q_id] = "No tiene costo: no se puede calcular el precio."
+        else:
+            valid.append(row)
+    if not valid:
+        return [], skipped
+
+    fields = {}
+    if margin is not None:
+        fields["final_sale_price_usd"] = _price_at_margin(margin)
+        fields["suggested_price_usd_m70"] = _price_at_margin(SUGGESTED_MARGINS["suggested_price_usd_m70"])
+    for col in {c for values in (per_quote or {}).values() for c in values}:
+        by_id = {r.id: per_quote[r.id][col] for r in valid if col in per_quote.get(r.id, {})}
+        if by_id:
+            fields[col] = case(by_id, value=Quote.id, else_=getattr(Quote, col))
+    result = db.execute(
+        update(Quote)
+        .where(tuple_(Quote.id, Quote.status, Quote.version).in_([(r.id, r.status, r.version) for r in valid]))
+        .values(status=new_status, version=Quote.version + 1, **fields)
+        .returning(Quote.id)
+        .execution_options(synchronize_session=False)
+    )
+    applied = sorted(r[0] for r in result)
+    db.commit()
+    done = set(applied)
+    for r in valid:
+        if r.id not in done:
+            skipped[r.id] = "Fue modificada por otro usuario."
+    return applied, skipped
+
+# ==============================================================================
+# USO DE INSUMOS (ORDEN DEL SELECTOR DEL COTIZADOR)
+# ==============================================================================
+# Contadores por (insumo, tipo de actividad) + total (tipo 0), sumados al
+# momento de agregar líneas (upsert atómico en la misma transacción) y
+# restados al borrarlas. Las plantillas no cuentan. El Cotizador solo lee la
+# tabla ya calculada: ordenar no cuesta nada extra.
+
+USAGE_EXCLUDED_STATUSES = ("PLANTILLA",)
+
+def record_insumo_usage(connection, rows):
+    # rows: [(insumo_id, activity_type_id, usos)]; usos negativos = líneas borradas
+    counts = {}
+    for insumo_id, type_id, n in rows:
+        for key in {(insumo_id, type_id or 0), (insumo_id, 0)}:
+            counts[key] = counts.get(key, 0) + n
+    usage = InsumoUsage.__table__
+    added = {k: n for k, n in counts.items() if n > 0}
+    if added:
+        now = datetime.datetime.utcnow()
+        stmt = (sqlite.insert if IS_SQLITE else postgresql.insert)(usage).values([
+            {"insumo_id": i, "activity_type_id": t, "uses": n, "last_used_at": now} for (i, t), n in added.items()
+        ])
+        connection.execute(stmt.on_conflict_do_update(
+            index_elements=[usage.c.insumo_id, usage.c.activity_type_id],
+            set_={"uses": usage.c.uses + stmt.excluded.uses, "last_used_at": stmt.excluded.last_used_at}
+        ))
+    removed = [{"k_insumo": i, "k_type": t, "n": -n} for (i, t), n in counts.items() if n < 0]
+    if removed:
+        remaining = usage.c.uses - bindparam("n")
+        connection.execute(
+            update(usage)
+            .where(usage.c.insumo_id == bindparam("k_insumo"), usage.c.activity_type_id == bindparam("k_type"))
+            .values(uses=case((remaining < 0, 0), else_=remaining)),
+            removed
+        )
+
+def delete_quote_lines(db: Session, line_ids):
+    # Borra líneas (DELETE masivo, sin eventos del ORM) y descuenta su uso en la
+    # misma transacción: quitar y volver a agregar un insumo no lo infla.
+    line_ids = list(line_ids)
+    if not line_ids:
+        return 0
+    rows = (
+        db.query(QuoteLine.insumo_id, Quote.activity_type_id, func.count(QuoteLine.id))
+        .join(Quote, Quote.id == QuoteLine.quote_id)
+        .filter(QuoteLine.id.in_(line_ids), QuoteLine.insumo_id.isnot(None), Quote.status.notin_(USAGE_EXCLUDED_STATUSES))
+        .group_by(QuoteLine.insumo_id, Quote.activity_type_id)
+        .all()
+    )
+    deleted = db.query(QuoteLine).filter(QuoteLine.id.in_(line_ids)).delete(synchronize_session=False)
+    record_insumo_usage(db.connection(), [(i, t, -n) for i, t, n in rows])
+    return deleted
+
+@event.listens_for(QuoteLine, "after_insert")
+def _quote_line_inserted(mapper, connection, target):
+    if target.insumo_id is None:
+        return
+    quotes = Quote.__table__
+    quote = connection.execute(
+        select(quotes.c.activity_type_id, quotes.c.status).where(quotes.c.id == target.quote_id)
+    ).first()
+    if quote is None or quote.status in USAGE_EXCLUDED_STATUSES:
+        return
+    record_insumo_usage(connection, [(target.insumo_id, quote.activity_type_id, 1)])
+
+def ranked_insumos(db: Session, activity_type_id=None):
+    # Insumos activos ordenados por: uso en este tipo de actividad, uso total,
+    # uso más reciente y nombre. Devuelve [(insumo, usos_tipo, usos_total)].
+    by_type = aliased(InsumoUsage)
+    overall = aliased(InsumoUsage)
+    type_uses = func.coalesce(by_type.uses, 0)
+    all_uses = func.coalesce(overall.uses, 0)
+    return (
+        db.query(Insumo, type_uses, all_uses)
+        .outerjoin(by_type, (by_type.insumo_id == Insumo.id) & (by_type.activity_type_id == (activity_type_id or -1)))
+        .outerjoin(overall, (overall.insumo_id == Insumo.id) & (overall.activity_type_id == 0))
+        .filter(Insumo.is_active == True)
+        .order_by(type_uses.desc(), all_uses.desc(), overall.last_used_at.is_(None), overall.last_used_at.desc(), Insumo.name)
+        .all()
+    )
+
+# ==============================================================================
+# GASTO ACUMULADO POR COTIZACIÓN (spent_gtq / spent_usd / expense_count)
+# ==============================================================================
+# Cada INSERT / UPDATE / DELETE de un gasto ajusta su cotización con un UPDATE
+# incremental en la MISMA conexión y transacción del flush: si el gasto no se
+# guarda, el acumulado tampoco. Las vistas de actividades ya no suman gastos.
+
+def _apply_spend(connection, quote_id, gtq, usd, count):
+    if quote_id is None:
+        return
+    quotes = Quote.__table__
+    connection.execute(
+        update(quotes).where(quotes.c.id == quote_id).values(
+            spent_gtq=quotes.c.spent_gtq + (gtq or 0.0),
+            spent_usd=quotes.c.spent_usd + (usd or 0.0),
+            expense_count=quotes.c.expense_count + count,
+        )
+    )
+
+@event.listens_for(Expense, "after_insert")
+def _expense_inserted(mapper, connection, target):
+    _apply_spend(connection, target.quote_id, target.amount_gtq, target.amount_usd, 1)
+
+@event.listens_for(Expense, "after_delete")
+def _expense_deleted(mapper, connection, target):
+    _apply_spend(connection, target.quote_id, -(target.amount_gtq or 0.0), -(target.amount_usd or 0.0), -1)
+
+@event.listens_for(Expense, "before_update")
+def _expense_updating(mapper, connection, target):
+    state = inspect(target)
+    if not any(state.attrs[a].history.has_changes() for a in ("quote_id", "amount_gtq", "amount_usd")):
+        return
+    # Los valores anteriores se leen de la fila (el objeto pudo estar expirado):
+    # se revierte lo anterior y se aplica lo nuevo (cubre el cambio de cotización)
+    expenses = Expense.__table__
+    old = connection.execute(
+        select(expenses.c.quote_id, expenses.c.amount_gtq, expenses.c.amount_usd).where(expenses.c.id == target.id)
+    ).first()
+    if old is not None:
+        _apply_spend(connection, old.quote_id, -(old.amount_gtq or 0.0), -(old.amount_usd or 0.0), -1)
+    _apply_spend(connection, target.quote_id, target.amount_gtq, target.amount_usd, 1)
+
+# ==============================================================================
+# VERSIÓN DE DATOS (CACHÉS DE REPORTES)
+# ==============================================================================
+# Los reportes cacheados usan la versión como parte de su llave: cualquier
+# escritura de gastos la incrementa (en la misma transacción) y el siguiente
+# render recalcula. Funciona igual con varias réplicas del servidor.
+
+def bump_data_version(connection, name):
+    versions = DataVersion.__table__
+    result = connection.execute(
+        update(versions).where(versions.c.name == name).values(version=versions.c.version + 1)
+    )
+    if result.rowcount == 0:
+        connection.execute(insert(versions).values(name=name, version=1))
+
+def data_version(db: Session, name):
+    return db.query(DataVersion.version).filter(DataVersion.name == name).scalar() or 0
+
+@event.listens_for(Expense, "after_insert")
+@event.listens_for(Expense, "after_update")
+@event.listens_for(Expense, "after_delete")
+def _expenses_changed(mapper, connection, target):
+    bump_data_version(connection, "expenses")
+
+def reconcile_quote_spend(db: Session, fix=True):
+    # Compara el acumulado de cada cotización contra la suma real de sus gastos
+    # (una consulta agrupada) y corrige las diferencias. Devuelve las diferencias.
+    actual = {
+        r.quote_id: r for r in db.query(
+            Expense.quote_id,
+            func.coalesce(func.sum(Expense.amount_gtq), 0).label("gtq"),
+            func.coalesce(func.sum(Expense.amount_usd), 0).label("usd"),
+            func.count(Expense.id).label("n")
+        ).group_by(Expense.quote_id).all()
+    }
+    mismatches = []
+    for q in db.query(Quote.id, Quote.spent_gtq, Quote.spent_usd, Quote.expense_count).all():
+        real = actual.get(q.id)
+        gtq, usd, n = (real.gtq, real.usd, real.n) if real else (0.0, 0.0, 0)
+        if to_cents(gtq) != to_cents(q.spent_gtq or 0.0) or to_cents(usd) != to_cents(q.spent_usd or 0.0) or n != (q.expense_count or 0):
+            mismatches.append({"id": q.id, "spent_gtq": gtq, "spent_usd": usd, "expense_count": n})
+
+    if fix and mismatches:
+        db.execute(update(Quote), mismatches)
+        db.commit()
+    return mismatches
+
+# ==============================================================================
+# RECOMENDACIÓN DE OI (SALDO DISPONIBLE DEL AÑO)
+# ==============================================================================
+# Disponible = presupuesto anual - gasto real del año - comprometido
+# (lo que falta por gastar de las actividades EJECUTADAS ya asignadas a la OI).
+# Una sola consulta con dos subconsultas agrupadas; montos en centavos.
+
+def oi_available_budget(db: Session, year):
+    cents = lambda col: type_coerce(col, Integer)
+    spent = (
+        select(Expense.oi_id, func.sum(cents(Expense.amount_usd)).label("cents"))
+        .where(Expense.year == year)
+        .group_by(Expense.oi_id)
+        .subquery()
+    )
+    pending = cents(Quote.total_cost_usd) - cents(Quote.spent_usd)
+    committed = (
+        select(Quote.oi_id, func.sum(case((pending > 0, pending), else_=0)).label("cents"))
+        .where(Quote.status == "EJECUTADA", Quote.oi_id.isnot(None))
+        .group_by(Quote.oi_id)
+        .subquery()
+    )
+    rows = (
+        db.query(
+            OI,
+            func.coalesce(cents(OI.annual_budget_usd), 0),
+            func.coalesce(spent.c.cents, 0),
+            func.coalesce(committed.c.cents, 0),
+        )
+        .outerjoin(spent, spent.c.oi_id == OI.id)
+        .outerjoin(committed, committed.c.oi_id == OI.id)
+        .filter(OI.is_active == True)
+        .all()
+    )
+    return {
+        oi.id: {"oi": oi, "budget": int(b), "spent": int(sp), "committed": int(c), "available": int(b) - int(sp) - int(c)}
+        for oi, b, sp, c in rows
+    }
+
+def rank_ois_for_quote(quote, budgets, available=None):
+    # Candidatas: OIs del mall de la cotización (o todas si no tiene). Primero las
+    # que alcanzan, de menor sobrante a mayor (mejor ajuste: las OIs grandes
+    # quedan libres para actividades grandes); luego las que no alcanzan.
+    available = available or {oi_id: b["available"] for oi_id, b in budgets.items()}
+    cost = to_cents(quote.total_cost_usd or 0.0)
+    candidates = [b for b in budgets.values() if not quote.mall_id or b["oi"].mall_id == quote.mall_id]
+    return sorted(
+        candidates,
+        key=lambda b: (0, available[b["oi"].id] - cost) if available[b["oi"].id] >= cost else (1, -available[b["oi"].id])
+    )
+
+def plan_oi_assignments(quotes, budgets):
+    # Asignación masiva: de la actividad más cara a la más barata, descontando el
+    # saldo de cada OI a medida que se asigna (dos actividades no usan el mismo saldo)
+    available = {oi_id: b["available"] for oi_id, b in budgets.items()}
+    plan = {}
+    for q in sorted(quotes, key=lambda q: -(q.total_cost_usd or 0.0)):
+        ranked = rank_ois_for_quote(q, budgets, available)
+        best = ranked[0] if ranked and available[ranked[0]["oi"].id] >= to_cents(q.total_cost_usd or 0.0) else None
+        plan[q.id] = best["oi"] if best else None
+        if best:
+            available[best["oi"].id] -= to_cents(q.total_cost_usd or 0.0)
+    return plan
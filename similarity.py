@@ -0,0 +1,135 @@
+import threading
+import numpy as np
+from sqlalchemy.orm import Session
+from models import Quote, QuoteLine
+
+# ==============================================================================
+# COTIZACIONES SIMILARES (COMPOSICIÓN DE INSUMOS)
+# ==============================================================================
+# Cada cotización histórica es un vector disperso insumo -> cantidad
+# (log(1 + personas x unidades), normalizado). El índice guarda las entradas
+# no-cero ordenadas por insumo (formato CSC): una consulta solo recorre las
+# cotizaciones que comparten algún insumo y suma con np.bincount.
+# Las cotizaciones aprobadas ya no cambian de líneas, así que el índice se
+# actualiza de forma incremental: solo se cargan las que aún no conoce.
+
+HISTORICAL_STATUSES = ["APROBADA", "EJECUTADA", "LIQUIDADA"]
+LOAD_CHUNK = 5000 # ids por consulta al cargar (límite de parámetros de SQLite)
+
+def _amounts(qty, units):
+    return np.maximum(np.asarray(qty, float) * np.asarray(units, float), 0.0)
+
+class QuoteSimilarityIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.quote_ids = np.zeros(0, dtype=np.int64)   # fila -> id de cotización
+        self.active = np.zeros(0, dtype=bool)          # filas dadas de baja quedan en False
+        self._rows = np.zeros(0, dtype=np.int64)       # entradas no-cero (COO)
+        self._cols = np.zeros(0, dtype=np.int64)       # insumo_id
+        self._vals = np.zeros(0, dtype=float)
+        self._csc = None                               # (insumos, inicios, filas, valores)
+
+    def refresh(self, db: Session):
+        # Alta de cotizaciones históricas nuevas / baja de las que salieron
+        current = np.array(
+            [r[0] for r in db.query(Quote.id).filter(Quote.status.in_(HISTORICAL_STATUSES))], dtype=np.int64
+        )
+        with self._lock:
+            known = self.quote_ids
+            self.active = np.isin(known, current)
+            new_ids = np.setdiff1d(current, known)
+            if new_ids.size:
+                self._append(db, new_ids)
+        return int(new_ids.size)
+
+    def _append(self, db, new_ids):
+        lines = []
+        for start in range(0, new_ids.size, LOAD_CHUNK):
+            lines += (
+                db.query(QuoteLine.quote_id, QuoteLine.insumo_id, QuoteLine.qty_personas, QuoteLine.units_value)
+                .filter(QuoteLine.quote_id.in_(new_ids[start:start + LOAD_CHUNK].tolist()), QuoteLine.insumo_id.isnot(None))
+                .all()
+            )
+        offset = self.quote_ids.size
+        self.quote_ids = np.concatenate([self.quote_ids, new_ids])
+        self.active = np.concatenate([self.active, np.ones(new_ids.size, dtype=bool)])
+        if not lines:
+            return
+        qids = np.array([l.quote_id for l in lines], dtype=np.int64)
+        rows = offset + np.searchsorted(new_ids, qids) # new_ids viene ordenado (setdiff1d)
+        cols = np.array([l.insumo_id for l in lines], dtype=np.int64)
+        amounts = _amounts([l.qty_personas or 0 for l in lines], [l.units_value or 0 for l in lines])
+        rows, cols, amounts = _merge_duplicates(rows, cols, amounts)
+        vals = np.log1p(amounts)
+
+        # Normalización L2 por cotización (coseno = producto punto)
+        norms = np.sqrt(np.bincount(rows - offset, weights=vals ** 2, minlength=new_ids.size))
+        vals = vals / np.where(norms[rows - offset] > 0, norms[rows - offset], 1.0)
+
+        self._rows = np.concatenate([self._rows, rows])
+        self._cols = np.concatenate([self._cols, cols])
+        self._vals = np.concatenate([self._vals, vals])
+        self._csc = None
+
+    def _columns(self):
+        if self._csc is None:
+            order = np.argsort(self._cols, kind="stable")
+            cols = self._cols[order]
+            insumos, starts = np.unique(cols, return_index=True)
+            self._csc = (insumos, np.append(starts, cols.size), self._rows[order], self._vals[order])
+        return self._csc
+
+    def query(self, lines, k=5, exclude_id=None):
+        # lines: [(insumo_id, personas, unidades)] -> [(quote_id, similitud)] de mayor a menor
+        if not lines:
+            return []
+        _, q_cols, q_amounts = _merge_duplicates(
+            np.zeros(len(lines), dtype=np.int64),
+            np.array([l[0] for l in lines], dtype=np.int64),
+            _amounts([l[1] for l in lines], [l[2] for l in lines])
+        )
+        q_vals = np.log1p(q_amounts)
+        norm = np.sqrt((q_vals ** 2).sum())
+        if norm == 0:
+            return []
+        q_vals = q_vals / norm
+
+        with self._lock:
+            insumos, bounds, rows, vals = self._columns()
+            if insumos.size == 0:
+                return []
+            pos = np.searchsorted(insumos, q_cols).clip(max=insumos.size - 1)
+            hit = insumos[pos] == q_cols
+            if not hit.any():
+                return []
+            segments = [(bounds[p], bounds[p + 1], w) for p, w in zip(pos[hit], q_vals[hit])]
+            cand_rows = np.concatenate([rows[a:b] for a, b, _ in segments])
+            cand_vals = np.concatenate([vals[a:b] * w for a, b, w in segments])
+            scores = np.bincount(cand_rows, weights=cand_vals, minlength=self.quote_ids.size)
+            scores[~self.active] = 0.0
+            quote_ids = self.quote_ids
+        if exclude_id is not None:
+            scores[quote_ids == exclude_id] = 0.0
+
+        k = min(k, int((scores > 0).sum()))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(quote_ids[i]), float(scores[i])) for i in top]
+
+def _merge_duplicates(rows, cols, vals):
+    # Un insumo repetido en la misma cotización suma sus cantidades
+    if rows.size == 0:
+        return rows, cols, vals
+    keys = np.stack([rows, cols], axis=1)
+    uniq, inverse = np.unique(keys, axis=0, return_inverse=True)
+    merged = np.bincount(inverse.ravel(), weights=vals, minlength=len(uniq))
+    return uniq[:, 0], uniq[:, 1], merged
+
+_INDEX = QuoteSimilarityIndex()
+
+def similar_quotes(db: Session, lines, k=5, exclude_id=None):
+    # Índice compartido por el proceso; cada consulta solo agrega lo nuevo
+    _INDEX.refresh(db)
+    return _INDEX.query(lines, k=k, exclude_id=exclude_id)
@@ -0,0 +1,27 @@
+import io
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import catalogs  # noqa: E402
+
+def _latin1_after_sample(rows_before):
+    # Muestra 100% ASCII; el primer byte Latin-1 ("Diseño") aparece después de SNIFF_BYTES
+    head = b"nombre,costo,unidad,cobro,categoria\n"
+    before = b"".join(b"Item %d,%d,UNIDAD,FIJO,Cat\n" % (i, i) for i in range(rows_before))
+    assert len(head + before) > catalogs.SNIFF_BYTES
+    latin = "Diseño gráfico,5,UNIDAD,FIJO,Diseño\n".encode("latin-1")
+    after = b"".join(b"Post %d,1,UNIDAD,FIJO,Cat\n" % i for i in range(50))
+    return head + before + latin + after
+
+def test_latin1_after_ascii_sample_falls_back_without_losing_rows():
+    data = _latin1_after_sample(rows_before=5000)
+    chunks = catalogs.read_insumos_file(io.BytesIO(data), "insumos.csv", chunksize=1000)
+    df = pd.concat(list(chunks))
+
+    assert len(df) == 5000 + 1 + 50
+    assert df["name"].is_unique # las filas ya entregadas no se repiten al reanudar
+    assert "Diseño gráfico" in df["name"].tolist()
+    assert df["name"].iloc[-1] == "Post 49"
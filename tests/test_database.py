@@ -0,0 +1,78 @@
+import gc
+import importlib
+import os
+import sys
+import threading
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+@pytest.fixture
+def db_module(tmp_path, monkeypatch):
+    # La URL de SQLite es relativa (./local_backup.db): se trabaja en una carpeta temporal
+    monkeypatch.chdir(tmp_path)
+    for name in ("database", "models"):
+        sys.modules.pop(name, None)
+    database = importlib.import_module("database")
+    models = importlib.import_module("models")
+    database.Base.metadata.create_all(bind=database.engine, tables=[models.Mall.__table__])
+    monkeypatch.setattr(database, "WRITER_TIMEOUT", 2)
+    yield database, models
+    database.engine.dispose()
+    database.read_engine.dispose()
+    for name in ("database", "models"):
+        sys.modules.pop(name, None)
+
+def _abandoned_write(database, models):
+    # Como una página: flush y luego una excepción antes del commit; nadie cierra la sesión
+    db = database.page_db()
+    db.add(models.Mall(name="Abandonado"))
+    db.flush()
+    raise RuntimeError("falla a mitad de la página")
+
+def test_abandoned_session_releases_the_writer(db_module):
+    database, models = db_module
+    with pytest.raises(RuntimeError):
+        _abandoned_write(database, models)
+    gc.collect()
+    assert not database._writer_lock.locked()
+
+    errors = []
+    def other_writer():
+        try:
+            with database.SessionLocal() as db:
+                db.add(models.Mall(name="Siguiente"))
+                db.commit()
+        except Exception as e:
+            errors.append(e)
+    t = threading.Thread(target=other_writer)
+    t.start(); t.join()
+    assert not errors
+
+    with database.SessionLocal() as db:
+        assert [m.name for m in db.query(models.Mall)] == ["Siguiente"]
+
+def test_same_thread_writes_after_abandoned_session(db_module):
+    # Tras st.rerun el mismo hilo vuelve a escribir: el turno abandonado no cuenta como anidado
+    database, models = db_module
+    with pytest.raises(RuntimeError):
+        _abandoned_write(database, models)
+    with database.SessionLocal() as db:
+        db.add(models.Mall(name="Otra vez"))
+        db.commit()
+    assert not database._writer_lock.locked()
+
+def test_nested_write_with_live_session_fails_fast(db_module):
+    database, models = db_module
+    first = database.SessionLocal()
+    first.add(models.Mall(name="Primera"))
+    first.flush()
+    with database.SessionLocal() as second:
+        second.add(models.Mall(name="Segunda"))
+        with pytest.raises(RuntimeError, match="Escritura anidada"):
+            second.flush()
+    first.commit()
+    first.close()
+    assert not database._writer_lock.locked()
@@ -0,0 +1,130 @@
+import time
+from contextlib import contextmanager
+import streamlit as st
+
+# ==============================================================================
+# AYUDAS DE INTERFAZ COMPARTIDAS ENTRE PÁGINAS
+# ==============================================================================
+
+def seen_version(quote, prefix="qv"):
+    # Devuelve la versión de la cotización que el usuario VIO en el render
+    # anterior (la que tenía en pantalla al hacer click) y guarda la actual.
+    key = f"{prefix}_{quote.id}"
+    seen = st.session_state.get(key, quote.version)
+    st.session_state[key] = quote.version
+    return seen
+
+def show_conflict(err):
+    st.warning(f"⚠️ {err} Los datos ya se actualizaron en pantalla: revísalos y vuelve a confirmar.")
+
+def download_artifact(label, artifact_key, file_name, mime, key):
+    # Los bytes se leen del disco SOLO al hacer click (data diferida): la sesión
+    # guarda únicamente la clave, no el archivo.
+    from artifacts import artifact_exists, read_artifact
+    if not artifact_exists(artifact_key):
+        st.caption("🗑️ El archivo ya expiró del almacenamiento. Vuelve a generarlo.")
+        return
+    st.download_button(label, data=lambda: read_artifact(artifact_key), file_name=file_name, mime=mime, key=key, on_click="ignore")
+
+# ==============================================================================
+# COMPUERTA DE ADMISIÓN (OPERACIONES PESADAS SÍNCRONAS)
+# ==============================================================================
+
+@contextmanager
+def admission_gate(op_class):
+    # Espera turno mostrando la posición en cola; si hay sobrecarga o se agota la
+    # espera, avisa y detiene la página en lugar de sumar carga.
+    from governor import get_gate, OverloadError, GATE_TIMEOUT
+    gate = get_gate(op_class)
+    try:
+        ticket = gate.enter()
+    except OverloadError as e:
+        st.warning(f"🚦 {e}")
+        st.stop()
+
+    if ticket is not None:
+        status = st.empty()
+        deadline = time.monotonic() + GATE_TIMEOUT
+        try:
+            while True:
+                status.info(f"🚦 Alta demanda: estás en la posición {gate.position(ticket)} de la cola...")
+                if gate.wait(ticket, 0.5):
+                    break
+                if time.monotonic() > deadline:
+                    gate.abandon(ticket)
+                    status.warning("🚦 El sistema sigue ocupado. Intenta de nuevo en unos minutos.")
+                    st.stop()
+        except BaseException:
+            # Rerun / cierre de la pestaña mientras esperaba: se libera el lugar
+            gate.abandon(ticket)
+            raise
+        status.empty()
+
+    try:
+        yield
+    finally:
+        gate.leave()
+
+def submit_job_or_warn(db, kind, params, state_key):
+    # Encola el trabajo y guarda su id en la sesión; si la cola está llena, avisa
+    from jobs import submit_job
+    from governor import OverloadError
+    try:
+        st.session_state[state_key] = submit_job(db, kind, params, created_by=st.session_state.get("user_id"))
+    except OverloadError as e:
+        st.warning(f"🚦 {e}")
+        return None
+    return st.session_state[state_key]
+
+# ==============================================================================
+# PANEL DE ESTADO DE UN TRABAJO EN SEGUNDO PLANO
+# ==============================================================================
+
+def job_panel(job_id, key):
+    # Mientras el trabajo está activo, el panel se refresca solo (fragmento con
+    # run_every); el resto de la página no se vuelve a ejecutar.
+    from database import SessionLocal
+    from models import Job
+    from jobs import ACTIVE_STATUSES
+    with SessionLocal() as s:
+        job_status = s.query(Job.status).filter(Job.id == job_id).scalar()
+    if job_status is None:
+        return
+    active = job_status in ACTIVE_STATUSES
+    st.fragment(_job_panel_body, run_every=2 if active else None)(job_id, key, active)
+
+def _job_panel_body(job_id, key, was_active):
+    from database import SessionLocal
+    from models import Job
+    from jobs import JOB_LABELS, ACTIVE_STATUSES, cancel_job, retry_job, queue_position
+
+    with SessionLocal() as s:
+        job = s.get(Job, job_id)
+        label = JOB_LABELS.get(job.kind, job.kind)
+
+        if job.status in ACTIVE_STATUSES:
+            if job.status == "PENDIENTE" and job.run_after:
+                st.progress(0.0, text=f"🔁 {label}: {job.message}") # Esperando para reintentar
+            elif job.status == "PENDIENTE":
+                st.progress(0.0, text=f"🚦 {label}: en cola (posición {queue_position(s, job)})")
+            else:
+                st.progress(job.progress or 0.0, text=f"⏳ {label}: {job.message or job.status}")
+            if st.button("✖️ Cancelar", key=f"cancel_{key}"):
+                cancel_job(s, job_id)
+                st.rerun(scope="fragment")
+        elif job.status == "COMPLETADO":
+            st.success(f"✅ {label}: {job.message}")
+            if job.error:
+                with st.expander("Ver detalle de filas con error / advertencias"):
+                    st.text(job.error)
+            if job.result_key:
+                download_artifact(f"⬇️ Descargar {job.result_name}", job.result_key, job.result_name, job.result_mime, key=f"dl_{key}")
+        else:
+            st.error(f"❌ {label}: {job.message}")
+            if st.button("🔁 Reintentar", key=f"retry_{key}"):
+                retry_job(s, job_id)
+                st.rerun()
+
+        if was_active and job.status not in ACTIVE_STATUSES:
+            # Terminó: rerun completo para dejar de consultar y refrescar tablas
+            st.rerun()